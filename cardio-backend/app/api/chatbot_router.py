@@ -1,7 +1,10 @@
-import os
-import google.generativeai as genai
+import asyncio, json, re, unicodedata
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from app.core.cache import TTLCache, MISSING
+from app.core.config import settings
+from app.services.llm_client import LLMUnavailable, make_client
 
 # Pydantic model để validate dữ liệu đầu vào
 class ChatRequest(BaseModel):
@@ -15,35 +18,41 @@ router = APIRouter(
     tags=["Chatbot"]
 )
 
-# Cấu hình Gemini API
-try:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-except Exception as e:
-    print(f"Error initializing Gemini model: {e}")
-    model = None
+# Client LLM bất đồng bộ (services/llm_client.py) — SDK Gemini chỉ được import ở request đầu tiên
+# (pod chỉ phục vụ /auth, /iot không phải import google.generativeai)
+llm = make_client(settings.LLM_BACKEND, settings.LLM_MODEL)
+# giới hạn số lời gọi LLM đồng thời (quota API); request vượt quá chờ slot trong khuôn khổ timeout
+_llm_slots = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+# câu trả lời theo câu hỏi: khoá "exact" (nguyên văn) và "norm" (chuẩn hoá) — câu hỏi FAQ lặp lại không gọi LLM
+_reply_cache = TTLCache(maxsize=settings.LLM_CACHE_SIZE, ttl=settings.LLM_CACHE_TTL_S)
+_chat_stats = {"llm_calls": 0, "exact_hits": 0, "norm_hits": 0, "timeouts": 0, "errors": 0, "in_flight": 0}
 
-# Endpoint này sẽ có đường dẫn là /api/chatbot/
-@router.post("/", status_code=status.HTTP_200_OK)
-async def handle_chat(request: ChatRequest):
-    if model is None:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="AI service is not configured correctly."
-        )
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
 
-    user_message = request.message
-    if not user_message:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Message is required"
-        )
+def normalize_question(text: str) -> str:
+    """Chữ thường, bỏ dấu câu và khoảng trắng thừa (giữ dấu tiếng Việt: "tim" khác "tìm")."""
+    text = unicodedata.normalize("NFC", text).casefold()
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text)).strip()
+
+def _cached_reply(message: str):
+    hit = _reply_cache.get(("exact", message))
+    if hit is not MISSING:
+        _chat_stats["exact_hits"] += 1
+        return hit
+    hit = _reply_cache.get(("norm", normalize_question(message)))
+    if hit is not MISSING:
+        _chat_stats["norm_hits"] += 1
+        _reply_cache.set(("exact", message), hit)
+    return hit
+
+def _store_reply(message: str, reply: str):
+    _reply_cache.set(("exact", message), reply)
+    _reply_cache.set(("norm", normalize_question(message)), reply)
 
+def _build_prompt(user_message: str) -> str:
     # Prompt Engineering: Hướng dẫn AI cách trả lời
-    prompt = f"""
+    return f"""
     Bạn là một trợ lý AI chuyên về sức khỏe tim mạch tên là CardioAI.
     Hãy trả lời câu hỏi của người dùng một cách chính xác, ngắn gọn và dễ hiểu.
     Luôn luôn nhắc nhở người dùng rằng thông tin này chỉ mang tính tham khảo và họ cần phải tham khảo ý kiến của bác sĩ chuyên khoa để có chẩn đoán chính xác.
@@ -52,13 +61,103 @@ async def handle_chat(request: ChatRequest):
     Câu hỏi của người dùng: "{user_message}"
     """
 
+def _validate(request: ChatRequest) -> str:
+    if not request.message or not request.message.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Message is required"
+        )
+    return request.message
+
+# Endpoint này sẽ có đường dẫn là /api/chatbot/
+@router.post("/", status_code=status.HTTP_200_OK)
+async def handle_chat(request: ChatRequest):
+    user_message = _validate(request)
+    hit = _cached_reply(user_message)
+    if hit is not MISSING:
+        return {"reply": hit, "cached": True}
+
+    _chat_stats["in_flight"] += 1
     try:
-        response = model.generate_content(prompt)
-        return {"reply": response.text}
+        # timeout tính cả thời gian chờ slot
+        async with asyncio.timeout(settings.LLM_TIMEOUT_S):
+            async with _llm_slots:
+                _chat_stats["llm_calls"] += 1
+                reply = await llm.generate(_build_prompt(user_message))
+    except LLMUnavailable as e:
+        print(f"Error initializing LLM client: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is not configured correctly."
+        )
+    except TimeoutError:
+        _chat_stats["timeouts"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="The AI service took too long to respond."
+        )
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
+        _chat_stats["errors"] += 1
+        print(f"Error calling LLM API: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while communicating with the AI service."
         )
+    finally:
+        _chat_stats["in_flight"] -= 1
+    _store_reply(user_message, reply)
+    return {"reply": reply, "cached": False}
+
+def _sse(data: dict, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _stream_reply(user_message: str):
+    hit = _cached_reply(user_message)
+    if hit is not MISSING:
+        yield _sse({"delta": hit})
+        yield _sse({"cached": True}, event="done")
+        return
+    parts = []
+    _chat_stats["in_flight"] += 1
+    try:
+        async with asyncio.timeout(settings.LLM_TIMEOUT_S):
+            async with _llm_slots:
+                _chat_stats["llm_calls"] += 1
+                async for delta in llm.stream(_build_prompt(user_message)):
+                    parts.append(delta)
+                    yield _sse({"delta": delta})
+    except LLMUnavailable as e:
+        print(f"Error initializing LLM client: {e}")
+        yield _sse({"detail": "AI service is not configured correctly."}, event="error")
+        return
+    except TimeoutError:
+        _chat_stats["timeouts"] += 1
+        yield _sse({"detail": "The AI service took too long to respond."}, event="error")
+        return
+    except Exception as e:
+        _chat_stats["errors"] += 1
+        print(f"Error calling LLM API: {e}")
+        yield _sse({"detail": "An error occurred while communicating with the AI service."}, event="error")
+        return
+    finally:
+        _chat_stats["in_flight"] -= 1
+    _store_reply(user_message, "".join(parts))
+    yield _sse({"cached": False}, event="done")
+
+# /api/chatbot/stream: Server-Sent Events — mỗi "data: {"delta": ...}" là 1 đoạn câu trả lời,
+# kết thúc bằng "event: done" (hoặc "event: error"); client hiển thị dần thay vì chờ cả câu trả lời
+@router.post("/stream")
+async def handle_chat_stream(request: ChatRequest):
+    user_message = _validate(request)
+    return StreamingResponse(
+        _stream_reply(user_message),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
+@router.get("/stats")
+def chat_stats():
+    """Lời gọi LLM, cache hit (nguyên văn / chuẩn hoá), timeout, lỗi, số chat đang chạy."""
+    return dict(_chat_stats, backend=llm.name, max_concurrency=settings.LLM_MAX_CONCURRENCY,
+                cache=_reply_cache.stats())
@@ -1,22 +1,15 @@
 from fastapi import APIRouter, Depends
-from fastapi.security import OAuth2PasswordBearer
-from jose import jwt, JWTError
-from app.core.config import settings
+from app.core.auth import get_current_user, auth_cache_stats, require_admin
 from app.models.user_model import User
 from app.schemas.user_schema import UserOut
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
-
 router = APIRouter(prefix="/users", tags=["Users"])
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        user = await User.get(payload.get("sub"))
-        return user
-    except JWTError:
-        return None
-
 @router.get("/me", response_model=UserOut)
 async def me(user: User = Depends(get_current_user)):
     return UserOut(id=str(user.id), email=user.email, roles=user.roles)
+
+@router.get("/auth_stats", dependencies=[Depends(require_admin)])
+def auth_stats():
+    """Hit rate của cache token -> claims và cache user document (core/auth.py)."""
+    return auth_cache_stats()
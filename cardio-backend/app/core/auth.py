@@ -0,0 +1,102 @@
+# app/core/auth.py
+# Dependency xác thực dùng chung (/users, và /ml, /iot khi API_AUTH_REQUIRED):
+# - cache token -> claims đã verify (TTL không vượt quá exp của token) → không decode/verify lại mỗi request;
+# - cache LRU user document theo id (TTL ngắn) → không round-trip Mongo mỗi request;
+#   nơi nào sửa user phải gọi invalidate_user(id).
+# require_admin: endpoint vận hành (/metrics, /debug/profile, /users/auth_stats).
+import hmac, time
+from typing import Optional
+from fastapi import Depends, HTTPException, WebSocketException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import jwt, JWTError
+from starlette.requests import HTTPConnection
+from app.core.cache import TTLCache, MISSING
+from app.core.config import settings
+from app.models.user_model import User
+
+_claims_cache = TTLCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_TOKEN_CACHE_TTL_S)
+_user_cache = TTLCache(maxsize=settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_USER_CACHE_TTL_S)
+
+
+def _unauthorized(conn: HTTPConnection, detail: str):
+    if conn.scope["type"] == "websocket":
+        return WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=detail)
+    return HTTPException(status.HTTP_401_UNAUTHORIZED, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+class BearerToken(OAuth2PasswordBearer):
+    """OAuth2PasswordBearer dùng được cả cho WebSocket: header Authorization, hoặc ?token= (trình duyệt không set header WS được)."""
+
+    async def __call__(self, conn: HTTPConnection) -> str:
+        scheme, _, token = conn.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            token = conn.query_params.get("token") if conn.scope["type"] == "websocket" else None
+        if not token:
+            raise _unauthorized(conn, "Not authenticated")
+        return token
+
+
+oauth2_scheme = BearerToken(tokenUrl="/auth/login")
+
+
+def decode_token(token: str) -> Optional[dict]:
+    """Claims của token hợp lệ (có cache), None nếu sai chữ ký / hết hạn."""
+    claims = _claims_cache.get(token)
+    if claims is not MISSING:
+        # entry không sống quá exp, nhưng kiểm lại cho chắc khi đồng hồ lệch ranh giới
+        if claims.get("exp") is None or claims["exp"] > time.time():
+            return claims
+        _claims_cache.pop(token)
+    try:
+        claims = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        return None
+    ttl = settings.AUTH_TOKEN_CACHE_TTL_S
+    if claims.get("exp") is not None:
+        ttl = min(ttl, float(claims["exp"]) - time.time())
+    if ttl > 0:
+        _claims_cache.set(token, claims, ttl=ttl)
+    return claims
+
+
+async def load_user(user_id: str) -> Optional[User]:
+    """User theo id, qua cache LRU. Document trả về dùng chung giữa các request: chỉ đọc."""
+    user = _user_cache.get(user_id)
+    if user is not MISSING:
+        return user
+    try:
+        user = await User.get(user_id)
+    except Exception:   # id không phải ObjectId hợp lệ
+        return None
+    if user is not None:
+        _user_cache.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id) -> None:
+    """Gọi sau mọi thay đổi user (mật khẩu, roles, xoá) để request sau đọc lại từ Mongo."""
+    _user_cache.pop(str(user_id))
+
+
+async def get_current_user(conn: HTTPConnection, token: str = Depends(oauth2_scheme)) -> User:
+    claims = decode_token(token)
+    if claims is None or not claims.get("sub"):
+        raise _unauthorized(conn, "Invalid or expired token")
+    user = await load_user(str(claims["sub"]))
+    if user is None:
+        raise _unauthorized(conn, "User not found")
+    return user
+
+
+async def require_admin(conn: HTTPConnection, token: str = Depends(oauth2_scheme)) -> Optional[User]:
+    """User có role "admin", hoặc token đúng OPS_TOKEN (scraper không đăng nhập được; trả về None)."""
+    if settings.OPS_TOKEN and hmac.compare_digest(token.encode(), settings.OPS_TOKEN.encode()):
+        return None
+    user = await get_current_user(conn, token)
+    if "admin" not in (user.roles or []):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return user
+
+
+def auth_cache_stats() -> dict:
+    return {"tokens": _claims_cache.stats(), "users": _user_cache.stats()}
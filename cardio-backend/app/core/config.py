@@ -5,9 +5,92 @@ class Settings(BaseSettings):
     JWT_SECRET: str
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRE_MINUTES: int = 30
+    # cache xác thực (core/auth.py): token -> claims (TTL không vượt exp), user document theo id
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_CACHE_TTL_S: float = 300.0
+    AUTH_USER_CACHE_SIZE: int = 5000
+    AUTH_USER_CACHE_TTL_S: float = 60.0
+    # True: /ml và /iot (kể cả WebSocket, token qua ?token=) yêu cầu Bearer token
+    API_AUTH_REQUIRED: bool = False
+    # bcrypt (core/security.py): cost (log2 số vòng), số thread hash song song, số việc chờ tối đa (quá → 503)
+    BCRYPT_ROUNDS: int = 12
+    BCRYPT_MAX_THREADS: int = 2
+    BCRYPT_MAX_PENDING: int = 256
     MQTT_HOST: str = "localhost"
     MQTT_PORT: int = 1883
     MQTT_ENABLED: bool = True
+    # ghi vitals theo lô (services/vital_writer.py): flush khi đủ BATCH_SIZE hoặc sau FLUSH_MS
+    IOT_WRITE_BATCH_SIZE: int = 500
+    IOT_WRITE_FLUSH_MS: float = 200.0
+    IOT_WRITE_MAX_QUEUE: int = 20000
+    IOT_WRITE_MAX_RETRIES: int = 3
+    # số message tối đa chờ gửi trên 1 WebSocket vitals; đầy → bỏ message cũ nhất
+    IOT_WS_QUEUE_SIZE: int = 64
+    # bảng vital mới nhất dùng chung giữa các worker (services/vitals_latest.py): tiền tố tên block shared memory
+    # ("" = bảng riêng từng process), id lượt chạy ghép vào tên ("" = pid master uvicorn; đặt khi chạy nhiều
+    # deployment/test trên 1 máy dưới cùng 1 process cha), số bệnh nhân tối đa, chu kỳ quét log của worker khác
+    IOT_LATEST_SHM_NAME: str = "cardio_latest"
+    IOT_LATEST_INSTANCE: str = ""
+    IOT_LATEST_MAX_PATIENTS: int = 8192
+    IOT_LATEST_WATCH_MS: float = 50.0
+    # thống kê trượt (services/vitals_stats.py): số bệnh nhân tối đa trong bộ nhớ, độ rộng block (giây)
+    IOT_STATS_MAX_PATIENTS: int = 2048
+    IOT_STATS_BLOCK_S: int = 15
+    # lưu trữ cột (services/vitals_archive.py): vitals cũ hơn AFTER_DAYS gom thành chunk theo ngày.
+    # Mặc định TẮT: job XOÁ vitals thô đã gom (collection vitals chỉ còn AFTER_DAYS ngày gần nhất, dữ liệu cũ
+    # chỉ đọc được qua chunk) → chỉ bật có chủ đích, sau khi đã backup / cập nhật mọi chỗ đọc thẳng collection vitals
+    ARCHIVE_ENABLED: bool = False
+    ARCHIVE_AFTER_DAYS: float = 7
+    ARCHIVE_INTERVAL_S: float = 3600
+    ARCHIVE_MAX_DAYS_PER_RUN: int = 50
+    # chấm lại rủi ro CVD từ vitals (services/risk_stream.py): chu kỳ gom lô, ngưỡng đổi huyết áp (mmHg),
+    # giãn cách tối thiểu giữa 2 lần chấm 1 bệnh nhân, cửa sổ làm mượt sbp/dbp ("1m" | "5m" | "15m")
+    RISK_ENABLED: bool = True
+    RISK_INTERVAL_MS: int = 1000
+    RISK_BP_THRESHOLD: float = 5.0
+    RISK_MIN_INTERVAL_S: float = 60.0
+    RISK_WINDOW: str = "5m"
+    # chatbot (services/llm_client.py): backend "gemini" | "stub", số lời gọi đồng thời, timeout mỗi request,
+    # cache câu trả lời theo câu hỏi (nguyên văn + chuẩn hoá)
+    LLM_BACKEND: str = "gemini"
+    LLM_MODEL: str = "gemini-1.5-flash"
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_TIMEOUT_S: float = 30.0
+    LLM_CACHE_SIZE: int = 1000
+    LLM_CACHE_TTL_S: float = 3600.0
+    # quan sát (core/instrumentation.py, core/profiler.py): /metrics Prometheus, chu kỳ đo lag event loop,
+    # cho phép POST /debug/profile (sampling profiler) — chỉ bật khi cần điều tra
+    METRICS_ENABLED: bool = True
+    METRICS_LOOP_LAG_INTERVAL_MS: float = 250.0
+    PROFILER_ENABLED: bool = False
+    # /metrics, /debug/profile, /users/auth_stats: user role "admin", hoặc Bearer OPS_TOKEN (Prometheus scrape);
+    # rỗng = chỉ admin
+    OPS_TOKEN: str = ""
+    # True: load + warm-up model trong thread nền ngay lúc startup; False: chỉ load khi có request /ml đầu tiên
+    ML_PRELOAD: bool = True
+    # chấm sẵn toàn bộ lưới input của /ml/predict_simple mỗi lần load model (services/ml_grid.py)
+    ML_SIMPLE_GRID: bool = True
+    ML_ENGINE: str = "sklearn"   # "sklearn" | "native" (NumPy tree evaluator, xem services/ml_native.py)
+    # micro-batching cho /ml/predict* (services/ml_batcher.py)
+    ML_BATCH_ENABLED: bool = True
+    ML_BATCH_MAX_SIZE: int = 64
+    ML_BATCH_MAX_WAIT_MS: float = 2.0
+    ML_BATCH_MAX_QUEUE: int = 1024
+    # cache kết quả /ml (prob + SHAP), key theo feature vector + model version
+    ML_CACHE_SIZE: int = 10000
+    ML_CACHE_TTL_S: float = 300.0
+    # số phiên bản model cũ giữ trong RAM để /ml/rollback tức thì
+    ML_KEEP_VERSIONS: int = 3
+    # "pickle": mỗi worker unpickle Pipeline; "mmap": export 1 lần ra ML_MMAP_DIR, worker mở bằng
+    # numpy memmap và dùng chung page read-only (services/ml_mmap.py) — nên bật khi chạy nhiều worker
+    ML_MODEL_FORMAT: str = "pickle"
+    ML_MMAP_DIR: str = "app/ml/mmap"
+    # process pool cho SHAP / chấm batch lớn (services/ml_pool.py): số process (0 = tắt, chạy trong threadpool),
+    # timeout mỗi task (quá → kill + dựng lại pool, 504), số task chờ tối đa (quá → 503), batch chấm điểm tối thiểu
+    ML_POOL_WORKERS: int = 0
+    ML_POOL_TIMEOUT_S: float = 30.0
+    ML_POOL_MAX_PENDING: int = 32
+    ML_POOL_MIN_ROWS: int = 1000
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
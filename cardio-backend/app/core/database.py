@@ -1,10 +1,13 @@
 import motor.motor_asyncio
 from beanie import init_beanie
 from app.models.user_model import User
+from app.models.vital_model import Vital
+from app.models.vital_chunk_model import VitalChunk
+from app.models.patient_profile_model import PatientProfile
 from app.core.config import settings
 
 client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGO_URI)
 db = client.get_default_database()
 
 async def init_db():
-    await init_beanie(database=db, document_models=[User])
+    await init_beanie(database=db, document_models=[User, Vital, VitalChunk, PatientProfile])
@@ -0,0 +1,160 @@
+# app/core/instrumentation.py
+# Đo lường cấp ứng dụng cho /metrics: latency từng route (middleware ASGI thuần, ~vài µs/request),
+# độ trễ event loop (task lấy mẫu định kỳ) và gauge đọc từ các thành phần (hàng đợi, WebSocket, cache).
+import asyncio, time
+from typing import Dict, Optional
+from app.core.metrics import REGISTRY, Histogram
+
+HTTP_MS_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+LOOP_LAG_MS_BUCKETS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class RouteMetricsMiddleware:
+    """
+    Histogram latency theo (method, route template, status class). Route lấy từ endpoint mà router đã
+    khớp (scope["endpoint"]) → nhãn là "/iot/stats/{patient}", không phải path thật (không bùng nổ series);
+    không khớp route nào → "unmatched". Latency tính tới khi gửi xong body (kể cả streaming).
+    """
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+        self._routes: Dict[object, str] = {}
+        self._hists: Dict[tuple, Histogram] = {}
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None:
+            app = scope.get("app")
+            for r in getattr(app, "routes", ()):
+                if getattr(r, "endpoint", None) is endpoint:
+                    path = r.path
+                    break
+            else:
+                path = "unmatched"
+            self._routes[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            key = (scope["method"], self._route_path(scope), f"{status[0] // 100}xx")
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = REGISTRY.histogram(
+                    "http_request_duration_ms", HTTP_MS_BUCKETS, "latency HTTP theo route (ms)",
+                    method=key[0], route=key[1], status=key[2])
+            h.observe((time.perf_counter() - t0) * 1000.0)
+
+
+class LoopLagMonitor:
+    """Ngủ interval rồi đo lượng thức dậy trễ: > 0 đáng kể nghĩa là có code chặn event loop."""
+
+    def __init__(self, interval_ms: float = 250.0):
+        self.interval = max(1.0, float(interval_ms)) / 1000.0
+        self.hist = REGISTRY.histogram("event_loop_lag_ms", LOOP_LAG_MS_BUCKETS, "độ trễ thức dậy của event loop (ms)")
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+        REGISTRY.gauge("event_loop_lag_last_ms", lambda: self.last_ms, "độ trễ event loop của lần đo gần nhất (ms)")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, (time.perf_counter() - t0 - self.interval) * 1000.0)
+            self.last_ms = lag
+            self.max_ms = max(self.max_ms, lag)
+            self.hist.observe(lag)
+
+
+def register_app_metrics():
+    """Gauge/counter đọc từ stats() của các thành phần lúc scrape (không tốn gì trên đường nóng)."""
+    from app.api import chatbot_router
+    from app.core import auth, security
+    from app.routers import ml
+    from app.services import iot_mqtt
+
+    w = iot_mqtt.writer
+    REGISTRY.register(w.flush_ms)
+    REGISTRY.register(w.batch_rows)
+    REGISTRY.gauge("vitals_write_queue_depth", lambda: len(w._buf), "số vital đang chờ ghi Mongo")
+    REGISTRY.counter("vitals_written_total", lambda: w.written, "số vital đã ghi Mongo")
+    REGISTRY.counter("vitals_dropped_total", lambda: {(("reason", "queue_full"),): w.dropped_full,
+                                                      (("reason", "not_running"),): w.dropped_not_running,
+                                                      (("reason", "write_failed"),): w.failed},
+                     "số vital bị bỏ")
+    REGISTRY.counter("vitals_invalid_messages_total", lambda: iot_mqtt.invalid_messages, "payload MQTT không hợp lệ")
+
+    hub = iot_mqtt.hub
+    REGISTRY.gauge("ws_connections", lambda: hub.connections, "số WebSocket vitals đang mở")
+    REGISTRY.gauge("ws_subscriptions", lambda: sum(len(s) for s in hub._subs.values()),
+                   "số cặp (socket, topic) đang theo dõi")
+    REGISTRY.gauge("ws_topics", lambda: len(hub._subs), "số topic (bệnh nhân / stats / risk) có người xem")
+    REGISTRY.counter("ws_messages_dropped_total", lambda: hub.dropped, "message bị bỏ vì client chậm")
+
+    latest = iot_mqtt.latest
+    REGISTRY.gauge("vitals_latest_patients", lambda: latest.stats()["patients"],
+                   "số bệnh nhân trong bảng vital mới nhất (dùng chung giữa worker)")
+    REGISTRY.counter("vitals_latest_remote_ingested_total", lambda: iot_mqtt.latest_watcher.ingested,
+                     "vital do worker khác ghi, được đưa vào thống kê / rủi ro / WebSocket của worker này")
+    REGISTRY.counter("vitals_latest_log_lost_total", lambda: iot_mqtt.latest_watcher.lost,
+                     "entry log bảng latest bị ghi đè trước khi watcher của worker này kịp đọc")
+
+    risk = iot_mqtt.risk
+    REGISTRY.gauge("risk_pending_patients", lambda: len(risk._dirty), "bệnh nhân chờ chấm lại rủi ro")
+    REGISTRY.counter("risk_scored_total", lambda: risk.scored, "số lần chấm lại rủi ro")
+
+    REGISTRY.gauge("ml_batch_queue_depth", lambda: ml._get_batcher().stats()["queue_depth"],
+                   "số request /ml chờ micro-batch")
+    b = ml._get_batcher()
+    REGISTRY.register(b.queue_wait_ms)
+    REGISTRY.register(b.batch_size)
+    def _grid():
+        g = ml.registry.current.simple_grid if ml.registry.current is not None else None
+        return None if g is None else {(("result", "hit"),): g.hits, (("result", "miss"),): g.misses}
+    REGISTRY.counter("ml_simple_grid_lookups_total", _grid, "tra lưới predict_simple (miss → chấm live)")
+    REGISTRY.gauge("ml_pool_pending", lambda: ml.pool.pending, "task ML đang chạy / chờ trong process pool")
+    REGISTRY.gauge("ml_pool_ready_workers", lambda: ml.pool.ready, "worker process đã load model hiện tại")
+    REGISTRY.counter("ml_pool_tasks_total", lambda: {(("result", k),): getattr(ml.pool, k) for k in
+                                                     ("completed", "failed", "rejected", "timeouts", "collateral",
+                                                                "fallbacks")},
+                     "task của process pool ML theo kết quả")
+    REGISTRY.counter("ml_pool_restarts_total", lambda: ml.pool.restarts, "số lần kill + dựng lại process pool")
+    REGISTRY.gauge("ml_model_loaded", lambda: float(ml.registry.current is not None), "1 khi model đã sẵn sàng")
+
+    caches = {"ml_pred": ml._pred_cache, "auth_tokens": auth._claims_cache, "auth_users": auth._user_cache,
+              "chat_replies": chatbot_router._reply_cache}
+    REGISTRY.counter("cache_hits_total", lambda: {(("cache", k),): c.hits for k, c in caches.items()}, "cache hit")
+    REGISTRY.counter("cache_misses_total", lambda: {(("cache", k),): c.misses for k, c in caches.items()}, "cache miss")
+    REGISTRY.gauge("cache_size", lambda: {(("cache", k),): len(c) for k, c in caches.items()}, "số entry trong cache")
+
+    REGISTRY.gauge("bcrypt_pending", lambda: security._hash_stats["pending"], "hash/verify bcrypt đang chạy hoặc chờ")
+    REGISTRY.gauge("llm_in_flight", lambda: chatbot_router._chat_stats["in_flight"], "chat đang gọi LLM")
@@ -0,0 +1,165 @@
+# app/core/metrics.py
+# Histogram đơn giản (bucket cố định, đếm tích luỹ) để theo dõi latency / kích thước batch,
+# registry xuất mọi metric ở định dạng Prometheus cho /metrics.
+import bisect, threading, time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# bucket mặc định cho thời gian (ms)
+LATENCY_MS_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Histogram:
+    def __init__(self, name: str, buckets: Iterable[float], help: str = ""):
+        self.name = name
+        self.help = help
+        self.buckets: List[float] = sorted(float(b) for b in buckets)
+        self._counts = [0] * (len(self.buckets) + 1)   # bucket cuối = +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict:
+        """{"buckets": {le: số mẫu <= le (tích luỹ)}, "count", "sum"} — cùng quy ước với Prometheus."""
+        with self._lock:
+            counts = list(self._counts)
+            total, s = self._count, self._sum
+        cum, out = 0, {}
+        for le, c in zip(self.buckets + [float("inf")], counts):
+            cum += c
+            out["+Inf" if le == float("inf") else f"{le:g}"] = cum
+        return {"buckets": out, "count": total, "sum": s}
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._sum = 0.0
+            self._count = 0
+
+    def time(self) -> "_Timer":
+        """with hist.time(): ... — ghi thời gian khối lệnh (ms)."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe((time.perf_counter() - self.t0) * 1000.0)
+        return False
+
+
+# ---- xuất Prometheus (text exposition format 0.0.4), không cần prometheus_client ----
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _fmt_labels(labels: Labels, extra: str = "") -> str:
+    parts = ['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v != v:
+        return "NaN"
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Registry:
+    """
+    Histogram (tạo tại đây hoặc đăng ký instance sẵn có của các service) + gauge/counter đọc qua callback
+    lúc scrape → đường nóng chỉ tốn 1 lần observe, không cập nhật gauge.
+    """
+
+    def __init__(self, prefix: str = "cardio_"):
+        self.prefix = prefix
+        self._hists: Dict[str, dict] = {}     # name -> {"help", "children": {labels: Histogram}}
+        self._fns: Dict[str, dict] = {}       # name -> {"type", "help", "fn"}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, buckets: Iterable[float] = LATENCY_MS_BUCKETS, help: str = "",
+                  **labels) -> Histogram:
+        """Lấy (hoặc tạo) histogram theo tên + nhãn."""
+        key: Labels = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        fam = self._hists.get(name)
+        h = fam["children"].get(key) if fam is not None else None
+        if h is not None:
+            return h
+        with self._lock:
+            fam = self._hists.setdefault(name, {"help": help, "children": {}})
+            h = fam["children"].get(key)
+            if h is None:
+                h = fam["children"][key] = Histogram(name, buckets, help)
+            return h
+
+    def register(self, hist: Histogram, **labels):
+        """Đưa 1 Histogram do service tự tạo vào /metrics (tên = hist.name)."""
+        key: Labels = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            fam = self._hists.setdefault(hist.name, {"help": hist.help, "children": {}})
+            fam["children"][key] = hist
+
+    def gauge(self, name: str, fn: Callable[[], Any], help: str = ""):
+        """fn() -> số, hoặc {((k, v), ...): số} cho nhiều series. Đăng ký lại cùng tên = ghi đè."""
+        self._fns[name] = {"type": "gauge", "help": help, "fn": fn}
+
+    def counter(self, name: str, fn: Callable[[], Any], help: str = ""):
+        self._fns[name] = {"type": "counter", "help": help, "fn": fn}
+
+    def render(self) -> str:
+        out: List[str] = []
+        for name, fam in sorted(self._hists.items()):
+            full = self.prefix + name
+            out.append(f"# HELP {full} {fam['help']}")
+            out.append(f"# TYPE {full} histogram")
+            for labels, h in list(fam["children"].items()):
+                snap = h.snapshot()
+                for le, c in snap["buckets"].items():
+                    le_label = 'le="%s"' % le
+                    out.append(f"{full}_bucket{_fmt_labels(labels, le_label)} {c}")
+                out.append(f"{full}_sum{_fmt_labels(labels)} {_fmt_value(snap['sum'])}")
+                out.append(f"{full}_count{_fmt_labels(labels)} {snap['count']}")
+        for name, m in sorted(self._fns.items()):
+            full = self.prefix + name
+            try:
+                value = m["fn"]()
+            except Exception:   # 1 nguồn lỗi không làm hỏng cả trang metrics
+                continue
+            if value is None:
+                continue
+            out.append(f"# HELP {full} {m['help']}")
+            out.append(f"# TYPE {full} {m['type']}")
+            series = value.items() if isinstance(value, dict) else [((), value)]
+            for labels, v in series:
+                if v is None:
+                    continue
+                out.append(f"{full}{_fmt_labels(labels)} {_fmt_value(float(v))}")
+        out.append("")
+        return "\n".join(out)
+
+
+REGISTRY = Registry()
+
+# thời gian từng bước inference /ml: features | preprocess | trees | shap
+ML_STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+def ml_stage(stage: str) -> Histogram:
+    return REGISTRY.histogram("ml_stage_ms", ML_STAGE_BUCKETS, "thời gian từng bước inference /ml (ms)", stage=stage)
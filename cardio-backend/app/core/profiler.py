@@ -0,0 +1,78 @@
+# app/core/profiler.py
+# Sampling profiler bật theo yêu cầu (PROFILER_ENABLED): 1 thread chụp stack mọi thread mỗi interval_ms
+# bằng sys._current_frames() trong `seconds` giây, trả về dạng "folded stacks" (mỗi dòng
+# "frame;frame;... count") — đưa thẳng vào flamegraph.pl / speedscope / inferno. Khi không chạy: 0 overhead.
+import os, sys, threading, time
+from collections import Counter
+from typing import Optional
+
+MAX_SECONDS = 120.0
+
+
+class ProfilerBusy(RuntimeError):
+    """Đang có 1 phiên profile khác."""
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.running = False
+        self.sessions = 0
+
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+    def _sample(self, stacks: Counter, skip: int):
+        names_by_id = {t.ident: t.name for t in threading.enumerate()}
+        for tid, frame in sys._current_frames().items():
+            if tid == skip:
+                continue
+            names = []
+            while frame is not None:
+                names.append(self._frame_label(frame))
+                frame = frame.f_back
+            if names:
+                stacks[(names_by_id.get(tid, str(tid)), ";".join(reversed(names)))] += 1
+
+    def capture(self, seconds: float, interval_ms: float = 5.0, idle: bool = False) -> str:
+        """
+        Chạy trên thread hiện tại (gọi qua threadpool). idle=False: bỏ các stack đang chờ
+        (select/epoll/wait/sleep ở đỉnh) để flame graph chỉ còn phần tốn CPU.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("a profiling session is already running")
+        try:
+            self.running = True
+            self.sessions += 1
+            seconds = min(max(0.1, float(seconds)), MAX_SECONDS)
+            interval = max(1.0, float(interval_ms)) / 1000.0
+            stacks: Counter = Counter()
+            me = threading.get_ident()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                self._sample(stacks, me)
+                time.sleep(interval)
+        finally:
+            self.running = False
+            self._lock.release()
+        lines = []
+        for (thread, stack), n in stacks.most_common():
+            if not idle and _is_idle(stack):
+                continue
+            lines.append(f"{thread};{stack} {n}")
+        return "\n".join(lines) + "\n"
+
+
+# frame Python ở đỉnh stack của thread đang chờ (event loop rảnh, worker pool rảnh, Condition.wait)
+_IDLE_LEAVES = ("select (selectors.py", "wait (threading.py", "_wait_for_tstate_lock", "_worker (thread.py",
+                "get (queue.py")
+
+
+def _is_idle(stack: str) -> bool:
+    leaf = stack.rsplit(";", 1)[-1]
+    return leaf.startswith(_IDLE_LEAVES)
+
+
+profiler = SamplingProfiler()
@@ -1,9 +1,25 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from fastapi import HTTPException
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min = max = default: hash có cost khác BCRYPT_ROUNDS (tăng hoặc giảm) bị coi là cũ → rehash khi login
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt tốn hàng trăm ms CPU (và nhả GIL) → chạy trong pool riêng, không chặn event loop,
+# không chiếm threadpool mặc định của FastAPI. Số việc đang chờ có giới hạn: quá → 503 thay vì xếp hàng vô hạn.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.BCRYPT_MAX_THREADS, thread_name_prefix="bcrypt")
+_hash_slots = asyncio.Semaphore(settings.BCRYPT_MAX_THREADS)
+_hash_stats = {"pending": 0, "completed": 0, "failed": 0, "rejected": 0, "rehashed": 0}
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -11,6 +27,40 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password, hashed)
 
+async def _run_hash(fn, *args):
+    if _hash_stats["pending"] >= settings.BCRYPT_MAX_PENDING:
+        _hash_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Too many concurrent logins, retry shortly")
+    _hash_stats["pending"] += 1
+    try:
+        async with _hash_slots:
+            out = await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    except BaseException:   # lỗi passlib (hash hỏng...) hoặc request bị huỷ khi đang chờ
+        _hash_stats["failed"] += 1
+        raise
+    finally:
+        _hash_stats["pending"] -= 1
+    _hash_stats["completed"] += 1
+    return out
+
+async def hash_password_async(password: str) -> str:
+    """hash_password chạy trong pool bcrypt (dùng trong handler async)."""
+    return await _run_hash(pwd_context.hash, password)
+
+async def verify_password_async(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """
+    verify_password chạy trong pool bcrypt. Trả về (đúng mật khẩu, hash mới) — hash mới khác None khi
+    mật khẩu đúng nhưng hash cũ dùng cost khác BCRYPT_ROUNDS; caller lưu lại để nâng cấp dần khi user login.
+    """
+    ok, new_hash = await _run_hash(pwd_context.verify_and_update, password, hashed)
+    if new_hash is not None:
+        _hash_stats["rehashed"] += 1
+    return ok, new_hash
+
+def hash_stats() -> dict:
+    return dict(_hash_stats, rounds=settings.BCRYPT_ROUNDS, threads=settings.BCRYPT_MAX_THREADS,
+                max_pending=settings.BCRYPT_MAX_PENDING)
+
 def create_access_token(data: dict, expires_delta: int = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=expires_delta or settings.JWT_EXPIRE_MINUTES)
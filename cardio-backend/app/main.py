@@ -1,6 +1,12 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.core.auth import get_current_user, require_admin
 from app.core.database import init_db
+from app.core.instrumentation import LoopLagMonitor, RouteMetricsMiddleware, register_app_metrics
+from app.core.metrics import REGISTRY
+from app.core.profiler import ProfilerBusy, profiler
 from app.api import auth, users
 from app.api import chatbot_router
 from app.routers import iot_router
@@ -18,17 +24,98 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# latency theo route cho /metrics (ASGI thuần, ngoài cùng → tính cả CORS)
+if settings.METRICS_ENABLED:
+    app.add_middleware(RouteMetricsMiddleware)
+loop_lag = LoopLagMonitor(interval_ms=settings.METRICS_LOOP_LAG_INTERVAL_MS)
+
 @app.on_event("startup")
 async def on_startup():
     await init_db()
 
+    if settings.METRICS_ENABLED:
+        register_app_metrics()
+        loop_lag.start()
+
+    # process pool ML (ML_POOL_WORKERS > 0): spawn worker khi model active đã có / mỗi lần model đổi
+    ml_router.pool.start(ml_router.registry.current)
+
+    # model ML load + warm-up trong thread nền → app nhận request /auth, /iot ngay
+    if settings.ML_PRELOAD:
+        ml_router.start_background_load()
+
+    # writer theo lô phải chạy trước khi MQTT bắt đầu đẩy message
+    from app.services.iot_mqtt import writer
+    writer.start()
+
+    if settings.ARCHIVE_ENABLED:
+        from app.services.iot_mqtt import claim_archive
+        from app.services.vitals_archive import archive_job
+        if claim_archive():
+            archive_job.start()
+
+    if settings.RISK_ENABLED:
+        from app.services.iot_mqtt import risk
+        await risk.load_profiles()
+        risk.start()
+
+    # nhiều worker: vital mới nhất nằm trong bảng shared memory; watcher đưa vital do worker khác nhận vào
+    # thống kê trượt / rủi ro / WebSocket của worker này, và chỉ 1 worker giữ kết nối MQTT
+    from app.services.iot_mqtt import latest, latest_watcher
+    if latest.shared:
+        latest_watcher.start()
+
     if getattr(settings, "MQTT_ENABLED", False):
-        from app.services.iot_mqtt import start_mqtt
-        start_mqtt(settings.MQTT_HOST, settings.MQTT_PORT)
+        from app.services.iot_mqtt import claim_mqtt, start_mqtt
+        if claim_mqtt():
+            start_mqtt(settings.MQTT_HOST, settings.MQTT_PORT)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    from app.services.iot_mqtt import writer
+    from app.services.iot_mqtt import risk, latest, latest_watcher
+    from app.services.vitals_archive import archive_job
+    await loop_lag.stop()
+    await latest_watcher.stop()
+    await risk.stop()
+    await archive_job.stop()
+    await writer.stop()   # flush nốt vitals còn trong hàng đợi
+    ml_router.pool.stop()
+    latest.close()        # worker cuối cùng (master tắt) unlink block shared memory + file khoá
 
 # Routers
 app.include_router(auth.router)
 app.include_router(users.router)
-app.include_router(iot_router.router)
-app.include_router(ml_router.router)    
-app.include_router(chatbot_router.router, prefix="/api")
\ No newline at end of file
+# API_AUTH_REQUIRED: /iot và /ml dùng chung dependency xác thực (cache claims + user, không hit Mongo mỗi request)
+api_auth = [Depends(get_current_user)] if settings.API_AUTH_REQUIRED else []
+app.include_router(iot_router.router, dependencies=api_auth)
+app.include_router(ml_router.router, dependencies=api_auth)
+app.include_router(chatbot_router.router, prefix="/api")
+
+@app.get("/ready", tags=["Health"])
+def ready():
+    """Readiness probe: 503 tới khi các thành phần bắt buộc sẵn sàng (ML chỉ bắt buộc khi ML_PRELOAD)."""
+    ml_state = ml_router.load_state()
+    ml_ready = ml_state["status"] == "ready"
+    ok = ml_ready or not settings.ML_PRELOAD
+    return JSONResponse(status_code=200 if ok else 503, content={"ready": ok, "ml": ml_state})
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+def metrics():
+    """Prometheus text format: latency route, bước inference ML, hàng đợi, WebSocket, cache, lag event loop."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/debug/profile", tags=["Health"], response_class=PlainTextResponse,
+          dependencies=[Depends(require_admin)])
+async def debug_profile(seconds: float = 10.0, interval_ms: float = 5.0, idle: bool = False):
+    """
+    Chụp mẫu stack mọi thread trong `seconds` giây (chỉ khi PROFILER_ENABLED) → folded stacks cho
+    flamegraph.pl / speedscope. Mỗi lúc 1 phiên; idle=true giữ cả các stack đang chờ.
+    """
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler disabled (PROFILER_ENABLED=false)")
+    try:
+        return await run_in_threadpool(profiler.capture, seconds, interval_ms, idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
@@ -0,0 +1,22 @@
+from beanie import Document
+from pymongo import ASCENDING, IndexModel
+from typing import Optional
+from datetime import datetime
+
+class PatientProfile(Document):
+    """Thông tin tĩnh của bệnh nhân đang theo dõi, ghép với huyết áp từ IoT để chấm rủi ro liên tục."""
+    patient: str
+    age: Optional[float] = None         # ngày tuổi (như CardioFullInput)
+    height: Optional[float] = None
+    weight: Optional[float] = None
+    cholesterol: Optional[float] = None
+    gluc: Optional[float] = None
+    smoke: Optional[float] = None
+    alco: Optional[float] = None
+    active: Optional[float] = None
+    gender: Optional[float] = None
+    updated_at: Optional[datetime] = None
+
+    class Settings:
+        name = "patient_profiles"
+        indexes = [IndexModel([("patient", ASCENDING)], name="patient_1", unique=True)]
@@ -0,0 +1,28 @@
+from beanie import Document
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from typing import Dict, List, Optional
+from datetime import datetime
+
+class VitalChunk(Document):
+    """
+    Vitals đã lưu trữ (cold storage) của 1 bệnh nhân trong 1 ngày UTC, dạng cột nén
+    (mã hoá / giải mã: services/vitals_archive.py).
+    """
+    patient: str
+    day: datetime                   # 00:00 UTC của ngày
+    start_ts: datetime              # ts nhỏ nhất / lớn nhất trong chunk (lọc theo khoảng)
+    end_ts: datetime
+    n: int
+    v: int = 1                      # phiên bản định dạng
+    t0_ms: int                      # ts đầu tiên (ms epoch); ts_delta: zlib(int32 LE, delta ms liên tiếp)
+    ts_delta: bytes
+    cols: Dict[str, bytes]          # hr/spo2/dbp/rr: zlib(uint8), sbp: zlib(uint16); 0 = không có giá trị
+    dicts: Dict[str, List[Optional[str]]]   # mode/source: bảng giá trị ...
+    codes: Dict[str, bytes]                 # ... + zlib(uint8) chỉ số vào bảng
+    pending: Optional[bytes] = None # zlib(_id 12 byte) document gốc vừa gộp, chưa xoá xong (compact_once)
+
+    class Settings:
+        name = "vital_chunks"
+        indexes = [
+            IndexModel([("patient", ASCENDING), ("day", DESCENDING)], name="patient_1_day_-1", unique=True),
+        ]
@@ -1,10 +1,11 @@
-from beanie import Document, Indexed
+from beanie import Document
+from pymongo import ASCENDING, DESCENDING, IndexModel
 from typing import Optional
 from datetime import datetime
 
 class Vital(Document):
-    patient: Indexed(str)          # khóa tìm theo bệnh nhân
-    ts:      Indexed(datetime)     # thời điểm đo
+    patient: str                   # khóa tìm theo bệnh nhân
+    ts:      datetime              # thời điểm đo
     hr: Optional[int] = None
     spo2: Optional[int] = None
     sbp: Optional[int] = None
@@ -15,3 +16,11 @@ class Vital(Document):
 
     class Settings:
         name = "vitals"
+        # mọi truy vấn lịch sử đều là "1 bệnh nhân, khoảng ts, sort theo ts" → 1 index ghép phục vụ
+        # cả filter + range + sort + keyset, không cần sort trong RAM; _id phân định các vital cùng ts cho
+        # con trỏ (ts, _id) của /iot/history. (Index cũ không tự bị xoá trên DB đã có; có thể drop tay:
+        # patient_1, ts_1, patient_1_ts_-1.)
+        indexes = [
+            IndexModel([("patient", ASCENDING), ("ts", DESCENDING), ("_id", DESCENDING)],
+                       name="patient_1_ts_-1__id_-1"),
+        ]
@@ -1,48 +1,303 @@
-from fastapi import APIRouter, WebSocket, Depends, Query
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, WebSocket, Depends, Query, HTTPException, Response
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from app.schemas.vital_schema import VitalIn
-from app.services.iot_mqtt import get_latest
+from app.schemas.patient_profile_schema import PatientProfileIn
+from app.services.iot_mqtt import get_latest, ingest_stats, writer, hub, rolling, risk, publish_vital, stats_topic
+from app.services.risk_stream import risk_topic
 from app.models.vital_model import Vital
+from app.models.patient_profile_model import PatientProfile
+from app.services import vitals_aggregate as agg, vitals_archive
 
 router = APIRouter(prefix="/iot", tags=["iot"])
 
 # Fallback demo: nếu không dùng MQTT, có thể POST trực tiếp payload vào đây để hiển thị realtime & lưu DB
 @router.post("/push")
 async def push_vital(v: VitalIn):
-    # cập nhật "latest" thông qua MQTT service không gọi được → gán tay:
-    from app.services.iot_mqtt import _latest   # type: ignore
-    _latest[v.patient] = v.model_dump()
-    await Vital(**v.model_dump()).insert()
+    # cùng đường realtime với MQTT: latest + thống kê trượt + WebSocket
+    publish_vital(v, v.model_dump(mode="json"))
+    if not writer.running:
+        await Vital(**v.model_dump()).insert()
+    elif not writer.submit(v):
+        raise HTTPException(status_code=503, detail="Vital ingestion queue full, retry shortly")
     return {"ok": True}
 
+@router.get("/stats/{patient}")
+def patient_stats(patient: str):
+    """Thống kê trượt 1/5/15 phút (mean, var, min/max, slope mỗi phút) + điểm cảnh báo sớm."""
+    out = rolling.summary(patient)
+    if out is None:
+        raise HTTPException(status_code=404, detail="No recent vitals for this patient")
+    return out
+
+@router.get("/ingest_stats")
+def ingest_stats_endpoint():
+    """Bộ đếm pipeline ghi vitals: hàng đợi, đã ghi, bị bỏ (backpressure), lỗi, retry."""
+    return ingest_stats()
+
+@router.put("/profile/{patient}")
+async def put_profile(patient: str, profile: PatientProfileIn):
+    """Hồ sơ tĩnh dùng để chấm rủi ro liên tục (ghi đè toàn bộ); điểm được chấm lại ở lượt kế tiếp."""
+    doc = {"patient": patient, **profile.model_dump(), "updated_at": datetime.now(timezone.utc)}
+    await PatientProfile.get_motor_collection().replace_one({"patient": patient}, doc, upsert=True)
+    risk.set_profile(patient, doc)
+    return doc
+
+@router.get("/profile/{patient}")
+async def get_profile(patient: str):
+    doc = await PatientProfile.get_motor_collection().find_one({"patient": patient}, {"_id": 0, "revision_id": 0})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="No profile for this patient")
+    return doc
+
+@router.get("/risk/{patient}")
+def patient_risk(patient: str):
+    """Điểm rủi ro CVD mới nhất từ luồng vitals (hồ sơ + huyết áp đã làm mượt)."""
+    out = risk.latest(patient)
+    if out is None:
+        raise HTTPException(status_code=404, detail="No risk score yet (needs a profile and recent blood pressure)")
+    return out
+
+@router.get("/risk_stats")
+def risk_stats():
+    """Bộ đếm chấm lại rủi ro: số hồ sơ, đang chờ, đã chấm, bỏ qua (đổi nhỏ), hoãn (giãn cách)."""
+    return risk.stats()
+
+# các field có thể trả về từ /history (revision_id của beanie không bao giờ cần)
+HISTORY_FIELDS = ("patient", "ts", "hr", "spo2", "sbp", "dbp", "rr", "mode", "source")
+
 @router.get("/history")
 async def history(
     patient: str,
+    response: Response,
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
-    limit: int = 500
+    limit: int = Query(500, ge=1, le=5000),
+    before_ts: Optional[datetime] = Query(None, description="trang cũ hơn: chỉ lấy ts < before_ts"),
+    before_id: Optional[str] = Query(None, description="đi kèm before_ts: lấy cả các dòng cùng ts đứng sau id này"),
+    after_ts: Optional[datetime] = Query(None, description="trang mới hơn: chỉ lấy ts > after_ts"),
+    after_id: Optional[str] = Query(None, description="đi kèm after_ts: lấy cả các dòng cùng ts đứng trước id này"),
+    fields: Optional[str] = Query(None, description="vd. hr,spo2 (ts + id luôn có); mặc định mọi field"),
 ):
-    q = Vital.find(Vital.patient == patient)
-    if start: q = q.find(Vital.ts >= start)
-    if end:   q = q.find(Vital.ts <= end)
-    q = q.sort(-Vital.ts).limit(limit)
-    items = await q.to_list()
+    """
+    Lịch sử thô, mới nhất trước. Phân trang keyset theo (ts, id) qua index (patient, ts, _id):
+    trang sau dùng header X-Next-Before-Ts + X-Next-Before-Id, trang mới hơn dùng X-Next-After-Ts +
+    X-Next-After-Id của response trước → các vital cùng ts nằm vắt qua 2 trang không bị bỏ sót.
+    Chỉ có *_ts (không *_id): con trỏ theo ts nghiêm ngặt như trước.
+    Chi phí mỗi trang không phụ thuộc độ dài lịch sử (không skip/offset).
+    Vitals đã lưu trữ (VitalChunk) được gộp vào trong suốt; id của chúng có dạng "<patient>@<ts_ms>[.<k>]"
+    và cùng 1 ts chúng đứng trước vitals chưa lưu trữ.
+    """
+    if before_ts is not None and after_ts is not None:
+        raise HTTPException(status_code=400, detail="use either before_ts or after_ts, not both")
+    if (before_id is not None and before_ts is None) or (after_id is not None and after_ts is None):
+        raise HTTPException(status_code=400, detail="before_id / after_id need before_ts / after_ts")
+    names = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(HISTORY_FIELDS)
+    bad = [f for f in names if f not in HISTORY_FIELDS]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"unknown fields {bad}; allowed {list(HISTORY_FIELDS)}")
+
+    # after_ts: lấy các điểm ngay sau con trỏ (sort tăng) rồi đảo lại cho đồng nhất "mới nhất trước"
+    direction = 1 if after_ts is not None else -1
+    ts_cond = {}
+    if start: ts_cond["$gte"] = start
+    if end:   ts_cond["$lte"] = end
+    flt = {"patient": patient}
+    arch_cond, edge = dict(ts_cond), None
+    cursor_ts = before_ts or after_ts
+    cursor_id = before_id if before_ts is not None else after_id
+    strict, loose = ("$lt", "$lte") if direction < 0 else ("$gt", "$gte")
+    if cursor_ts is not None and cursor_id is None:
+        ts_cond[strict] = arch_cond[strict] = cursor_ts
+    elif cursor_ts is not None:
+        # thứ tự tăng trong cùng 1 ts: dòng archive (theo k) rồi tới vitals (theo _id)
+        edge = vitals_archive.parse_row_id(cursor_id)
+        if edge is None:
+            try:
+                oid = ObjectId(cursor_id)
+            except InvalidId:
+                raise HTTPException(status_code=400, detail="invalid cursor id")
+            flt["$or"] = [{"ts": {strict: cursor_ts}}, {"ts": cursor_ts, "_id": {strict: oid}}]
+            arch_cond[loose if direction < 0 else strict] = cursor_ts
+        else:
+            ts_cond[strict if direction < 0 else loose] = cursor_ts
+            arch_cond[loose] = cursor_ts
+    if ts_cond:
+        flt["ts"] = ts_cond
+    projection = {f: 1 for f in names} | {"ts": 1}
+
+    # đọc thẳng motor + projection: bỏ qua dựng Document/validate cho từng dòng
+    cursor = (Vital.get_motor_collection().find(flt, projection)
+              .sort([("ts", direction), ("_id", direction)]).limit(limit))
+    docs = await cursor.to_list(length=limit)
+    for d in docs:
+        d["id"] = str(d.pop("_id"))
+    # archive trả tối đa `limit` dòng theo cùng thứ tự → gộp 2 nguồn rồi cắt lại `limit`
+    archived = await vitals_archive.history_rows(patient, arch_cond, direction, limit, names, edge)
+    if archived:
+        docs = sorted(docs + archived, key=_history_key, reverse=direction == -1)[:limit]
+    if direction == 1:
+        docs.reverse()
+
+    if docs:
+        response.headers["X-Next-After-Ts"] = docs[0]["ts"].isoformat()
+        response.headers["X-Next-After-Id"] = docs[0]["id"]
+        if len(docs) == limit:
+            response.headers["X-Next-Before-Ts"] = docs[-1]["ts"].isoformat()
+            response.headers["X-Next-Before-Id"] = docs[-1]["id"]
     # trả về mới nhất trước (frontend có thể đảo nếu muốn)
-    return [i.model_dump() | {"id": str(i.id)} for i in items]
+    return docs
+
+def _history_key(d: dict):
+    """Thứ tự tăng của /history: (ts, dòng archive theo k trước, vitals theo _id sau)."""
+    edge = vitals_archive.parse_row_id(d["id"])
+    return (d["ts"], 0, edge[1]) if edge is not None else (d["ts"], 1, ObjectId(d["id"]))
+
+@router.get("/archive_stats")
+def archive_stats():
+    """Trạng thái job lưu trữ vitals (số chunk đã ghi, document đã chuyển, lỗi gần nhất)."""
+    return vitals_archive.archive_job.stats()
+
+@router.get("/history/aggregate")
+async def history_aggregate(
+    patient: str,
+    start: Optional[datetime] = Query(None, description="mặc định: end - 24h"),
+    end: Optional[datetime] = Query(None, description="mặc định: bây giờ"),
+    bucket: Optional[str] = Query(None, description="độ rộng bucket: 30s, 1m, 15m, 1h... (mặc định tự chọn theo points, hoặc 1m)"),
+    points: Optional[int] = Query(None, ge=3, le=5000, description="giảm mỗi chỉ số về tối đa N điểm (LTTB)"),
+    fields: Optional[str] = Query(None, description="vd. hr,spo2 (mặc định: hr,spo2,sbp,dbp,rr)"),
+):
+    """
+    min/mean/max theo bucket thời gian cho từng chỉ số, tính trong MongoDB ($dateTrunc + $group).
+    Trả dạng cột theo từng field: {"t": [...], "min": [...], "mean": [...], "max": [...]}.
+    """
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    names = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(agg.VITAL_FIELDS)
+    bad = [f for f in names if f not in agg.VITAL_FIELDS]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"unknown fields {bad}; allowed {list(agg.VITAL_FIELDS)}")
+    if bucket is None:
+        bucket = agg.auto_bucket(start, end, points) if points else "1m"
+    try:
+        unit, bin_size, width_s = agg.parse_bucket(bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if (end - start).total_seconds() / width_s > agg.MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"too many buckets (max {agg.MAX_BUCKETS}); use a wider bucket")
+
+    rows = await Vital.aggregate(agg.bucket_pipeline(patient, start, end, unit, bin_size, names)).to_list()
+    # phần đã lưu trữ: giải nén chunk + bucket bằng NumPy, gộp theo bin với kết quả Mongo
+    cold = await vitals_archive.scan(patient, start, end, names)
+    if len(cold["ts_ms"]):
+        rows = vitals_archive.merge_bucket_rows(rows, vitals_archive.bucket_stats(cold, width_s, names), names)
+    return {
+        "patient": patient, "start": start, "end": end, "bucket": bucket, "bucket_s": width_s,
+        "buckets": len(rows), "fields": agg.to_columns(rows, names, points),
+    }
 
-# WebSocket realtime cho 1 bệnh nhân
+# WebSocket realtime: push mỗi vital mới ngay khi ingest (services/vitals_hub.py), không polling
 from fastapi import WebSocketDisconnect
 import asyncio, json
 
+async def _pump(ws: WebSocket, sub):
+    """Gửi message từ hàng đợi của subscription tới khi socket đóng."""
+    while True:
+        await ws.send_text(await sub.get())
+
+async def _serve(ws: WebSocket, sub, handle_text=None):
+    """Chạy song song: gửi (pump) + nhận (phát hiện disconnect / lệnh subscribe); 1 bên xong là dừng."""
+    async def _recv():
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                return
+            if handle_text is not None and msg.get("text"):
+                await handle_text(msg["text"])
+
+    tasks = [asyncio.create_task(_pump(ws, sub)), asyncio.create_task(_recv())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            exc = t.exception()
+            if exc is not None and not isinstance(exc, (WebSocketDisconnect, RuntimeError)):
+                raise exc
+    finally:
+        for t in tasks:
+            t.cancel()
+        hub.disconnect(sub)
+
+def _topics(patients, stats: bool, risk_: bool = False):
+    out = []
+    for p in patients:
+        out.append(p)
+        if stats:
+            out.append(stats_topic(p))
+        if risk_:
+            out.append(risk_topic(p))
+    return out
+
+def _send_snapshot(sub, patients, stats: bool, risk_: bool = False):
+    """Giá trị mới nhất (+ thống kê / điểm rủi ro nếu opt-in) ngay khi subscribe, không chờ mẫu kế tiếp."""
+    for p in patients:
+        data = get_latest(p)
+        if data:
+            sub.put(json.dumps(data, default=str))
+        summary = rolling.summary(p) if stats else None
+        if summary is not None:
+            sub.put(json.dumps({"type": "stats", **summary}))
+        score = risk.latest(p) if risk_ else None
+        if score is not None:
+            sub.put(json.dumps(score))
+
 @router.websocket("/ws/vitals/{patient}")
-async def ws_vitals(ws: WebSocket, patient: str):
+async def ws_vitals(ws: WebSocket, patient: str, stats: bool = False, risk: bool = False):
+    """
+    1 bệnh nhân: gửi ngay giá trị mới nhất (nếu có), sau đó mỗi vital mới.
+    ?stats=true: thêm message {"type": "stats", ...} (như /iot/stats/{patient}) sau mỗi mẫu.
+    ?risk=true: thêm message {"type": "risk", ...} (như /iot/risk/{patient}) mỗi khi điểm được chấm lại.
+    """
+    await ws.accept()
+    sub = hub.connect(_topics([patient], stats, risk))
+    _send_snapshot(sub, [patient], stats, risk)
+    await _serve(ws, sub)
+
+@router.websocket("/ws/vitals")
+async def ws_vitals_multi(ws: WebSocket, patients: str = "", stats: bool = False, risk: bool = False):
+    """
+    Nhiều bệnh nhân trên 1 socket (màn hình theo dõi cả khoa): ?patients=p1,p2,...
+    Client có thể gửi {"subscribe": [...]} / {"unsubscribe": [...]} để đổi danh sách.
+    Mỗi message là 1 vital (có trường "patient"); ?stats=true thêm message {"type": "stats", ...},
+    ?risk=true thêm {"type": "risk", ...}; lỗi lệnh trả về {"error": ...}.
+    """
     await ws.accept()
+    initial = list(dict.fromkeys(p for p in patients.split(",") if p))
     try:
-        while True:
-            data = get_latest(patient)
-            if data:
-                await ws.send_text(json.dumps(data))
-            await asyncio.sleep(1.0)
-    except WebSocketDisconnect:
-        await ws.close()
+        sub = hub.connect(_topics(initial, stats, risk))
+    except ValueError as e:
+        await ws.send_text(json.dumps({"error": str(e)}))
+        await ws.close(code=1008)
+        return
+    _send_snapshot(sub, initial, stats, risk)
+
+    async def handle_text(text: str):
+        try:
+            cmd = json.loads(text)
+            sub.unsubscribe(_topics(map(str, cmd.get("unsubscribe", [])), True, True))
+            added = [str(p) for p in cmd.get("subscribe", []) if str(p) not in sub.patients]
+            sub.subscribe(_topics(added, stats, risk))
+        except (ValueError, AttributeError, TypeError) as e:
+            sub.put(json.dumps({"error": str(e)}))
+            return
+        _send_snapshot(sub, added, stats, risk)
+
+    await _serve(ws, sub, handle_text)
+
+@router.get("/ws_stats")
+def ws_stats():
+    """Số kết nối / subscription của hub và số message đã phát, đã giao, bị bỏ (client chậm)."""
+    return hub.stats()
@@ -1,24 +1,97 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List
-import joblib, numpy as np, os
-import pandas as pd
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-# --- SHAP imports ---
-import math
-import shap
-from functools import lru_cache
+from typing import Literal, Optional, List
+import numpy as np, os, threading, time
+# pandas / sklearn / shap / joblib được import trễ trong hàm (app khởi động nhanh, pod chỉ phục vụ
+# /auth, /iot không phải trả chi phí import + load model)
+import math, hashlib
+from app.core.config import settings
+from app.core.cache import TTLCache, MISSING
+from app.core.metrics import ml_stage
+from app.services import ml_mmap, ml_native
+from app.services.ml_grid import SimpleGrid
+from app.services.ml_batcher import MicroBatcher, BatcherOverloaded
+from app.services.ml_pool import MLProcessPool, MLPoolOverloaded, MLPoolTimeout, MLPoolUnavailable
+from app.services.ml_registry import ModelBundle, ModelRegistry, file_sha256
 
 
 router = APIRouter(prefix="/ml", tags=["Machine Learning"])
 
+# thời gian từng bước inference (xuất ở /metrics: cardio_ml_stage_ms{stage=...})
+_T_FEATURES, _T_PRE, _T_TREES, _T_SHAP, _T_CONTRIBS = (
+    ml_stage(s) for s in ("features", "preprocess", "trees", "shap", "contribs"))
+
 MODEL_PATH = "app/ml/cardio_model.pkl"
-model = None
+# các phiên bản upload qua /ml/reload (services/ml_registry.py); MODEL_PATH là phiên bản gốc "base"
+MODEL_VERSIONS_DIR = "app/ml/versions"
+BASE_VERSION = "base"
 
-def load_model(path=MODEL_PATH):
-    global model
-    m = joblib.load(path)
+# tham chiếu DUY NHẤT tới model đang phục vụ: registry.current (ModelBundle bất biến)
+registry = ModelRegistry(MODEL_VERSIONS_DIR, keep=settings.ML_KEEP_VERSIONS)
+
+# cache kết quả (prob + SHAP payload) theo feature vector đã chuẩn hoá
+_pred_cache = TTLCache(maxsize=settings.ML_CACHE_SIZE, ttl=settings.ML_CACHE_TTL_S)
+
+# process pool cho explain / batch lớn (services/ml_pool.py); main.py gọi pool.start() lúc startup
+pool = MLProcessPool(workers=settings.ML_POOL_WORKERS, timeout_s=settings.ML_POOL_TIMEOUT_S,
+                     max_pending=settings.ML_POOL_MAX_PENDING, min_rows=settings.ML_POOL_MIN_ROWS)
+
+def current_bundle() -> ModelBundle:
+    """
+    Bundle đang active. Chưa có → khởi động load nền (nếu chưa chạy) và trả 503 để client retry.
+    Handler lấy 1 lần rồi dùng suốt request.
+    """
+    b = registry.current
+    if b is None:
+        start_background_load()
+        state = _load_state["status"]
+        detail = "Model loading, retry shortly" if state in ("pending", "loading") else "Model not loaded"
+        raise HTTPException(status_code=503, detail=detail)
+    return b
+
+# trạng thái load model nền: pending -> loading -> ready | failed
+_load_state = {"status": "pending", "error": None, "seconds": None}
+_load_lock = threading.Lock()
+
+def start_background_load() -> bool:
+    """
+    Load + warm-up model active trong thread nền (không chặn startup / event loop).
+    Gọi nhiều lần an toàn; trả về True nếu lần gọi này khởi động việc load.
+    """
+    with _load_lock:
+        if _load_state["status"] in ("loading", "ready"):
+            return False
+        _load_state.update(status="loading", error=None)
+    threading.Thread(target=_background_load, name="ml-model-load", daemon=True).start()
+    return True
+
+def _background_load():
+    t0 = time.perf_counter()
+    try:
+        _load_active_model()
+    except Exception as e:
+        print(f"[WARN] Could not load model at startup: {e}")
+        _load_state.update(status="failed", error=str(e), seconds=time.perf_counter() - t0)
+        return
+    _load_state.update(status="ready", seconds=time.perf_counter() - t0)
+
+def load_state() -> dict:
+    return dict(_load_state, version=registry.current.version if registry.current is not None else None)
+
+def _cache_key(kind: str, row: np.ndarray, version: str, *extra):
+    """
+    Key = (loại kết quả, phiên bản model, hash của dòng float đã chuẩn hoá, tham số phụ).
+    Chuẩn hoá: mọi NaN cùng 1 bit pattern, -0.0 -> 0.0 ⇒ hai dòng bằng nhau (NaN == NaN) cho cùng key.
+    """
+    row = np.asarray(row, dtype=np.float64).ravel()
+    canon = np.where(np.isnan(row), np.nan, row + 0.0)
+    digest = hashlib.blake2b(canon.tobytes(), digest_size=16).digest()
+    return (kind, version, digest) + extra
+
+def _validate_pipeline(m):
+    from sklearn.compose import ColumnTransformer
+    from sklearn.pipeline import Pipeline
     pre = getattr(m, "named_steps", {}).get("pre", None)
     if not isinstance(m, Pipeline):
         raise RuntimeError("Invalid model: not a sklearn Pipeline")
@@ -30,21 +103,223 @@ def load_model(path=MODEL_PATH):
     for name, trans, cols in tfms:
         if isinstance(trans, str) and trans not in ("passthrough", "drop"):
             raise RuntimeError(f"Invalid transformer '{name}': got {trans!r}")
-    model = m
-    return model
 
+def build_bundle(path: str, version: str, engine_name: Optional[str] = None,
+                 model_format: Optional[str] = None) -> ModelBundle:
+    """
+    Load + validate + warm-up 1 phiên bản model thành ModelBundle (chạy được trong worker thread).
+    engine_name="native" compile thêm NativePredictor (services/ml_native.py) và chỉ dùng nó nếu
+    khớp model.predict_proba trên mẫu cố định; không khớp / không compile được → fallback về sklearn.
+    model_format="mmap": dùng artifact memmap dùng chung giữa các worker (services/ml_mmap.py),
+    export từ file .pkl lần đầu; model không compile được → fallback về pickle.
+    """
+    model_format = model_format or settings.ML_MODEL_FORMAT
+    note = None
+    if model_format == "mmap":
+        try:
+            return _build_mmap_bundle(path, version)
+        except (NotImplementedError, RuntimeError) as e:
+            note = f"mmap artifacts unavailable ({e}), using pickle"
+    elif model_format != "pickle":
+        note = f"unknown model format {model_format!r}, using pickle"
+
+    import joblib, shap
+    m = joblib.load(path)
+    _validate_pipeline(m)
+
+    engine_name = engine_name or settings.ML_ENGINE
+    nat = None
+    if engine_name == "native":
+        nat, native_note = _build_native(m)
+        note = "; ".join(filter(None, (note, native_note))) or None
+    elif engine_name != "sklearn":
+        note = "; ".join(filter(None, (note, f"unknown engine {engine_name!r}, using sklearn")))
+    if note:
+        print(f"[WARN] {note}")
+
+    b = ModelBundle(
+        version=version, path=path, sha256=file_sha256(path), model=m,
+        engine="native" if nat is not None else "sklearn", native=nat, engine_note=note,
+        explainer=shap.TreeExplainer(m[-1]),
+        feature_names_out=tuple(map(str, m.named_steps["pre"].get_feature_names_out())),
+    )
+    _warm_up(b)
+    return _with_simple_grid(b)
+
+def _warm_up(b: ModelBundle):
+    # chạy thử predictor + SHAP trên batch mẫu trước khi nhận traffic
+    _, _, X_trans = _infer(ml_native.verification_sample(32), b)
+    _shap_matrix(X_trans[:8], b)
+
+def _build_mmap_bundle(path: str, version: str) -> ModelBundle:
+    """Bundle engine "mmap": không unpickle Pipeline trong worker này (trừ process làm export)."""
+    sha = file_sha256(path)
+    art = ml_mmap.load_artifacts(
+        ml_mmap.ensure_artifacts(settings.ML_MMAP_DIR, sha, lambda out: _export_mmap(path, sha, out))
+    )
+    b = ModelBundle(
+        version=version, path=path, sha256=sha, model=None,
+        engine="mmap", native=art.native, explainer=art.explainer,
+        feature_names_out=tuple(art.feature_names_out), threshold=art.threshold,
+    )
+    _warm_up(b)
+    return _with_simple_grid(b)
+
+def _with_simple_grid(b: ModelBundle) -> ModelBundle:
+    """
+    Chấm lưới predict_simple (ML_SIMPLE_GRID) trong thread nền: model sẵn sàng ngay, predict_simple chấm live
+    tới khi lưới xong. Lưới chỉ được gắn khi đã chấm xong, qua registry.update (bundle mới thay tham chiếu,
+    bundle đã phát hành không bị sửa). Rollback dùng lại lưới của bundle cũ.
+    """
+    if settings.ML_SIMPLE_GRID:
+        threading.Thread(target=_fill_simple_grid, args=(b,), name="ml-simple-grid", daemon=True).start()
+    return b
+
+def _fill_simple_grid(b: ModelBundle):
+    """
+    Chấm mọi ô rồi đối chiếu vài ô ngẫu nhiên với đường chấm 1 dòng thật; lệch quá VERIFY_ATOL → bỏ lưới.
+    Engine mmap (chấm bằng NativePredictor, chậm với batch lớn): lưới lưu cạnh artifact, worker khác mmap dùng lại.
+    """
+    t0 = time.perf_counter()
+    grid = SimpleGrid()
+    cache = (os.path.join(ml_mmap.artifact_dir(settings.ML_MMAP_DIR, b.sha256), "simple_grid.npy")
+             if b.engine == "mmap" else None)
+    try:
+        X = build_feature_matrix(grid.raw_inputs(FULL_INPUT_FIELDS))
+        probs = np.load(cache, mmap_mode="r").ravel() if cache and os.path.exists(cache) else None
+        loaded = probs is not None and probs.size == grid.size
+        if not loaded:
+            # batch lớn qua xgboost (nhanh); với engine native, đường 1 dòng khớp trong dung sai VERIFY_ATOL
+            probs = np.concatenate([_score_matrix(X[i:i + BATCH_CHUNK_ROWS], b)[1]
+                                    for i in range(0, len(X), BATCH_CHUNK_ROWS)])
+        check = np.random.default_rng(0).choice(len(X), size=min(32, len(X)), replace=False)
+        live = np.array([_score_matrix(X[i:i + 1], b)[1][0] for i in check])
+        diff = float(np.max(np.abs(live - probs[check])))
+        if diff > ml_native.VERIFY_ATOL:
+            print(f"[WARN] predict_simple grid mismatch (max |diff|={diff:.2e}), serving live")
+            return
+        if cache and not loaded:
+            tmp = f"{cache}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, probs.reshape(grid.shape))
+            os.replace(tmp, cache)
+    except Exception as e:
+        print(f"[WARN] predict_simple grid failed ({e}), serving live")
+        return
+    grid.probs = probs.reshape(grid.shape)
+    registry.update(b.version, simple_grid=grid)
+    print(f"[INFO] predict_simple grid ({b.version}): {grid.size} cells in {time.perf_counter() - t0:.2f}s"
+          f"{' (mmap)' if loaded else ''}")
+
+def _export_mmap(path: str, sha: str, out_dir: str):
+    import joblib, shap
+    m = joblib.load(path)
+    _validate_pipeline(m)
+    nat = ml_native.compile_pipeline(m, BASE_FEATURE_COLUMNS)
+    ok, diff = ml_native.verify(nat, m, BASE_FEATURE_COLUMNS)
+    if not ok:
+        raise RuntimeError(f"native engine mismatch (max |diff|={diff:.2e})")
+    X = ml_native.verification_sample()
+    explainer = shap.TreeExplainer(m[-1])
+    # với xgboost, expected_value chỉ được chốt (bias của pred_contribs) sau lần shap_values đầu tiên
+    explainer.shap_values(nat.transform(X[:8]))
+    ml_mmap.export_artifacts(
+        out_dir, sha256=sha, native=nat, explainer=explainer,
+        feature_names_out=m.named_steps["pre"].get_feature_names_out(),
+        threshold=getattr(m, "threshold_", DEFAULT_THRESHOLD),
+        verify_X=X, verify_p1=nat.predict_proba(X)[:, 1],
+    )
+
+def load_model(path=MODEL_PATH, engine_name: Optional[str] = None, version: str = BASE_VERSION,
+               model_format: Optional[str] = None):
+    """
+    Load đồng bộ + activate ngay (dùng lúc startup / script).
+    Trả về Pipeline (None với model_format="mmap": worker không giữ Pipeline).
+    """
+    with registry.building(version):
+        b = build_bundle(path, version, engine_name, model_format)
+    registry.activate(b)
+    _pred_cache.clear()
+    pool.load(b)
+    _load_state.update(status="ready", error=None)
+    return b.model
+
+def _load_active_model():
+    """Startup: phiên bản active lần chạy trước (nếu còn file), ngược lại MODEL_PATH gốc."""
+    version = registry.active_version_on_disk()
+    if version is not None:
+        return load_model(registry.path_for(version), version=version)
+    return load_model(MODEL_PATH, version=BASE_VERSION)
+
+def _build_native(m):
+    """Compile + verify NativePredictor -> (native | None, lý do fallback)."""
+    try:
+        nat = ml_native.compile_pipeline(m, BASE_FEATURE_COLUMNS)
+        ok, diff = ml_native.verify(nat, m, BASE_FEATURE_COLUMNS)
+    except Exception as e:
+        return None, f"native engine unavailable ({e}), using sklearn"
+    if not ok:
+        return None, f"native engine mismatch (max |diff|={diff:.2e}), using sklearn"
+    return nat, None
+
+def _shap_matrix(X_trans, b: ModelBundle):
+    """1 lần explainer.shap_values cho cả ma trận -> (S (n, n_feat) của class 1, base_value logit)."""
+    explainer = b.explainer
+    with _T_SHAP.time():
+        shap_values = explainer.shap_values(X_trans)
+    expected_value = explainer.expected_value
+    # Với XGBoostClassifier, shap_values / expected_value có thể là list/mảng 2 classes; lấy class 1
+    if isinstance(shap_values, list):
+        shap_values = shap_values[1]
+        if isinstance(expected_value, (list, tuple, np.ndarray)):
+            expected_value = expected_value[1]
+    return np.asarray(shap_values, dtype=float), float(np.asarray(expected_value).ravel()[0])
+
+# engine giải thích: "shap" = shap.TreeExplainer (mặc định), "exact" / "approx" = contribution gốc của
+# booster xgboost (pred_contribs; approx = Saabas, nhanh hơn nhưng không phải SHAP)
+EXPLAIN_MODES = ("shap", "exact", "approx")
+
+class ExplainModeUnavailable(ValueError):
+    """Bundle không có booster cho mode này — lỗi thường (pickle được qua process pool), router trả 409."""
 
-try:
-    load_model()
-except Exception as e:
-    print(f"[WARN] Could not load model at startup: {e}")
+def _contrib_matrix(X_trans, b: ModelBundle, mode: str):
+    """booster.predict(pred_contribs) -> (S (n, n_feat), base_value logit) — cùng dạng với _shap_matrix."""
+    if b.model is None:
+        raise ExplainModeUnavailable(f"mode={mode} needs the xgboost booster, "
+                                     "not loaded in this worker (ML_MODEL_FORMAT=mmap)")
+    import xgboost as xgb
+    clf = b.model[-1]
+    booster = clf.get_booster()
+    try:   # cùng số cây với predict_proba khi train có early stopping
+        iteration_range = (0, clf.best_iteration + 1)
+    except AttributeError:
+        iteration_range = (0, 0)
+    dm = xgb.DMatrix(np.asarray(X_trans, dtype=np.float32), missing=np.nan, feature_names=booster.feature_names)
+    with _T_CONTRIBS.time():
+        C = booster.predict(dm, pred_contribs=True, approx_contribs=(mode == "approx"),
+                            iteration_range=iteration_range)
+    # cột cuối = bias (giống nhau mọi dòng) = base_value
+    base = float(C[0, -1]) if len(C) else 0.0
+    return np.asarray(C[:, :-1], dtype=float), base
 
-@lru_cache(maxsize=1)
-def _get_explainer():
-    if model is None:
-        raise RuntimeError("Model not loaded")
-    clf = model.named_steps.get("clf")
-    return shap.TreeExplainer(clf)  
+def _explain_matrix(X_trans, b: ModelBundle, mode: str):
+    if mode == "shap":
+        return _shap_matrix(X_trans, b)
+    return _contrib_matrix(X_trans, b, mode)
+
+def _topk_idx(score: np.ndarray, k: int) -> np.ndarray:
+    """
+    Top-k cột theo score giảm dần cho từng dòng: argpartition O(n_feat) rồi chỉ sort k phần tử.
+    Ô có score = -inf (không đủ k ứng viên) trả về -1.
+    """
+    n, m = score.shape
+    k = max(0, min(int(k), m))
+    if k == 0:
+        return np.empty((n, 0), dtype=np.int64)
+    part = np.argpartition(-score, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(score, part, axis=1), axis=1, kind="stable")
+    idx = np.take_along_axis(part, order, axis=1)
+    return np.where(np.isneginf(np.take_along_axis(score, idx, axis=1)), -1, idx)
 
 def _sigmoid(x: float) -> float:
     try:
@@ -74,7 +349,8 @@ def build_feature_df(
     alco: Optional[float],
     active: Optional[float],
     gender: Optional[float],  # 1=female, 2=male
-) -> pd.DataFrame:
+) -> "pd.DataFrame":
+    import pandas as pd
     age_days = _nz(age_days); height = _nz(height); weight = _nz(weight)
     ap_hi = _nz(ap_hi); ap_lo = _nz(ap_lo)
     cholesterol = _nz(cholesterol); gluc = _nz(gluc)
@@ -82,6 +358,7 @@ def build_feature_df(
     gender = _nz(gender)
 
     # Derived features (đúng như notebook train)
+    t0 = time.perf_counter()
     age_years = float(np.floor(age_days / 365.0)) if pd.notna(age_days) else np.nan
     bmi = float(weight / ((height / 100.0) ** 2)) if pd.notna(height) and pd.notna(weight) and float(height) != 0.0 else np.nan
     bp_diff = float(ap_hi - ap_lo) if pd.notna(ap_hi) and pd.notna(ap_lo) else np.nan
@@ -95,8 +372,195 @@ def build_feature_df(
     X_df = pd.DataFrame([row], columns=BASE_FEATURE_COLUMNS)
     # XGB xử lý NaN được; ép float để loại lỗi dtype
     X_df = X_df.astype(float)
+    _T_FEATURES.observe((time.perf_counter() - t0) * 1000.0)
     return X_df
 
+# Thứ tự cột THÔ của 1 bản ghi CardioFullInput (trước khi tính derived features)
+FULL_INPUT_FIELDS: List[str] = [
+    "age","height","weight","ap_hi","ap_lo",
+    "cholesterol","gluc","smoke","alco","active","gender",
+]
+
+# Số dòng tối đa mỗi lần gọi predict_proba khi chấm điểm batch/upload lớn
+BATCH_CHUNK_ROWS = 20_000
+MAX_BATCH_ROWS = 50_000
+
+def build_feature_matrix(raw: np.ndarray) -> np.ndarray:
+    """
+    Bản columnar (NumPy) của build_feature_df cho nhiều dòng cùng lúc.
+    raw: mảng (n, 11) theo FULL_INPUT_FIELDS, giá trị thiếu = NaN.
+    Trả về mảng float (n, 15) theo BASE_FEATURE_COLUMNS, cho ra đúng các feature như bản scalar.
+    """
+    t0 = time.perf_counter()
+    raw = np.asarray(raw, dtype=float)
+    if raw.ndim != 2 or raw.shape[1] != len(FULL_INPUT_FIELDS):
+        raise ValueError(f"expected shape (n, {len(FULL_INPUT_FIELDS)}), got {raw.shape}")
+    (age_days, height, weight, ap_hi, ap_lo,
+     cholesterol, gluc, smoke, alco, active, gender) = raw.T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        age_years = np.floor(age_days / 365.0)
+        bmi = np.where(height != 0.0, weight / ((height / 100.0) ** 2), np.nan)
+    bp_diff = ap_hi - ap_lo
+    # 1=female→0, 2=male→1, còn lại NaN (giống dict .get ở bản scalar)
+    gender_bin = np.where(gender == 1.0, 0.0, np.where(gender == 2.0, 1.0, np.nan))
+
+    X = np.column_stack([
+        age_days, height, weight, ap_hi, ap_lo,
+        age_years, bmi, bp_diff,
+        gender, cholesterol, gluc, smoke, alco, active, gender_bin,
+    ])
+    _T_FEATURES.observe((time.perf_counter() - t0) * 1000.0)
+    return X
+
+def _raw_from_inputs(rows) -> np.ndarray:
+    """List[CardioFullInput] -> mảng (n, 11); None -> NaN."""
+    return np.array(
+        [[getattr(r, f) for f in FULL_INPUT_FIELDS] for r in rows],
+        dtype=float,
+    ).reshape(-1, len(FULL_INPUT_FIELDS))
+
+def _simple_gender(s) -> Optional[float]:
+    """"male"/"m..." -> 2.0, chuỗi khác -> 1.0, rỗng/None -> None."""
+    if not s.gender:
+        return None
+    return 2.0 if s.gender.lower().startswith("m") else 1.0
+
+def _raw_from_simple(s) -> np.ndarray:
+    """SimpleInput -> mảng (1, 11); các field không có trong form rút gọn = NaN."""
+    raw = np.full((1, len(FULL_INPUT_FIELDS)), np.nan)
+    if s.age is not None:
+        raw[0, 0] = float(s.age) * 365
+    if s.bp is not None:
+        raw[0, 3] = float(s.bp)
+    if s.cholesterol is not None:
+        raw[0, 5] = float(s.cholesterol)
+    gender = _simple_gender(s)
+    if gender is not None:
+        raw[0, 10] = gender
+    return raw
+
+def _raw_from_frame(df: "pd.DataFrame") -> np.ndarray:
+    """DataFrame (CSV/Parquet) -> mảng (n, 11); cột thiếu hoặc không parse được -> NaN."""
+    import pandas as pd
+    raw = np.full((len(df), len(FULL_INPUT_FIELDS)), np.nan)
+    for j, f in enumerate(FULL_INPUT_FIELDS):
+        if f in df.columns:
+            raw[:, j] = pd.to_numeric(df[f], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    return raw
+
+# Ngưỡng mặc định của XGBClassifier.predict (class 1 khi prob > 0.5)
+DEFAULT_THRESHOLD = 0.5
+
+def _threshold(b: ModelBundle) -> float:
+    """Ngưỡng phân lớp của model (thuộc tính `threshold_` nếu lúc train có lưu, ngược lại 0.5)."""
+    if b.threshold is not None:
+        return float(b.threshold)
+    return float(getattr(b.model, "threshold_", DEFAULT_THRESHOLD))
+
+def _label_classes(b: ModelBundle) -> np.ndarray:
+    """Nhãn theo chỉ số (0 = âm, 1 = dương) như _infer dùng."""
+    if b.native is not None:
+        return b.native.classes
+    return np.asarray(getattr(b.model[-1], "classes_", (0, 1)))
+
+def _infer(X, b: Optional[ModelBundle] = None):
+    """
+    Inference core dùng chung cho mọi endpoint:
+    preprocessor chạy 1 lần, trees chấm 1 lần (predict_proba), nhãn lấy từ prob theo ngưỡng.
+    X: DataFrame hoặc ndarray (n, 15) theo BASE_FEATURE_COLUMNS.
+    Trả về (labels, prob class 1, X_trans) — X_trans dùng lại cho SHAP.
+    Engine native (nếu bật) xử lý batch nhỏ (online path), batch lớn vẫn qua sklearn/xgboost;
+    engine mmap không có Pipeline nên mọi batch đều qua NativePredictor.
+    """
+    b = b or current_bundle()
+    nat = b.native
+    if nat is not None and (b.model is None or len(X) <= ml_native.ONLINE_MAX_ROWS):
+        X_raw = X.to_numpy(dtype=float) if hasattr(X, "to_numpy") else np.asarray(X, dtype=float)
+        with _T_PRE.time():
+            X_trans = nat.transform(X_raw)
+        with _T_TREES.time():
+            p1 = nat.predict_proba_transformed(X_trans)
+        classes = nat.classes
+    else:
+        import pandas as pd
+        if not isinstance(X, pd.DataFrame):
+            X = pd.DataFrame(X, columns=BASE_FEATURE_COLUMNS)
+        with _T_PRE.time():
+            X_trans = b.model[:-1].transform(X)
+        clf = b.model[-1]
+        with _T_TREES.time():
+            p1 = clf.predict_proba(X_trans)[:, 1]
+        classes = np.asarray(getattr(clf, "classes_", (0, 1)))
+    labels = classes[(p1 > _threshold(b)).astype(int)]
+    return labels, p1, X_trans
+
+def _score_matrix(X: np.ndarray, b: Optional[ModelBundle] = None):
+    """Chấm điểm ma trận feature THÔ (n, 15) -> (labels, prob class 1)."""
+    labels, p1, _ = _infer(X, b)
+    return labels, p1
+
+def _run_pooled(kind: str, X: np.ndarray, b: ModelBundle, mode: str = "shap") -> Optional[dict]:
+    """Task qua process pool nếu pool nhận (xem MLProcessPool.wants); None → caller chấm tại chỗ."""
+    if not pool.wants(len(X), kind):
+        return None
+    try:
+        return pool.run(kind, X, b, mode, n_feat=len(b.feature_names_out))
+    except MLPoolUnavailable:
+        return None
+    except MLPoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except MLPoolTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+def _score_rows(X: np.ndarray, b: ModelBundle):
+    """Như _score_matrix cho batch từ handler: batch >= ML_POOL_MIN_ROWS chạy trong process pool (nếu bật)."""
+    out = _run_pooled("score", X, b)
+    if out is None:
+        return _score_matrix(X, b)
+    return out["labels"], out["probs"]
+
+def _explain_rows(X: np.ndarray, b: ModelBundle, mode: str):
+    """X thô (n, 15) -> (labels, prob class 1, S, base_value); trong process pool nếu bật."""
+    try:
+        out = _run_pooled("explain", X, b, mode)
+        if out is None:
+            labels, p1, X_trans = _infer(X, b)
+            return (labels, p1) + _explain_matrix(X_trans, b, mode)
+    except ExplainModeUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return out["labels"], out["probs"], out["contribs"], out["base"]
+
+_batcher: Optional[MicroBatcher] = None
+
+def _get_batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(
+            _score_matrix,
+            max_batch=settings.ML_BATCH_MAX_SIZE,
+            max_wait_ms=settings.ML_BATCH_MAX_WAIT_MS,
+            max_queue=settings.ML_BATCH_MAX_QUEUE,
+        )
+    return _batcher
+
+async def _score_one(X: np.ndarray, b: ModelBundle):
+    """
+    X (1, 15) -> (label, prob). Tra cache trước; miss thì qua micro-batcher nếu ML_BATCH_ENABLED,
+    ngược lại chấm thẳng trong threadpool.
+    """
+    key = _cache_key("proba", X[0], b.version)
+    hit = _pred_cache.get(key)
+    if hit is not MISSING:
+        return hit
+    if settings.ML_BATCH_ENABLED:
+        out = await _get_batcher().submit(X[0], b)   # chấm bằng đúng bundle của cache key
+    else:
+        labels, p1 = await run_in_threadpool(_score_matrix, X, b)
+        out = (labels[0], p1[0])
+    _pred_cache.set(key, out)
+    return out
+
 class CardioInput(BaseModel):
     age: int
     height: float
@@ -139,6 +603,42 @@ class CardioFullInput(BaseModel):
     active: Optional[float] = Field(None, description="0/1")
     gender: Optional[float] = Field(None, description="1=female, 2=male")
 
+class BatchInput(BaseModel):
+    rows: List[CardioFullInput] = Field(..., description="danh sách bản ghi, mỗi bản ghi như /predict_full")
+
+# /ml/whatif: tối đa 2 trục, mỗi trục <= MAX_WHATIF_STEPS giá trị (50 x 50 = 2500 dòng mặc định là đủ cho UI)
+MAX_WHATIF_STEPS = 200
+MAX_WHATIF_POINTS = 10_000
+
+class WhatIfAxis(BaseModel):
+    feature: str = Field(..., description="1 field của CardioFullInput (vd. ap_hi, smoke, weight)")
+    values: Optional[List[float]] = Field(None, description="danh sách giá trị; hoặc dùng start/stop/steps")
+    start: Optional[float] = None
+    stop: Optional[float] = None
+    steps: Optional[int] = Field(None, description="số điểm chia đều từ start tới stop (gồm 2 đầu)")
+
+    @field_validator("feature")
+    @classmethod
+    def _known_feature(cls, v):
+        if v not in FULL_INPUT_FIELDS:
+            raise ValueError(f"feature must be one of {FULL_INPUT_FIELDS}")
+        return v
+
+    def grid(self) -> np.ndarray:
+        if self.values is not None:
+            vals = np.asarray(self.values, dtype=float)
+        elif None not in (self.start, self.stop, self.steps):
+            vals = np.linspace(self.start, self.stop, self.steps)
+        else:
+            raise ValueError(f"{self.feature}: give either values or start/stop/steps")
+        if not 1 <= len(vals) <= MAX_WHATIF_STEPS:
+            raise ValueError(f"{self.feature}: 1..{MAX_WHATIF_STEPS} values per axis")
+        return vals
+
+class WhatIfInput(BaseModel):
+    base: CardioFullInput
+    vary: List[WhatIfAxis] = Field(..., min_length=1, max_length=2, description="1 trục (đường) hoặc 2 trục (bề mặt)")
+
 class SimpleInput(BaseModel):
     age: Optional[int] = Field(None, description="years")
     gender: Optional[str] = Field(None, description='"male"/"female"')
@@ -188,11 +688,19 @@ def feature_labels():
 @router.get("/model_info")
 def model_info():
     """Thông tin nhanh để xác nhận preprocessor đã fit và tên cột sau preprocess."""
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    info = {"loaded": True, "type": type(model).__name__}
+    b = current_bundle()
+    info = {"loaded": True, "type": type(b.model).__name__ if b.model is not None else None, "engine": b.engine,
+            "version": b.info(), "history": [h.info() for h in registry.history()]}
+    if b.engine_note:
+        info["engine_note"] = b.engine_note
+    if b.model is None:
+        # engine mmap: worker không giữ Pipeline, tên cột lấy từ manifest của artifact
+        info["has_pre"] = True
+        info["pre_feature_names_out"] = list(b.feature_names_out)
+        info["pre_feature_count"] = len(b.feature_names_out)
+        return info
     try:
-        pre = getattr(model, "named_steps", {}).get("pre", None)
+        pre = getattr(b.model, "named_steps", {}).get("pre", None)
         info["has_pre"] = pre is not None
         if pre is not None:
             # cần model đã fit
@@ -210,114 +718,222 @@ def model_info():
     return info
 
 @router.post("/predict")
-def predict(data: CardioInput):
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    X_df = build_feature_df(
-        age_days=float(data.age),
-        height=float(data.height),
-        weight=float(data.weight),
-        ap_hi=float(data.ap_hi),
-        ap_lo=float(data.ap_lo),
-        cholesterol=float(data.cholesterol),
-        gluc=float(data.gluc),
-        smoke=float(data.smoke),
-        alco=float(data.alco),
-        active=float(data.active),
-        gender=float(data.gender),
-    )
+async def predict(data: CardioInput):
+    b = current_bundle()
+    # CardioInput có cùng tên field với CardioFullInput -> dùng chung đường vector hoá
+    X = build_feature_matrix(_raw_from_inputs([data]))
     try:
-        y = model.predict(X_df)
-        pred = int(y[0])
-        proba = None
-        if hasattr(model, "predict_proba"):
-            p = model.predict_proba(X_df)
-            proba = float(p[0,1])
-        return {"prediction": pred, "prob": proba}
+        label, p = await _score_one(X, b)
+        return {"prediction": int(label), "prob": float(p)}
+    except BatcherOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Predict failed: {e}")
 
 @router.post("/predict_full")
-def predict_full(payload: CardioFullInput):
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    X_df = build_feature_df(
-        age_days=payload.age,
-        height=payload.height,
-        weight=payload.weight,
-        ap_hi=payload.ap_hi,
-        ap_lo=payload.ap_lo,
-        cholesterol=payload.cholesterol,
-        gluc=payload.gluc,
-        smoke=payload.smoke,
-        alco=payload.alco,
-        active=payload.active,
-        gender=payload.gender,
-    )
+async def predict_full(payload: CardioFullInput):
+    b = current_bundle()
+    X = build_feature_matrix(_raw_from_inputs([payload]))
     try:
-        y = model.predict(X_df)
-        pred = int(y[0])
-        proba = None
-        if hasattr(model, "predict_proba"):
-            p = model.predict_proba(X_df)
-            proba = float(p[0,1])
-        return {"prediction": pred, "prob": proba}
+        label, p = await _score_one(X, b)
+        return {"prediction": int(label), "prob": float(p)}
+    except BatcherOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Predict failed: {e}")
 
 @router.post("/predict_simple")
-def predict_simple(s: SimpleInput):
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    age_days = float(s.age)*365 if s.age is not None else None
-    ap_hi = float(s.bp) if s.bp is not None else None
-    gender_num = None
-    if s.gender:
-        gender_num = 2.0 if s.gender.lower().startswith("m") else 1.0
-    X_df = build_feature_df(
-        age_days=age_days,
-        height=None,
-        weight=None,
-        ap_hi=ap_hi,
-        ap_lo=None,
-        cholesterol=float(s.cholesterol) if s.cholesterol is not None else None,
-        gluc=None, smoke=None, alco=None, active=None, gender=gender_num,
-    )
+async def predict_simple(s: SimpleInput):
+    b = current_bundle()
+    # lưới chấm sẵn của bundle: O(1), không qua pipeline / batcher / cache; ngoài lưới → chấm live
+    if b.simple_grid is not None:
+        p = b.simple_grid.lookup(s.age, _simple_gender(s), s.cholesterol, s.bp)
+        if p is not None:
+            label = _label_classes(b)[int(p > _threshold(b))]
+            return {"prediction": int(label), "prob": p, "note": "Missing fields sent as NaN."}
+    X = build_feature_matrix(_raw_from_simple(s))
+    try:
+        label, p = await _score_one(X, b)
+        return {"prediction": int(label), "prob": float(p), "note": "Missing fields sent as NaN."}
+    except BatcherOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Predict failed: {e}")
+
+@router.post("/whatif")
+def whatif(payload: WhatIfInput):
+    """
+    Độ nhạy theo 1-2 feature: mọi điểm của lưới là 1 dòng (base + giá trị trục), dựng feature dạng cột
+    + chấm trong 1 lần gọi model. 1 trục → probs[i]; 2 trục → probs[i][j] cho (x[i], y[j]).
+    """
+    b = current_bundle()
+    names = [a.feature for a in payload.vary]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=422, detail="vary features must be distinct")
+    try:
+        grids = [a.grid() for a in payload.vary]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    shape = tuple(len(g) for g in grids)
+    n = int(np.prod(shape))
+    if n > MAX_WHATIF_POINTS:
+        raise HTTPException(status_code=413, detail=f"Too many points: {n} > {MAX_WHATIF_POINTS}")
+    base = _raw_from_inputs([payload.base])
+    # dòng 0 = base, sau đó lưới theo thứ tự C (trục cuối chạy nhanh nhất)
+    raw = np.repeat(base, n + 1, axis=0)
+    for name, mesh in zip(names, np.meshgrid(*grids, indexing="ij")):
+        raw[1:, FULL_INPUT_FIELDS.index(name)] = mesh.ravel()
     try:
-        y = model.predict(X_df)
-        pred = int(y[0])
-        proba = None
-        if hasattr(model, "predict_proba"):
-            p = model.predict_proba(X_df)
-            proba = float(p[0,1])
-        return {"prediction": pred, "prob": proba, "note": "Missing fields sent as NaN."}
+        labels, probs = _score_rows(build_feature_matrix(raw), b)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Predict failed: {e}")
+    axes = [{"feature": f, "values": g.tolist()} for f, g in zip(names, grids)]
+    return {
+        "model_version": b.version,
+        "base": {"prob": float(probs[0]), "prediction": int(labels[0])},
+        "axes": axes,
+        "probs": probs[1:].astype(float).reshape(shape).tolist(),
+        "predictions": labels[1:].astype(int).reshape(shape).tolist(),
+    }
+
+@router.post("/predict_batch")
+def predict_batch(payload: BatchInput):
+    """Chấm điểm nhiều bản ghi CardioFullInput trong 1 lần predict_proba (thay vì gọi /predict_full từng dòng)."""
+    b = current_bundle()
+    n = len(payload.rows)
+    if n > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"Too many rows: {n} > {MAX_BATCH_ROWS}; use /ml/predict_batch/upload")
+    if n == 0:
+        return {"count": 0, "predictions": [], "probs": []}
+    try:
+        X = build_feature_matrix(_raw_from_inputs(payload.rows))
+        labels, probs = _score_rows(X, b)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Predict failed: {e}")
+    return {"count": n, "predictions": labels.astype(int).tolist(), "probs": probs.astype(float).tolist()}
+
+def _iter_upload_frames(file: UploadFile, chunk_rows: int):
+    """Đọc file upload theo từng chunk (CSV hoặc Parquet) để giới hạn bộ nhớ."""
+    name = (file.filename or "").lower()
+    if name.endswith((".parquet", ".pq")) or "parquet" in (file.content_type or ""):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise HTTPException(status_code=400, detail="Parquet upload requires 'pyarrow' to be installed")
+        pf = pq.ParquetFile(file.file)
+        cols = [c for c in FULL_INPUT_FIELDS if c in pf.schema_arrow.names]
+        for batch in pf.iter_batches(batch_size=chunk_rows, columns=cols):
+            yield batch.to_pandas()
+    else:
+        import pandas as pd
+        yield from pd.read_csv(
+            file.file, chunksize=chunk_rows,
+            usecols=lambda c: c in FULL_INPUT_FIELDS,
+        )
+
+@router.post("/predict_batch/upload")
+def predict_batch_upload(file: UploadFile = File(...), chunk_rows: int = BATCH_CHUNK_ROWS):
+    """
+    Chấm điểm file CSV/Parquet (cột theo FULL_INPUT_FIELDS, cột thiếu = NaN).
+    File được xử lý theo chunk `chunk_rows` dòng, mỗi chunk 1 lần predict_proba.
+    """
+    b = current_bundle()
+    chunk_rows = max(1, min(int(chunk_rows), BATCH_CHUNK_ROWS))
+    labels_out, probs_out = [], []
+    try:
+        for df in _iter_upload_frames(file, chunk_rows):
+            if len(df) == 0:
+                continue
+            labels, probs = _score_rows(build_feature_matrix(_raw_from_frame(df)), b)
+            labels_out.append(labels.astype(np.int8))
+            probs_out.append(probs.astype(np.float32))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Predict failed: {e}")
+    labels = np.concatenate(labels_out) if labels_out else np.empty(0, dtype=np.int8)
+    probs = np.concatenate(probs_out) if probs_out else np.empty(0, dtype=np.float32)
+    return {"count": int(len(probs)), "predictions": labels.tolist(), "probs": probs.tolist()}
 
 @router.post("/reload")
 async def reload_model(file: UploadFile = File(...)):
+    """
+    Upload model mới: ghi thành file phiên bản riêng, load + validate + warm-up trong worker thread,
+    rồi swap bundle nguyên tử. Request đang chạy vẫn dùng bundle cũ; lỗi thì model cũ giữ nguyên.
+    """
     try:
-        os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
-        with open(MODEL_PATH,"wb") as f:
-            f.write(await file.read())
-        load_model(MODEL_PATH)
-        _get_explainer.cache_clear()
-        return {"message":"Model reloaded successfully"}
+        b = await registry.install(await file.read(), build_bundle)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Reload failed: {e}")
+    _pred_cache.clear()
+    pool.load(b)
+    return {"message": "Model reloaded successfully", "version": b.version, "engine": b.engine}
+
+@router.post("/rollback")
+def rollback_model(version: Optional[str] = None):
+    """Quay lại phiên bản trước (hoặc `version` trong history) — bundle đã nằm sẵn trong RAM."""
+    try:
+        b = registry.rollback(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Version not in history: {e}")
+    _pred_cache.clear()
+    pool.load(b)
+    return {"message": "Rolled back", "version": b.version}
+
+@router.get("/model_versions")
+def model_versions():
+    """Phiên bản đang active + các phiên bản giữ lại để rollback (mới nhất trước)."""
+    cur = registry.current
+    return {
+        "active": cur.info() if cur is not None else None,
+        "history": [h.info() for h in registry.history()],
+        "keep": registry.keep,
+    }
+
+@router.get("/batcher_stats")
+def batcher_stats():
+    """Histogram thời gian chờ hàng đợi + kích thước batch của micro-batcher (để tune throughput vs tail latency)."""
+    return {"enabled": settings.ML_BATCH_ENABLED, **_get_batcher().stats()}
+
+@router.get("/pool_stats")
+def pool_stats():
+    """Process pool ML: số worker đã load model, task đang chờ, timeout / restart / fallback về threadpool."""
+    return pool.stats()
+
+@router.get("/ready")
+def ml_ready():
+    """Readiness của riêng ML: 200 khi bundle đã load + warm-up, 503 khi đang load / lỗi."""
+    from fastapi.responses import JSONResponse
+    state = load_state()
+    ready = registry.current is not None
+    if not ready and state["status"] == "pending":
+        start_background_load()
+        state = load_state()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **state})
 
 @router.get("/ml_health")
 def ml_health():
-    name = type(model).__name__ if model is not None else None
-    return {"loaded": model is not None, "model_type": name}
+    b = registry.current
+    return {"loaded": b is not None,
+            "model_type": type(b.model).__name__ if b is not None and b.model is not None else None,
+            "engine": b.engine if b is not None else None,
+            "model_version": b.version if b is not None else None,
+            "cache": _pred_cache.stats(),
+            "pool": {k: pool.stats()[k] for k in ("enabled", "workers", "ready", "version")},
+            "simple_grid": b.simple_grid.stats() if b is not None and b.simple_grid is not None else None}
 
 @router.get("/debug_pipeline")
 def debug_pipeline():
     from sklearn.compose import ColumnTransformer
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    info = {"type": type(model).__name__, "steps": [n for n,_ in getattr(model, "steps", [])]}
-    pre = getattr(model, "named_steps", {}).get("pre", None)
+    m = current_bundle().model
+    if m is None:
+        raise HTTPException(status_code=409, detail="Pipeline not loaded in this worker (ML_MODEL_FORMAT=mmap)")
+    info = {"type": type(m).__name__, "steps": [n for n,_ in getattr(m, "steps", [])]}
+    pre = getattr(m, "named_steps", {}).get("pre", None)
     info["pre_type"] = str(type(pre)) if pre is not None else None
     if isinstance(pre, ColumnTransformer):
         tfms = getattr(pre, "transformers_", None) or getattr(pre, "transformers", None)
@@ -333,16 +949,17 @@ def versions():
     return {"python": sys.version, "sklearn": sklearn.__version__, "xgboost": xgboost.__version__}
 
 @router.post("/explain_full")
-def explain_full(payload: CardioFullInput, top_k: int = 6):
+def explain_full(payload: CardioFullInput, top_k: int = 6, mode: Literal[EXPLAIN_MODES] = "shap"):
     """
-    Trả về giải thích SHAP cho 1 mẫu (class 1 = nguy cơ cao):
+    Trả về giải thích SHAP cho 1 mẫu (class 1 = nguy cơ cao).
+    mode: shap (shap.TreeExplainer) | exact (pred_contribs của booster, cùng giá trị, không qua package shap)
+    | approx (approx_contribs — Saabas, nhanh hơn ~50x với batch, xấp xỉ). Cùng dạng kết quả:
     - base_value (logit), base_prob (sigmoid)
     - prob dự đoán
     - danh sách đóng góp theo feature (name, shap_value)
     - top_up (đẩy tăng rủi ro), top_down (giảm rủi ro)
     """
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+    b = current_bundle()
 
     # 1) build raw features
     X_raw = build_feature_df(
@@ -353,29 +970,18 @@ def explain_full(payload: CardioFullInput, top_k: int = 6):
         gender=payload.gender,
     )
 
-    # 2) preprocess -> matrix
-    pre = model.named_steps["pre"]
-    X_trans = pre.transform(X_raw)
-    feat_names = list(map(str, pre.get_feature_names_out()))
-
-    # 3) prediction
-    y = model.predict(X_raw)
-    prob = None
-    if hasattr(model, "predict_proba"):
-        prob = float(model.predict_proba(X_raw)[0,1])
-
-    # 4) SHAP
-    explainer = _get_explainer()
-    # Với XGBoostClassifier, explainer.expected_value có thể là mảng 2 classes; lấy class 1
-    shap_values = explainer.shap_values(X_trans)
-    expected_value = explainer.expected_value
-    # chuẩn hoá về class-1 dạng số
-    if isinstance(shap_values, list):  # đôi khi trả list theo class
-        shap_row = shap_values[1][0]
-        if isinstance(expected_value, (list, tuple, np.ndarray)):
-            expected_value = float(expected_value[1])
-    else:
-        shap_row = shap_values[0]
+    # cache theo feature vector (+ top_k vì payload phụ thuộc top_k)
+    X = X_raw.to_numpy(dtype=float)
+    key = _cache_key("explain", X[0], b.version, int(top_k), mode)
+    hit = _pred_cache.get(key)
+    if hit is not MISSING:
+        return hit
+
+    # 2+3+4) preprocess 1 lần + prediction + SHAP (chuẩn hoá về class-1 dạng số); process pool nếu bật
+    y, p1, S, expected_value = _explain_rows(X, b, mode)
+    prob = float(p1[0])
+    feat_names = list(b.feature_names_out)
+    shap_row = S[0]
 
     # 5) đóng gói kết quả
     contrib = [{"feature": feat_names[i], "value": float(shap_row[i])}
@@ -385,7 +991,7 @@ def explain_full(payload: CardioFullInput, top_k: int = 6):
     up   = [c for c in contrib_sorted if c["value"] > 0][:top_k]   # đẩy tăng rủi ro
     down = [c for c in contrib_sorted if c["value"] < 0][:top_k]   # đẩy giảm rủi ro
 
-    return {
+    out = {
         "prediction": int(y[0]),
         "prob": prob,
         "base_value": float(expected_value),           # logit base
@@ -393,5 +999,60 @@ def explain_full(payload: CardioFullInput, top_k: int = 6):
         "top_up":   up,
         "top_down": down,
         "contributions": contrib_sorted,               # đầy đủ (để vẽ biểu đồ client)
+        "mode": mode,
         "note": "SHAP > 0: tăng xác suất class=1 (nguy cơ cao); SHAP < 0: giảm."
-    }
\ No newline at end of file
+    }
+    _pred_cache.set(key, out)
+    return out
+
+class ExplainBatchInput(BatchInput):
+    top_k: int = Field(6, ge=0, le=64, description="số feature top_up/top_down mỗi dòng")
+    full: bool = Field(False, description="trả kèm toàn bộ ma trận SHAP (n, n_feat)")
+    mode: Literal[EXPLAIN_MODES] = Field("shap", description="shap | exact | approx (xem /explain_full)")
+
+@router.post("/explain_batch")
+def explain_batch(payload: ExplainBatchInput):
+    """
+    Giải thích SHAP cho N dòng trong 1 lần TreeExplainer.shap_values (hoặc 1 lần pred_contribs, theo mode).
+    Kết quả dạng mảng gọn: danh sách `features` trả 1 lần, mỗi dòng chỉ có chỉ số + giá trị:
+    - top_up.idx / top_up.values: (n, top_k) feature đẩy tăng rủi ro mạnh nhất (idx=-1 nếu không đủ)
+    - top_down.idx / top_down.values: (n, top_k) feature kéo giảm rủi ro mạnh nhất
+    - values: ma trận SHAP đầy đủ (chỉ khi full=true)
+    """
+    b = current_bundle()
+    n = len(payload.rows)
+    if n > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"Too many rows: {n} > {MAX_BATCH_ROWS}")
+    feat_names = list(b.feature_names_out)
+    try:
+        X = build_feature_matrix(_raw_from_inputs(payload.rows))
+        if n:
+            labels, p1, S, expected_value = _explain_rows(X, b, payload.mode)
+        else:
+            labels, p1 = _score_matrix(X, b)
+            S, expected_value = np.empty((0, len(feat_names))), 0.0
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Explain failed: {e}")
+
+    k = payload.top_k
+    up_idx = _topk_idx(np.where(S > 0, S, -np.inf), k)
+    down_idx = _topk_idx(np.where(S < 0, -S, -np.inf), k)
+    take = lambda idx: np.where(idx >= 0, np.take_along_axis(S, np.maximum(idx, 0), axis=1), 0.0)
+
+    out = {
+        "count": n,
+        "features": feat_names,
+        "base_value": float(expected_value),
+        "base_prob": _sigmoid(float(expected_value)),
+        "predictions": labels.astype(int).tolist(),
+        "probs": p1.astype(float).tolist(),
+        "top_up":   {"idx": up_idx.tolist(),   "values": take(up_idx).tolist()},
+        "top_down": {"idx": down_idx.tolist(), "values": take(down_idx).tolist()},
+        "mode": payload.mode,
+        "note": "idx trỏ vào `features`; idx=-1 (value 0) là ô trống khi dòng có ít hơn top_k feature cùng dấu.",
+    }
+    if payload.full:
+        out["values"] = S.tolist()
+    return out
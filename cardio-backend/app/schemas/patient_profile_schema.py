@@ -0,0 +1,13 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class PatientProfileIn(BaseModel):
+    age: Optional[float] = Field(None, description="age in days")
+    height: Optional[float] = None
+    weight: Optional[float] = None
+    cholesterol: Optional[float] = Field(None, description="1..3")
+    gluc: Optional[float] = Field(None, description="1..3")
+    smoke: Optional[float] = Field(None, description="0/1")
+    alco: Optional[float] = Field(None, description="0/1")
+    active: Optional[float] = Field(None, description="0/1")
+    gender: Optional[float] = Field(None, description="1=female, 2=male")
@@ -1,34 +1,121 @@
 # app/services/iot_mqtt.py
-import json, threading
+import json, os, tempfile, threading
 import paho.mqtt.client as mqtt
 from datetime import datetime
 from typing import Dict, Any, Optional, List
+from app.core.config import settings
 from app.schemas.vital_schema import VitalIn
 from app.models.vital_model import Vital
+from app.services.vital_writer import VitalWriter
+from app.services.vitals_hub import VitalsHub
+from app.services.vitals_stats import FIELDS as STATS_FIELDS, RollingVitals
+from app.services.risk_stream import RiskStream
+from app.services.vitals_latest import LatestWatcher, open_latest, fcntl
 
-# cache realtime (in-memory)
-_latest: Dict[str, Dict[str, Any]] = {}
+# vital mới nhất mỗi bệnh nhân: bảng shared memory chung mọi worker uvicorn (IOT_LATEST_SHM_NAME)
+latest = open_latest(settings.IOT_LATEST_MAX_PATIENTS, settings.IOT_LATEST_SHM_NAME or None,
+                     settings.IOT_LATEST_INSTANCE)
+
+# ghi Mongo theo lô (insert_many); start() trong startup của app, trước start_mqtt
+writer = VitalWriter(
+    batch_size=settings.IOT_WRITE_BATCH_SIZE,
+    flush_interval_ms=settings.IOT_WRITE_FLUSH_MS,
+    max_queue=settings.IOT_WRITE_MAX_QUEUE,
+    max_retries=settings.IOT_WRITE_MAX_RETRIES,
+)
+# fan-out realtime tới WebSocket /iot/ws/vitals*
+hub = VitalsHub(max_queue=settings.IOT_WS_QUEUE_SIZE)
+# thống kê trượt 1/5/15 phút + điểm cảnh báo sớm theo bệnh nhân (bộ nhớ cố định)
+rolling = RollingVitals(max_patients=settings.IOT_STATS_MAX_PATIENTS, block_s=settings.IOT_STATS_BLOCK_S)
+# chấm lại rủi ro CVD theo lô từ huyết áp đã làm mượt + hồ sơ tĩnh; start() trong startup của app
+risk = RiskStream(
+    rolling, hub,
+    interval_ms=settings.RISK_INTERVAL_MS,
+    bp_threshold=settings.RISK_BP_THRESHOLD,
+    min_interval_s=settings.RISK_MIN_INTERVAL_S,
+    window=settings.RISK_WINDOW,
+)
+# vital do worker khác ghi vào bảng (MQTT chỉ ở 1 worker, /iot/push ở worker bất kỳ) → ingest_remote trên worker
+# này; start() khi bảng là shared
+latest_watcher = LatestWatcher(latest, hub, interval_ms=settings.IOT_LATEST_WATCH_MS,
+                               ingest=lambda patient, ts, data: ingest_remote(patient, ts, data))
+# payload MQTT không parse / validate được
+invalid_messages = 0
 
 def get_latest(patient: str) -> Optional[Dict[str, Any]]:
-    return _latest.get(patient)
+    return latest.get(patient)
 
 async def persist_vital(v: VitalIn):
     doc = Vital(**v.model_dump())
     await doc.insert()
 
+def stats_topic(patient: str) -> str:
+    """Topic hub cho thống kê của 1 bệnh nhân (WebSocket chỉ nhận khi opt-in ?stats=true)."""
+    return f"stats:{patient}"
+
+def publish_vital(v: VitalIn, data: Dict[str, Any], from_thread: bool = False):
+    """Phần realtime của ingestion: latest, thống kê trượt, fan-out vital (+ thống kê nếu có người xem)."""
+    slot = latest.put(v)
+    if slot is not None:
+        latest_watcher.mark_local(*slot)
+    _fan_out(v.patient, v.ts, {f: getattr(v, f) for f in STATS_FIELDS}, data,
+             hub.publish_threadsafe if from_thread else hub.publish)
+
+def ingest_remote(patient: str, ts: datetime, data: Dict[str, Any]):
+    """Vital do worker khác nhận (đọc từ log bảng latest, trên event loop): như publish_vital, trừ ghi bảng."""
+    _fan_out(patient, ts, data, data, hub.publish)
+
+def _fan_out(patient: str, ts: datetime, values: Dict[str, Any], data: Dict[str, Any], publish):
+    rolling.add(patient, ts, [values.get(f) for f in STATS_FIELDS])
+    if values.get("sbp") is not None or values.get("dbp") is not None:
+        risk.notify(patient)   # chỉ đánh dấu; chấm điểm theo lô ở risk task
+    # đẩy tới các WebSocket đang xem bệnh nhân này (serialize 1 lần cho mọi viewer)
+    publish(patient, data)
+    topic = stats_topic(patient)
+    if hub.has_subscribers(topic):
+        publish(topic, {"type": "stats", **rolling.summary(patient)})
+
 def _on_message(client, userdata, msg):
+    # chạy trên network thread của paho: không được chạm vào event loop ngoài writer.submit
+    global invalid_messages
     try:
         data = json.loads(msg.payload.decode())
         v = VitalIn(**data)
     except Exception:
+        invalid_messages += 1
         return
-    # cập nhật cache realtime
-    _latest[v.patient] = data
-    # lưu Mongo (không await được trong callback thread) → fire & forget
-    import asyncio
-    loop = asyncio.get_event_loop()
-    if loop.is_running():
-        loop.create_task(persist_vital(v))
+    # cache realtime + thống kê + WebSocket (tính toán trên thread MQTT, loop chỉ nhận text đã serialize)
+    publish_vital(v, data, from_thread=True)
+    # lưu Mongo: xếp hàng cho writer (không chặn thread MQTT; hàng đợi đầy → bỏ + đếm)
+    writer.submit(v)
+
+def ingest_stats() -> Dict[str, Any]:
+    return dict(writer.stats(), invalid_messages=invalid_messages, rolling=rolling.stats(), risk=risk.stats(),
+                latest=dict(latest.stats(), watcher=latest_watcher.stats()))
+
+# vai trò chỉ 1 worker được giữ ("mqtt", "archive") -> fd file khoá đang flock
+_claims: Dict[str, int] = {}
+
+def _claim(role: str) -> bool:
+    """flock không chờ trên file khoá theo vai trò, giữ tới khi process thoát; bảng không shared → luôn True."""
+    if not latest.shared or role in _claims:
+        return True
+    fd = os.open(os.path.join(tempfile.gettempdir(), f"{latest.name}.{role}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _claims[role] = fd
+    return True
+
+def claim_mqtt() -> bool:
+    """Chỉ 1 worker giữ kết nối MQTT (client_id cố định)."""
+    return _claim("mqtt")
+
+def claim_archive() -> bool:
+    """Chỉ 1 worker chạy job lưu trữ vitals (compact_once nhiều worker cùng lúc sẽ ghi đè chunk của nhau)."""
+    return _claim("archive")
 
 def start_mqtt(host: str, port: int) -> mqtt.Client:
     client = mqtt.Client(client_id="cardio-backend")
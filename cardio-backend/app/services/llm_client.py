@@ -0,0 +1,88 @@
+# app/services/llm_client.py
+# Client LLM bất đồng bộ cho chatbot: 1 interface (generate / stream), backend chọn theo LLM_BACKEND.
+# - gemini: SDK google.generativeai (generate_content_async, stream=True), import + cấu hình trễ ở lần gọi đầu;
+# - stub:   trả lời cố định sinh từ câu hỏi, không gọi mạng (test / dev không có API key).
+import asyncio, os, threading
+from typing import AsyncIterator, Optional
+
+
+class LLMUnavailable(RuntimeError):
+    """Backend chưa cấu hình được (thiếu API key / SDK)."""
+
+
+class LLMClient:
+    name = "base"
+
+    async def generate(self, prompt: str) -> str:
+        parts = [p async for p in self.stream(prompt)]
+        return "".join(parts)
+
+    def stream(self, prompt: str) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+
+class GeminiClient(LLMClient):
+    name = "gemini"
+
+    def __init__(self, model_name: str = "gemini-1.5-flash", api_key: Optional[str] = None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                api_key = self.api_key or os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise LLMUnavailable("GEMINI_API_KEY not found in environment variables.")
+                try:
+                    import google.generativeai as genai
+                except ImportError as e:
+                    raise LLMUnavailable(f"google-generativeai not installed: {e}") from e
+                genai.configure(api_key=api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    async def generate(self, prompt: str) -> str:
+        # lần đầu import SDK (chậm) → ngoài event loop
+        model = self._model or await asyncio.to_thread(self._get_model)
+        response = await model.generate_content_async(prompt)
+        return response.text
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        model = self._model or await asyncio.to_thread(self._get_model)
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            text = getattr(chunk, "text", "")
+            if text:
+                yield text
+
+
+class StubClient(LLMClient):
+    """Trả lời giả định, tách theo từ; delay_ms giữa các token để mô phỏng streaming."""
+    name = "stub"
+
+    def __init__(self, delay_ms: float = 0.0):
+        self.delay_s = max(0.0, delay_ms / 1000.0)
+        self.calls = 0
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        self.calls += 1
+        question = prompt.rsplit("Câu hỏi của người dùng:", 1)[-1].strip().strip('"')
+        reply = (f"[stub] Bạn hỏi: \"{question}\". Thông tin chỉ mang tính tham khảo, "
+                 f"hãy hỏi ý kiến bác sĩ chuyên khoa tim mạch.")
+        for i, word in enumerate(reply.split(" ")):
+            if self.delay_s:
+                await asyncio.sleep(self.delay_s)
+            yield word if i == 0 else " " + word
+
+
+def make_client(backend: str, model_name: str = "gemini-1.5-flash") -> LLMClient:
+    if backend == "gemini":
+        return GeminiClient(model_name)
+    if backend == "stub":
+        return StubClient()
+    raise ValueError(f"unknown LLM backend {backend!r} (expected 'gemini' or 'stub')")
@@ -0,0 +1,117 @@
+# app/services/ml_batcher.py
+# Gom các request 1 dòng đồng thời thành 1 batch (micro-batching) trước khi chấm model:
+# request xếp hàng, được flush khi đủ max_batch dòng hoặc sau max_wait_ms kể từ dòng đầu tiên,
+# mỗi caller nhận lại đúng dòng kết quả của mình. Mỗi dòng mang theo `arg` (vd. bundle model lúc nhận
+# request); 1 lần flush gọi fn riêng cho từng arg → dòng luôn được chấm bằng đúng model caller đã thấy.
+import asyncio, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+from app.core.metrics import Histogram, LATENCY_MS_BUCKETS
+
+
+class BatcherOverloaded(Exception):
+    """Hàng đợi đầy (vượt max_queue) — caller nên trả 503."""
+
+
+class MicroBatcher:
+    def __init__(self, fn: Callable[[np.ndarray, Any], Tuple[np.ndarray, ...]], *,
+                 max_batch: int = 64, max_wait_ms: float = 2.0, max_queue: int = 1024,
+                 name: str = "ml"):
+        """
+        fn(X, arg): ma trận (n, d) + arg chung của các dòng → tuple các mảng có chiều đầu n (vd. (labels, probs)).
+        fn chạy trong threadpool của event loop nên không chặn loop.
+        """
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.name = name
+        self.queue_wait_ms = Histogram(f"{name}_batch_queue_wait_ms", LATENCY_MS_BUCKETS,
+                                       "thời gian 1 request chờ trong hàng đợi trước khi được chấm")
+        self.batch_size = Histogram(f"{name}_batch_size", (1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+                                    "số dòng mỗi lần gọi model")
+        self.rejected = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, row: np.ndarray, arg: Any = None):
+        """Xếp 1 dòng vào hàng đợi, chờ tới khi batch chứa nó được chấm bằng fn(X, arg) → tuple kết quả của dòng."""
+        self._ensure_worker()
+        fut = self._loop.create_future()
+        try:
+            self._queue.put_nowait((row, arg, fut, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise BatcherOverloaded(f"{self.name} batch queue full ({self.max_queue})")
+        return await fut
+
+    async def _collect(self) -> List:
+        items = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch:
+            # lấy hết những gì đã có sẵn trước, chỉ chờ khi hàng đợi rỗng
+            try:
+                items.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            # bỏ các caller đã huỷ (client disconnect) trước khi chấm
+            items = [it for it in items if not it[2].cancelled()]
+            if not items:
+                continue
+            now = time.perf_counter()
+            for *_, t0 in items:
+                self.queue_wait_ms.observe((now - t0) * 1000.0)
+            # model đổi giữa chừng: dòng của từng arg (theo object) được chấm riêng
+            groups: Dict[int, List] = {}
+            for it in items:
+                groups.setdefault(id(it[1]), []).append(it)
+            for group in groups.values():
+                self.batch_size.observe(len(group))
+                await self._flush(loop, group)
+
+    async def _flush(self, loop, items: List):
+        try:
+            X = np.vstack([it[0] for it in items])
+            outs = await loop.run_in_executor(None, self.fn, X, items[0][1])
+        except Exception as e:
+            for _, _, fut, _ in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for i, (_, _, fut, _) in enumerate(items):
+            if not fut.done():
+                fut.set_result(tuple(o[i] for o in outs))
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_queue": self.max_queue,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "rejected": self.rejected,
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
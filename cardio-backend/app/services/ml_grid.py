@@ -0,0 +1,73 @@
+# app/services/ml_grid.py
+# Bảng tra rủi ro cho /ml/predict_simple: form rút gọn chỉ có 4 input rời rạc (tuổi, giới, cholesterol,
+# huyết áp tâm thu), các field khác luôn NaN → không gian input hữu hạn. Chấm trước toàn bộ lưới
+# (kể cả ô "thiếu" của từng trục) 1 lần cho mỗi phiên bản model; request chỉ còn là 1 phép index.
+from typing import Optional
+import numpy as np
+
+AGE_YEARS = (0, 120)        # tuổi (năm), gồm 2 đầu
+BP_SYSTOLIC = (60, 250)     # ap_hi (mmHg), gồm 2 đầu
+CHOLESTEROL = (1, 3)
+GENDERS = (1.0, 2.0)        # 1=female, 2=male (như CardioFullInput)
+
+
+class SimpleGrid:
+    """
+    probs[a, g, c, p] với chỉ số 0 của mỗi trục = thiếu (NaN), sau đó là các giá trị hợp lệ tăng dần.
+    Giá trị ngoài lưới, hoặc lưới chưa chấm xong (probs None) → lookup trả None (caller chấm bằng model).
+    """
+
+    def __init__(self):
+        self.ages = np.arange(AGE_YEARS[0], AGE_YEARS[1] + 1, dtype=float)
+        self.chols = np.arange(CHOLESTEROL[0], CHOLESTEROL[1] + 1, dtype=float)
+        self.bps = np.arange(BP_SYSTOLIC[0], BP_SYSTOLIC[1] + 1, dtype=float)
+        self.shape = (len(self.ages) + 1, len(GENDERS) + 1, len(self.chols) + 1, len(self.bps) + 1)
+        self.probs: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def raw_inputs(self, fields) -> np.ndarray:
+        """Mọi ô của lưới dưới dạng ma trận input thô (size, len(fields)) theo FULL_INPUT_FIELDS, thứ tự C."""
+        axes = [np.concatenate([[np.nan], a]) for a in
+                (self.ages * 365, np.asarray(GENDERS), self.chols, self.bps)]
+        a, g, c, p = (m.ravel() for m in np.meshgrid(*axes, indexing="ij"))
+        raw = np.full((self.size, len(fields)), np.nan)
+        for name, col in (("age", a), ("gender", g), ("cholesterol", c), ("ap_hi", p)):
+            raw[:, list(fields).index(name)] = col
+        return raw
+
+    @staticmethod
+    def _slot(value, lo: int, hi: int) -> Optional[int]:
+        if value is None:
+            return 0
+        if value != int(value) or not lo <= value <= hi:
+            return None
+        return int(value) - lo + 1
+
+    def index(self, age: Optional[float], gender: Optional[float], cholesterol: Optional[float],
+              bp: Optional[float]) -> Optional[tuple]:
+        ia = self._slot(age, *AGE_YEARS)
+        ic = self._slot(cholesterol, *CHOLESTEROL)
+        ip = self._slot(bp, *BP_SYSTOLIC)
+        ig = 0 if gender is None else (GENDERS.index(gender) + 1 if gender in GENDERS else None)
+        if None in (ia, ig, ic, ip):
+            return None
+        return ia, ig, ic, ip
+
+    def lookup(self, age, gender, cholesterol, bp) -> Optional[float]:
+        idx = self.index(age, gender, cholesterol, bp)
+        if idx is None or self.probs is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return float(self.probs[idx])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        kb = round(self.probs.nbytes / 1024, 1) if self.probs is not None else 0
+        return {"ready": self.probs is not None, "cells": self.size, "memory_kb": kb, "hits": self.hits,
+                "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0}
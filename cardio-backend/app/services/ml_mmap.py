@@ -0,0 +1,176 @@
+# app/services/ml_mmap.py
+# Định dạng artifact nhị phân cho nhiều worker uvicorn: Pipeline được compile 1 lần
+# (NativePredictor + mảng cây của shap TreeExplainer) rồi ghi thành các file .npy + manifest.json.
+# Worker mở bằng np.load(mmap_mode="r") → mọi process dùng chung page cache read-only của OS,
+# không ai phải unpickle Pipeline hay dựng TreeExplainer riêng.
+import json, os, shutil
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+from app.services.ml_native import NativePredictor
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+NATIVE_ARRAYS = ("num_src", "num_dst", "num_offset", "num_scale", "oh_src", "oh_dst", "oh_value",
+                 "left", "right", "feat", "thresh", "default_left", "value")
+SHAP_ARRAYS = ("children_left", "children_right", "children_default", "features",
+               "thresholds", "values", "node_sample_weight", "base_offset")
+
+
+class MmapTreeExplainer:
+    """
+    Tree SHAP (tree_path_dependent, output margin) chạy thẳng trên mảng cây memmap qua C extension
+    của shap — cùng thuật toán TreeExplainer dùng cho model "internal". expected_value lấy từ
+    explainer gốc lúc export (để S.sum + expected_value = margin như đường pickle).
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], *, max_depth: int, expected_value: float):
+        self.arrays = arrays
+        self.max_depth = int(max_depth)
+        self.expected_value = float(expected_value)
+
+    def shap_values(self, X) -> np.ndarray:
+        from shap import _cext
+        from shap.explainers._tree import feature_perturbation_codes, output_transform_codes
+
+        a = self.arrays
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        phi = np.zeros((X.shape[0], X.shape[1] + 1, 1))
+        _cext.dense_tree_shap(
+            a["children_left"], a["children_right"], a["children_default"], a["features"],
+            a["thresholds"], a["values"], a["node_sample_weight"], self.max_depth,
+            X, np.isnan(X), None, None, None, a["values"].shape[0], a["base_offset"], phi,
+            feature_perturbation_codes["tree_path_dependent"], output_transform_codes["identity"], False,
+        )
+        return phi[:, :-1, 0]
+
+
+class MmapArtifacts:
+    """Artifact đã mở: predictor + explainer trỏ vào các mảng memmap (read-only, dùng chung giữa process)."""
+
+    def __init__(self, directory: str, manifest: dict, native: NativePredictor, explainer: MmapTreeExplainer):
+        self.directory = directory
+        self.manifest = manifest
+        self.native = native
+        self.explainer = explainer
+
+    @property
+    def sha256(self) -> str:
+        return self.manifest["sha256"]
+
+    @property
+    def threshold(self) -> float:
+        return float(self.manifest["threshold"])
+
+    @property
+    def feature_names_out(self) -> List[str]:
+        return list(self.manifest["feature_names_out"])
+
+
+def artifact_dir(root: str, sha256: str) -> str:
+    """Thư mục artifact theo nội dung file model (cùng file .pkl → dùng lại artifact đã export)."""
+    return os.path.join(root, sha256[:16])
+
+
+def export_artifacts(out_dir: str, *, sha256: str, native: NativePredictor, explainer,
+                     feature_names_out: List[str], threshold: float,
+                     verify_X: np.ndarray, verify_p1: np.ndarray):
+    """
+    Ghi artifact vào out_dir (thư mục mới). explainer: shap.TreeExplainer đã dựng từ model.
+    verify_X / verify_p1: mẫu cố định + prob tham chiếu của Pipeline gốc, dùng kiểm tra lúc mở.
+    """
+    os.makedirs(out_dir)
+    t = explainer.model
+    if getattr(t, "num_outputs", 1) != 1:
+        raise NotImplementedError("only single-output tree models are supported")
+    arrays = {f"native.{k}": np.ascontiguousarray(getattr(native, k)) for k in NATIVE_ARRAYS}
+    arrays.update({f"shap.{k}": np.ascontiguousarray(getattr(t, k)) for k in SHAP_ARRAYS})
+    arrays["verify.X"] = np.ascontiguousarray(verify_X, dtype=float)
+    arrays["verify.p1"] = np.ascontiguousarray(verify_p1, dtype=float)
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr, allow_pickle=False)
+
+    expected_value = np.asarray(explainer.expected_value, dtype=float).ravel()
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "sha256": sha256,
+        "threshold": float(threshold),
+        "feature_names_in": list(native.feature_names_in),
+        "feature_names_out": list(map(str, feature_names_out)),
+        "native": {
+            "n_out": native.n_out, "n_trees": native.n_trees, "max_nodes": native.max_nodes,
+            "depth": native.depth, "base_margin": native.base_margin,
+            "classes": np.asarray(native.classes).tolist(),
+        },
+        "shap": {"max_depth": int(t.max_depth), "expected_value": float(expected_value[-1])},
+        "arrays": {k: {"dtype": str(v.dtype), "shape": list(v.shape)} for k, v in arrays.items()},
+    }
+    # manifest ghi sau cùng: có manifest ⇒ mọi file .npy đã đầy đủ
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def ensure_artifacts(root: str, sha256: str, export: Callable[[str], None]) -> str:
+    """
+    Trả về thư mục artifact cho sha256, gọi export(tmp_dir) nếu chưa có.
+    Nhiều worker khởi động cùng lúc: chỉ 1 process export (flock), các process khác chờ rồi dùng lại.
+    Export vào thư mục tạm rồi os.rename ⇒ không ai thấy artifact dở dang.
+    """
+    target = artifact_dir(root, sha256)
+    if os.path.exists(os.path.join(target, MANIFEST)):
+        return target
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, f".{sha256[:16]}.lock"), "w") as lock:
+        try:
+            import fcntl
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except ImportError:   # Windows: không có flock, rename nguyên tử vẫn đảm bảo đúng
+            pass
+        if os.path.exists(os.path.join(target, MANIFEST)):
+            return target
+        tmp = f"{target}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            export(tmp)
+            shutil.rmtree(target, ignore_errors=True)   # thư mục hỏng (thiếu manifest) từ lần trước
+            os.rename(tmp, target)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return target
+
+
+def load_artifacts(directory: str, *, verify: bool = True, atol: float = 1e-5) -> MmapArtifacts:
+    """Mở artifact bằng memmap. verify=True: chấm lại mẫu cố định và so với prob đã lưu lúc export."""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise RuntimeError(f"unsupported artifact format {manifest.get('format_version')!r}")
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        arr = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+        if str(arr.dtype) != spec["dtype"] or list(arr.shape) != spec["shape"]:
+            raise RuntimeError(f"artifact array {name!r} does not match manifest")
+        arrays[name] = arr
+
+    nat = manifest["native"]
+    native = NativePredictor(
+        feature_names_in=manifest["feature_names_in"], n_out=nat["n_out"],
+        **{k: arrays[f"native.{k}"] for k in NATIVE_ARRAYS},
+        n_trees=nat["n_trees"], max_nodes=nat["max_nodes"], depth=nat["depth"],
+        base_margin=nat["base_margin"], classes=nat["classes"],
+    )
+    explainer = MmapTreeExplainer(
+        {k: arrays[f"shap.{k}"] for k in SHAP_ARRAYS},
+        max_depth=manifest["shap"]["max_depth"], expected_value=manifest["shap"]["expected_value"],
+    )
+    if verify:
+        got = native.predict_proba(arrays["verify.X"])[:, 1]
+        diff = float(np.max(np.abs(got - arrays["verify.p1"])))
+        if diff > atol:
+            raise RuntimeError(f"artifact verification failed (max |diff|={diff:.2e})")
+    return MmapArtifacts(directory, manifest, native, explainer)
@@ -0,0 +1,220 @@
+# app/services/ml_native.py
+# Engine inference thuần NumPy: compile Pipeline(pre=ColumnTransformer, clf=XGBClassifier)
+# thành các mảng phẳng (tham số scale/one-hot + cây dạng mảng chỉ số node),
+# rồi duyệt toàn bộ batch × toàn bộ cây bằng phép gather vector hoá.
+import json
+from typing import List, Optional, Tuple
+import numpy as np
+
+# Mẫu cố định để so khớp với model.predict_proba lúc load (đủ NaN và giá trị biên)
+VERIFY_ROWS = 256
+VERIFY_ATOL = 1e-5
+# Trên ngưỡng này predictor C++ của xgboost nhanh hơn phép gather NumPy → batch lớn đi đường sklearn
+ONLINE_MAX_ROWS = 64
+
+
+class NativePredictor:
+    """Pipeline đã compile. Input là ma trận feature THÔ (n, n_in) theo thứ tự `feature_names_in`."""
+
+    def __init__(self, *, feature_names_in: List[str], n_out: int,
+                 num_src, num_dst, num_offset, num_scale,
+                 oh_src, oh_dst, oh_value,
+                 left, right, feat, thresh, default_left, value,
+                 n_trees: int, max_nodes: int, depth: int, base_margin: float, classes):
+        self.feature_names_in = list(feature_names_in)
+        self.n_out = int(n_out)
+        # preprocessor
+        self.num_src, self.num_dst = num_src, num_dst
+        self.num_offset, self.num_scale = num_offset, num_scale
+        self.oh_src, self.oh_dst, self.oh_value = oh_src, oh_dst, oh_value
+        # cây: mảng phẳng (n_trees * max_nodes), lá trỏ về chính nó
+        self.left, self.right, self.feat = left, right, feat
+        self.thresh, self.default_left, self.value = thresh, default_left, value
+        self.n_trees, self.max_nodes = int(n_trees), int(max_nodes)
+        self.depth = int(depth)
+        self.base_margin = float(base_margin)
+        self.classes = np.asarray(classes)
+        # node gốc của từng cây trong mảng phẳng
+        self._offsets = (np.arange(self.n_trees, dtype=np.int32) * self.max_nodes)[None, :]
+
+    def transform(self, X_raw: np.ndarray) -> np.ndarray:
+        """Tương đương ColumnTransformer.transform: (n, n_in) -> (n, n_out)."""
+        X_raw = np.asarray(X_raw, dtype=float)
+        out = np.zeros((X_raw.shape[0], self.n_out), dtype=float)
+        out[:, self.num_dst] = (X_raw[:, self.num_src] - self.num_offset) / self.num_scale
+        # one-hot: NaN/giá trị lạ ≠ mọi category → cả nhóm = 0 (handle_unknown='ignore')
+        out[:, self.oh_dst] = X_raw[:, self.oh_src] == self.oh_value
+        return out
+
+    def margin(self, X_trans: np.ndarray) -> np.ndarray:
+        """Tổng leaf value của mọi cây + base margin (logit), duyệt cả batch cùng lúc."""
+        Xf = np.ascontiguousarray(X_trans, dtype=np.float32)
+        n, n_feat = Xf.shape
+        x_flat = Xf.ravel()
+        row_base = (np.arange(n, dtype=np.int32) * n_feat)[:, None]
+        node = np.repeat(self._offsets, n, axis=0)
+        for _ in range(self.depth):
+            x = x_flat.take(row_base + self.feat.take(node))
+            go_left = np.where(np.isnan(x), self.default_left.take(node), x < self.thresh.take(node))
+            node = np.where(go_left, self.left.take(node), self.right.take(node))
+        return self.base_margin + self.value.take(node).sum(axis=1, dtype=np.float64)
+
+    def predict_proba_transformed(self, X_trans: np.ndarray) -> np.ndarray:
+        """Prob class 1 từ ma trận đã preprocess."""
+        return 1.0 / (1.0 + np.exp(-self.margin(X_trans)))
+
+    def predict_proba(self, X_raw: np.ndarray) -> np.ndarray:
+        """(n, 2) giống sklearn predict_proba."""
+        p1 = self.predict_proba_transformed(self.transform(X_raw))
+        return np.column_stack([1.0 - p1, p1])
+
+
+def _compile_pre(pre, feature_names_in: List[str]):
+    """ColumnTransformer -> chỉ số cột nguồn/đích + tham số scale/one-hot."""
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    col_idx = {c: i for i, c in enumerate(feature_names_in)}
+    num_src, num_dst, num_offset, num_scale = [], [], [], []
+    oh_src, oh_dst, oh_value = [], [], []
+    pos = 0
+    for name, trans, cols in pre.transformers_:
+        if isinstance(trans, str) and trans == "drop":
+            continue
+        if isinstance(cols, slice) or (len(cols) and not isinstance(cols[0], str)):
+            cols = list(np.asarray(feature_names_in)[cols])
+        src = [col_idx[c] for c in cols]
+        if isinstance(trans, str) and trans == "passthrough":
+            num_src += src; num_offset += [0.0] * len(src); num_scale += [1.0] * len(src)
+            num_dst += list(range(pos, pos + len(src))); pos += len(src)
+        elif isinstance(trans, StandardScaler):
+            mean = trans.mean_ if trans.with_mean else np.zeros(len(src))
+            scale = trans.scale_ if trans.with_std else np.ones(len(src))
+            num_src += src; num_offset += list(mean); num_scale += list(scale)
+            num_dst += list(range(pos, pos + len(src))); pos += len(src)
+        elif isinstance(trans, OneHotEncoder):
+            if trans.drop is not None or trans.handle_unknown != "ignore" \
+                    or getattr(trans, "infrequent_categories_", None) is not None and any(
+                        c is not None for c in trans.infrequent_categories_):
+                raise NotImplementedError(f"OneHotEncoder '{name}': only drop=None, handle_unknown='ignore'")
+            for s, cats in zip(src, trans.categories_):
+                for c in cats:
+                    oh_src.append(s); oh_value.append(float(c)); oh_dst.append(pos); pos += 1
+        else:
+            raise NotImplementedError(f"Unsupported transformer '{name}': {type(trans).__name__}")
+    as_i = lambda a: np.asarray(a, dtype=np.int64)
+    as_f = lambda a: np.asarray(a, dtype=float)
+    return pos, dict(
+        num_src=as_i(num_src), num_dst=as_i(num_dst), num_offset=as_f(num_offset), num_scale=as_f(num_scale),
+        oh_src=as_i(oh_src), oh_dst=as_i(oh_dst), oh_value=as_f(oh_value),
+    )
+
+
+def _tree_depth(left: List[int], right: List[int]) -> int:
+    depth, frontier = 0, [0]
+    while True:
+        nxt = [c for n in frontier if left[n] != -1 for c in (left[n], right[n])]
+        if not nxt:
+            return depth
+        depth += 1; frontier = nxt
+
+
+def _compile_trees(clf):
+    """XGBClassifier (gbtree, binary:logistic) -> mảng node phẳng đã pad về cùng số node."""
+    if not np.isnan(getattr(clf, "missing", np.nan)):
+        raise NotImplementedError("only missing=nan is supported")
+    booster = clf.get_booster()
+    d = json.loads(booster.save_raw("json"))
+    learner = d["learner"]
+    if learner["objective"]["name"] != "binary:logistic":
+        raise NotImplementedError(f"objective {learner['objective']['name']!r} not supported")
+    gb = learner["gradient_booster"]
+    if gb["name"] != "gbtree":
+        raise NotImplementedError(f"booster {gb['name']!r} not supported")
+    trees = gb["model"]["trees"]
+    try:
+        best = clf.best_iteration  # có khi train với early stopping
+    except AttributeError:
+        best = None
+    if best is not None:
+        trees = trees[: (int(best) + 1) * int(gb["model"]["gbtree_model_param"]["num_parallel_tree"])]
+
+    max_nodes = max(len(t["left_children"]) for t in trees)
+    T = len(trees)
+    left = np.zeros((T, max_nodes), dtype=np.int32)
+    right = np.zeros((T, max_nodes), dtype=np.int32)
+    feat = np.zeros((T, max_nodes), dtype=np.int32)
+    thresh = np.zeros((T, max_nodes), dtype=np.float32)
+    dleft = np.zeros((T, max_nodes), dtype=bool)
+    value = np.zeros((T, max_nodes), dtype=np.float32)
+    depth = 0
+    for t, tr in enumerate(trees):
+        if any(tr["split_type"]):
+            raise NotImplementedError("categorical splits not supported")
+        lc, rc = tr["left_children"], tr["right_children"]
+        k = len(lc)
+        base = t * max_nodes
+        idx = np.arange(k)
+        is_leaf = np.asarray(lc) == -1
+        left[t, :k] = np.where(is_leaf, idx, lc) + base
+        right[t, :k] = np.where(is_leaf, idx, rc) + base
+        feat[t, :k] = np.where(is_leaf, 0, tr["split_indices"])
+        thresh[t, :k] = tr["split_conditions"]
+        dleft[t, :k] = np.asarray(tr["default_left"], dtype=bool)
+        # leaf value nằm trong split_conditions của node lá
+        value[t, :k] = np.where(is_leaf, tr["split_conditions"], 0.0)
+        depth = max(depth, _tree_depth(lc, rc))
+
+    base_score = float(learner["learner_model_param"]["base_score"])
+    base_margin = float(np.log(base_score / (1.0 - base_score)))
+    flat = dict(
+        left=left.ravel(), right=right.ravel(), feat=feat.ravel(),
+        thresh=thresh.ravel(), default_left=dleft.ravel(), value=value.ravel(),
+    )
+    return T, max_nodes, depth, base_margin, flat
+
+
+def compile_pipeline(model, feature_names_in: Optional[List[str]] = None) -> NativePredictor:
+    """Compile Pipeline đã fit. Raise NotImplementedError nếu gặp bước không hỗ trợ."""
+    pre, clf = model[:-1], model[-1]
+    if len(pre.steps) != 1:
+        raise NotImplementedError("expected exactly one preprocessing step")
+    pre = pre.steps[0][1]
+    names = list(feature_names_in if feature_names_in is not None else pre.feature_names_in_)
+    n_out, pre_params = _compile_pre(pre, names)
+    T, max_nodes, depth, base_margin, tree_params = _compile_trees(clf)
+    return NativePredictor(
+        feature_names_in=names, n_out=n_out, **pre_params, **tree_params,
+        n_trees=T, max_nodes=max_nodes, depth=depth, base_margin=base_margin,
+        classes=getattr(clf, "classes_", (0, 1)),
+    )
+
+
+def verification_sample(n: int = VERIFY_ROWS, seed: int = 0) -> np.ndarray:
+    """Ma trận feature THÔ cố định (theo BASE_FEATURE_COLUMNS) có cả NaN, dùng để so khớp."""
+    rng = np.random.default_rng(seed)
+    age = rng.integers(10_000, 24_000, n).astype(float)
+    height = rng.integers(140, 200, n).astype(float)
+    weight = rng.uniform(40, 130, n).round(1)
+    ap_hi = rng.integers(80, 200, n).astype(float)
+    ap_lo = rng.integers(50, 120, n).astype(float)
+    cols = [
+        age, height, weight, ap_hi, ap_lo,
+        np.floor(age / 365.0), weight / (height / 100.0) ** 2, ap_hi - ap_lo,
+        rng.integers(1, 3, n), rng.integers(1, 4, n), rng.integers(1, 4, n),
+        rng.integers(0, 2, n), rng.integers(0, 2, n), rng.integers(0, 2, n),
+    ]
+    X = np.column_stack(cols + [cols[8] - 1.0]).astype(float)
+    X[rng.random(X.shape) < 0.1] = np.nan
+    return X
+
+
+def verify(native: NativePredictor, model, columns: List[str],
+           X_raw: Optional[np.ndarray] = None, atol: float = VERIFY_ATOL) -> Tuple[bool, float]:
+    """So output native với model.predict_proba trên mẫu cố định -> (ok, max |diff|)."""
+    import pandas as pd
+
+    X_raw = verification_sample() if X_raw is None else X_raw
+    ref = model.predict_proba(pd.DataFrame(X_raw, columns=columns))[:, 1]
+    got = native.predict_proba(X_raw)[:, 1]
+    diff = float(np.max(np.abs(ref - got)))
+    return diff <= atol, diff
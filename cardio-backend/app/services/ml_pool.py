@@ -0,0 +1,260 @@
+# app/services/ml_pool.py
+# Process pool cho việc ML nặng CPU (SHAP, chấm batch lớn): chạy trong threadpool chung thì giữ GIL và làm
+# chậm /auth, /iot cùng worker uvicorn. Pool gồm ML_POOL_WORKERS process "spawn" sẵn, mỗi process load bundle
+# 1 lần (initializer); ma trận input / output đi qua shared memory (chỉ tên block + shape được pickle).
+# Mỗi task có timeout: quá hạn → kill các process của pool và dựng pool mới (task đang chạy không huỷ được).
+# ProcessPoolExecutor không kill riêng 1 worker được (1 process chết = cả pool hỏng) nên mọi task khác đang
+# chạy / chờ trên pool đó cũng hỏng theo: chúng không bị trả lỗi mà được chấm lại tại chỗ (MLPoolUnavailable),
+# đếm ở `collateral`. Model đổi (/ml/reload, /ml/rollback) → load(bundle) dựng pool mới, task đang chạy trên
+# pool cũ chạy nốt, task còn chờ bị huỷ và cũng chấm lại tại chỗ (collateral).
+import multiprocessing, os, threading, weakref
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+import numpy as np
+
+KINDS = ("score", "explain")
+
+
+class MLPoolUnavailable(RuntimeError):
+    """Pool tắt / chưa load xong model / đang dựng lại — caller chấm ngay trong thread hiện tại."""
+
+
+class MLPoolOverloaded(RuntimeError):
+    """Số task đang chờ vượt max_pending — caller nên trả 503."""
+
+
+class MLPoolTimeout(RuntimeError):
+    """Task chạy quá timeout_s — pool đã được dựng lại, caller nên trả 504."""
+
+
+def _out_layout(n: int, n_feat: int):
+    """Vị trí các mảng kết quả trong block output: probs (n,) f8, labels (n,) i8, contribs (n, n_feat) f8."""
+    return (("probs", (n,), np.float64, 0),
+            ("labels", (n,), np.int64, 8 * n),
+            ("contribs", (n, n_feat), np.float64, 16 * n))
+
+
+def _out_nbytes(n: int, n_feat: int) -> int:
+    return 16 * n + 8 * n * n_feat
+
+
+def _views(buf, n: int, n_feat: int) -> dict:
+    return {name: np.ndarray(shape, dtype=dtype, buffer=buf, offset=off)
+            for name, shape, dtype, off in _out_layout(n, n_feat)}
+
+
+# ---- phía worker process ----
+_worker = {"bundle": None}
+
+
+def _init_worker(path: str, version: str):
+    from app.routers import ml
+    ml.settings.ML_SIMPLE_GRID = False    # lưới predict_simple chỉ cần ở process chính
+    _worker["bundle"] = ml.build_bundle(path, version)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _run_task(kind: str, mode: str, path: str, version: str, in_name: str, shape: tuple,
+              out_name: str, n_feat: int) -> Optional[float]:
+    """Đọc X (n, 15) từ block input, ghi probs / labels (/ contribs) vào block output → base_value (explain)."""
+    from app.routers import ml
+    b = _worker["bundle"]
+    if b is None or b.version != version:
+        b = _worker["bundle"] = ml.build_bundle(path, version)
+    # process chính tạo + unlink block; worker spawn dùng chung resource_tracker với nó nên attach không bị coi là rò rỉ
+    shm_in, shm_out = SharedMemory(name=in_name), SharedMemory(name=out_name)
+    try:
+        X = np.ndarray(shape, dtype=np.float64, buffer=shm_in.buf)
+        out = _views(shm_out.buf, shape[0], n_feat if kind == "explain" else 0)
+        labels, p1, X_trans = ml._infer(X, b)
+        out["probs"][:] = p1
+        out["labels"][:] = labels
+        base = None
+        if kind == "explain":
+            S, base = ml._explain_matrix(X_trans, b, mode)
+            out["contribs"][:] = S
+        # mọi view vào buffer phải được giải phóng trước close()
+        del X, out, X_trans
+        return base
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+
+# ---- phía process chính ----
+class MLProcessPool:
+    def __init__(self, workers: int = 0, timeout_s: float = 30.0, max_pending: int = 32, min_rows: int = 1000):
+        """workers=0: tắt (mọi việc chạy trong threadpool như cũ). min_rows: batch chấm điểm nhỏ hơn → chấm tại chỗ."""
+        self.workers = max(0, int(workers))
+        self.timeout_s = float(timeout_s)
+        self.max_pending = max(1, int(max_pending))
+        self.min_rows = max(1, int(min_rows))
+        self.started = False
+        self.version: Optional[str] = None
+        self.ready = 0              # số worker của pool hiện tại đã load xong model
+        self.error: Optional[str] = None
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.collateral = 0         # task hỏng / bị huỷ vì pool bị thay (timeout của task khác, đổi model)
+        self.restarts = 0
+        self.fallbacks = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._bundle = None
+        self._retired = weakref.WeakSet()   # executor đã bị thay: lỗi của task trên đó không phải lỗi của task
+        self._lock = threading.RLock()   # _spawn (giữ lock) có thể gọi _on_ping ngay nếu future đã xong
+
+    @property
+    def enabled(self) -> bool:
+        return self.started and self.workers > 0
+
+    def start(self, bundle=None):
+        """Bật pool; process chỉ được spawn khi có bundle (ngay nếu truyền vào, hoặc ở lần load() tiếp theo)."""
+        self.started = True
+        if bundle is not None:
+            self.load(bundle)
+
+    def load(self, bundle):
+        """Model active đổi: dựng pool mới cho bundle; pool cũ shutdown không chờ (task đang chạy vẫn xong)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            old = self._executor
+            self._bundle = bundle
+            self._executor = self._spawn(bundle)
+            if old is not None:
+                self._retired.add(old)
+        if old is not None:
+            old.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        with self._lock:
+            ex, self._executor = self._executor, None
+            self.started = False
+            self.version, self.ready = None, 0
+        if ex is not None:
+            self._kill(ex)
+
+    def _spawn(self, bundle) -> ProcessPoolExecutor:
+        # spawn: không fork process chính (đang có event loop + thread), mỗi worker import lại app + load model
+        ex = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(bundle.path, bundle.version))
+        self.version, self.ready, self.error = bundle.version, 0, None
+        # submit đồng thời `workers` ping → executor spawn đủ số process ngay (pre-fork), không đợi request đầu
+        for _ in range(self.workers):
+            ex.submit(_ping).add_done_callback(lambda f, ex=ex: self._on_ping(ex, f))
+        return ex
+
+    def _on_ping(self, ex, fut):
+        with self._lock:
+            if ex is not self._executor or fut.cancelled():
+                return
+            if fut.exception() is not None:
+                self.error = f"worker failed to load model: {fut.exception()!r}"
+            else:
+                self.ready += 1
+
+    @staticmethod
+    def _kill(ex: ProcessPoolExecutor):
+        """Huỷ task còn chờ + terminate process (API huỷ task đang chạy không có ở Python < 3.14)."""
+        # lấy danh sách process trước: shutdown() đặt ex._processes = None
+        procs = list((getattr(ex, "_processes", None) or {}).values())
+        ex.shutdown(wait=False, cancel_futures=True)
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+
+    def _restart(self, ex: ProcessPoolExecutor):
+        """Pool `ex` hỏng / bị treo: kill và dựng pool mới cho cùng bundle (nếu chưa có ai làm)."""
+        with self._lock:
+            if ex is not self._executor:
+                return
+            self.restarts += 1
+            self._retired.add(ex)
+            self._executor = self._spawn(self._bundle)
+        self._kill(ex)
+
+    def wants(self, rows: int, kind: str = "score") -> bool:
+        """Task này có nên chạy trong pool không (explain luôn; chấm điểm từ min_rows dòng)."""
+        return self.enabled and (kind == "explain" or rows >= self.min_rows)
+
+    def run(self, kind: str, X: np.ndarray, bundle, mode: str = "shap", n_feat: int = 0) -> dict:
+        """
+        Chạy 1 task trong pool (gọi từ thread, chặn tới khi xong) → {"probs", "labels"[, "contribs", "base"]}.
+        MLPoolUnavailable → caller tự chấm tại chỗ (cả khi pool bị dựng lại giữa chừng vì task khác quá hạn);
+        MLPoolOverloaded / MLPoolTimeout → 503 / 504; lỗi của chính task (ValueError...) được raise lại nguyên vẹn.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"unknown task kind {kind!r}")
+        with self._lock:
+            ex = self._executor
+            if not self.wants(len(X), kind):
+                raise MLPoolUnavailable("task below ML process pool thresholds")
+            if ex is None or self.ready == 0 or self.version != bundle.version:
+                self.fallbacks += 1
+                raise MLPoolUnavailable("ML process pool not ready for this model version")
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise MLPoolOverloaded(f"ML process pool busy ({self.pending} pending)")
+            self.pending += 1
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        n = len(X)
+        n_feat = n_feat if kind == "explain" else 0
+        shm_in = SharedMemory(create=True, size=max(1, X.nbytes))
+        shm_out = SharedMemory(create=True, size=max(1, _out_nbytes(n, n_feat)))
+        try:
+            np.ndarray(X.shape, dtype=np.float64, buffer=shm_in.buf)[:] = X
+            try:
+                fut = ex.submit(_run_task, kind, mode, bundle.path, bundle.version, shm_in.name, X.shape,
+                                shm_out.name, n_feat)
+            except (BrokenProcessPool, RuntimeError) as e:   # pool vừa bị thay / hỏng
+                self.fallbacks += 1
+                raise MLPoolUnavailable(str(e))
+            try:
+                base = fut.result(timeout=self.timeout_s)
+            except FuturesTimeout:
+                if ex in self._retired:     # pool bị thay khi task còn chờ / chạy: không phải lỗi của task này
+                    self.collateral += 1
+                    raise MLPoolUnavailable("ML process pool was replaced while the task was in flight")
+                self.timeouts += 1
+                if not fut.cancel():        # đã chạy → chỉ có thể kill worker
+                    self._restart(ex)
+                raise MLPoolTimeout(f"ML task exceeded {self.timeout_s:g}s")
+            except (BrokenProcessPool, CancelledError) as e:
+                if ex in self._retired:
+                    self.collateral += 1
+                    raise MLPoolUnavailable("ML process pool was replaced while the task was in flight")
+                self.failed += 1
+                self._restart(ex)
+                raise MLPoolUnavailable(f"ML worker died: {e!r}")
+            except Exception:
+                self.failed += 1
+                raise
+            views = _views(shm_out.buf, n, n_feat)
+            # copy ra khỏi shared memory trước khi giải phóng block
+            out = {k: v.copy() for k, v in views.items() if k != "contribs" or kind == "explain"}
+            del views
+            if kind == "explain":
+                out["base"] = base
+            self.completed += 1
+            return out
+        finally:
+            with self._lock:
+                self.pending -= 1
+            for shm in (shm_in, shm_out):
+                shm.close()
+                shm.unlink()
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "workers": self.workers, "ready": self.ready, "version": self.version,
+                "error": self.error, "pending": self.pending, "max_pending": self.max_pending,
+                "timeout_s": self.timeout_s, "min_rows": self.min_rows, "completed": self.completed,
+                "failed": self.failed, "rejected": self.rejected, "timeouts": self.timeouts,
+                "collateral": self.collateral, "restarts": self.restarts, "fallbacks": self.fallbacks}
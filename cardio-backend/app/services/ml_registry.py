@@ -0,0 +1,188 @@
+# app/services/ml_registry.py
+# Registry phiên bản model: mỗi lần upload được ghi thành file riêng (versions/<version>.pkl),
+# load + validate + warm-up trong worker thread, rồi mới swap 1 tham chiếu ModelBundle bất biến.
+# Request đang chạy giữ bundle cũ tới khi xong; N bundle trước đó được giữ trong RAM để rollback tức thì.
+import asyncio, contextlib, dataclasses, hashlib, os, threading, time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+ACTIVE_FILE = "ACTIVE"
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """Mọi thứ cần để phục vụ 1 phiên bản model; không bao giờ bị sửa sau khi tạo."""
+    version: str
+    path: str
+    sha256: str
+    model: Any                      # sklearn Pipeline(pre, clf); None khi engine == "mmap"
+    engine: str                     # "sklearn" | "native" | "mmap"
+    native: Any = None              # NativePredictor nếu engine == "native" / "mmap"
+    engine_note: Optional[str] = None
+    explainer: Any = None           # shap.TreeExplainer đã warm-up
+    feature_names_out: Tuple[str, ...] = ()
+    threshold: Optional[float] = None   # None → lấy model.threshold_ (xem routers/ml.py::_threshold)
+    simple_grid: Any = None         # SimpleGrid đã chấm sẵn cho /ml/predict_simple (services/ml_grid.py)
+    loaded_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def info(self) -> dict:
+        return {
+            "version": self.version, "path": self.path, "sha256": self.sha256,
+            "engine": self.engine, "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, root: str, keep: int = 3):
+        """root: thư mục chứa các file phiên bản; keep: số bundle cũ giữ lại để rollback."""
+        self.root = root
+        self.keep = max(0, int(keep))
+        self._current: Optional[ModelBundle] = None
+        self._history: Deque[ModelBundle] = deque()
+        self._pending: Dict[str, dict] = {}     # version -> thay đổi chờ áp khi bundle đó được activate
+        self._building: Set[str] = set()        # version đang build (chỉ các version này được giữ _pending)
+        self._swap_lock = threading.Lock()
+
+    # ---- đọc ----
+    @property
+    def current(self) -> Optional[ModelBundle]:
+        # đọc 1 tham chiếu là nguyên tử; handler nên lấy 1 lần rồi dùng suốt request
+        return self._current
+
+    def history(self) -> List[ModelBundle]:
+        return list(self._history)
+
+    def active_version_on_disk(self) -> Optional[str]:
+        """Phiên bản đang active lần chạy trước (file ACTIVE), nếu file model vẫn còn."""
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE)) as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version if version and os.path.exists(self.path_for(version)) else None
+
+    def path_for(self, version: str) -> str:
+        return os.path.join(self.root, f"{version}.pkl")
+
+    # ---- ghi ----
+    def write_version(self, data: bytes) -> Tuple[str, str]:
+        """Ghi bytes upload thành file phiên bản mới (tmp + os.replace, không bao giờ ghi đè file đang dùng)."""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256(data).hexdigest()
+        version = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{digest[:8]}"
+        path = self.path_for(version)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return version, path
+
+    def activate(self, bundle: ModelBundle, persist: bool = True) -> Optional[ModelBundle]:
+        """Swap nguyên tử sang `bundle`; bundle cũ vào history. Trả về bundle cũ."""
+        with self._swap_lock:
+            self._building.discard(bundle.version)
+            changes = self._pending.pop(bundle.version, None)
+            if changes:
+                bundle = dataclasses.replace(bundle, **changes)
+            prev = self._current
+            if prev is not None and prev.version != bundle.version:
+                self._history.appendleft(prev)
+            # bundle mới không được nằm trong history (vd. khi rollback)
+            self._history = deque(b for b in self._history if b.version != bundle.version)
+            evicted = []
+            while len(self._history) > self.keep:
+                evicted.append(self._history.pop())
+            self._current = bundle
+            if persist:
+                self._write_active(bundle.version)
+            self._remove_files(evicted)
+        return prev
+
+    def update(self, version: str, **changes):
+        """
+        Thay bundle `version` (current / history) bằng bản dataclasses.replace(..., **changes) — 1 lần swap
+        tham chiếu, bundle cũ không bị sửa. Đang build (xem building) → giữ tới lúc activate; version khác
+        (đã bị đẩy khỏi history, build lỗi, hoặc build ngoài registry như worker ml_pool) → bỏ.
+        """
+        with self._swap_lock:
+            found = False
+            if self._current is not None and self._current.version == version:
+                self._current = dataclasses.replace(self._current, **changes)
+                found = True
+            for i, b in enumerate(self._history):
+                if b.version == version:
+                    self._history[i] = dataclasses.replace(b, **changes)
+                    found = True
+            if not found and version in self._building:
+                self._pending.setdefault(version, {}).update(changes)
+
+    @contextlib.contextmanager
+    def building(self, version: str) -> Iterator[None]:
+        """Bao quanh build 1 version sắp activate: update() trong lúc đó được giữ; build lỗi → bỏ thay đổi chờ."""
+        with self._swap_lock:
+            self._building.add(version)
+        try:
+            yield
+        except BaseException:
+            with self._swap_lock:
+                self._building.discard(version)
+                self._pending.pop(version, None)
+            raise
+
+    def rollback(self, version: Optional[str] = None) -> ModelBundle:
+        """Quay về bundle trước đó (hoặc `version` cụ thể) — đã nằm sẵn trong RAM nên tức thì."""
+        for b in self._history:
+            if version is None or b.version == version:
+                self.activate(b)
+                return b
+        raise KeyError(version or "no previous version")
+
+    async def install(self, data: bytes, build: Callable[[str, str], ModelBundle]) -> ModelBundle:
+        """
+        Ghi file + build(path, version) (load, validate, warm-up) trong worker thread,
+        event loop không bị chặn; chỉ swap khi build thành công.
+        """
+        version, path = await asyncio.to_thread(self.write_version, data)
+        try:
+            with self.building(version):
+                bundle = await asyncio.to_thread(build, path, version)
+        except Exception:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise
+        self.activate(bundle)
+        return bundle
+
+    def _write_active(self, version: str):
+        if not os.path.isdir(self.root):
+            return
+        p = os.path.join(self.root, ACTIVE_FILE)
+        tmp = f"{p}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write(version)
+        os.replace(tmp, p)
+
+    def _remove_files(self, bundles: List[ModelBundle]):
+        """Xoá file của các bundle bị đẩy khỏi history (chỉ file nằm trong thư mục registry)."""
+        root = os.path.abspath(self.root)
+        for b in bundles:
+            p = os.path.abspath(b.path)
+            if os.path.dirname(p) == root:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
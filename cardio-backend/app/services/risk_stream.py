@@ -0,0 +1,198 @@
+# app/services/risk_stream.py
+# Chấm lại rủi ro tim mạch liên tục từ luồng vitals: hồ sơ tĩnh của bệnh nhân (tuổi, chiều cao, cân nặng,
+# cholesterol, ...) ghép với huyết áp đã làm mượt (mean cửa sổ trượt sbp/dbp của RollingVitals → ap_hi/ap_lo).
+# Ingestion chỉ đánh dấu bệnh nhân "bẩn" (O(1), không gọi model); 1 task nền mỗi interval_ms gom các bệnh
+# nhân bẩn, bỏ qua ai có huyết áp đổi < bp_threshold mmHg so với lần chấm trước, giãn cách tối thiểu
+# min_interval_s giữa 2 lần chấm 1 bệnh nhân, rồi chấm cả lô bằng 1 lần gọi model và đẩy kết quả lên hub.
+# Nhiều worker: mỗi worker chấm cho WebSocket / GET của chính nó (vitals của worker khác tới qua LatestWatcher);
+# hồ sơ PUT ở worker khác được nạp lại từ Mongo mỗi PROFILE_REFRESH_S.
+import asyncio, threading, time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Set
+import numpy as np
+from app.core.config import settings
+
+# hồ sơ tĩnh = FULL_INPUT_FIELDS của ML trừ ap_hi/ap_lo (lấy từ vitals)
+PROFILE_FIELDS = ("age", "height", "weight", "cholesterol", "gluc", "smoke", "alco", "active", "gender")
+BP_FIELDS = ("sbp", "dbp")
+PROFILE_REFRESH_S = 30.0
+
+
+def risk_topic(patient: str) -> str:
+    """Topic hub cho điểm rủi ro của 1 bệnh nhân (WebSocket chỉ nhận khi opt-in ?risk=true)."""
+    return f"risk:{patient}"
+
+
+class RiskStream:
+    def __init__(self, rolling, hub, *, interval_ms: int = 1000, bp_threshold: float = 5.0,
+                 min_interval_s: float = 60.0, window: str = "5m", max_batch: int = 5000):
+        if window not in rolling.windows:
+            raise ValueError(f"unknown window {window!r} (expected one of {sorted(rolling.windows)})")
+        self.rolling = rolling
+        self.hub = hub
+        self.interval_s = max(0.01, interval_ms / 1000.0)
+        self.bp_threshold = float(bp_threshold)
+        self.min_interval_s = float(min_interval_s)
+        self.window = window
+        self.max_batch = max(1, int(max_batch))
+        self._profiles: Dict[str, np.ndarray] = {}   # patient -> (11,) theo FULL_INPUT_FIELDS, ap_hi/ap_lo = NaN
+        self._dirty: Set[str] = set()
+        self._forced: Set[str] = set()               # hồ sơ vừa đổi: chấm lại bất kể ngưỡng / giãn cách
+        self._lock = threading.Lock()                # notify() được gọi từ thread MQTT
+        self._last: Dict[str, dict] = {}
+        self._last_mono: Dict[str, float] = {}
+        self._held: Set[str] = set()                 # bệnh nhân đang bị hoãn (đếm `deferred` 1 lần / lần hoãn)
+        self._version: Optional[str] = None
+        self._profiles_at: Optional[datetime] = None  # updated_at lớn nhất đã nạp từ Mongo
+        self._profiles_mono = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.scored = 0
+        self.skipped_small = 0
+        self.deferred = 0
+        self.no_profile = 0
+        self.last_batch = 0
+        self.last_run_s: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    # ---- đầu vào ----
+    def notify(self, patient: str):
+        """Gọi từ ingestion (thread bất kỳ) khi có vital mới mang huyết áp."""
+        with self._lock:
+            self._dirty.add(patient)
+
+    def set_profile(self, patient: str, profile: dict):
+        """Cập nhật hồ sơ tĩnh (dict theo PROFILE_FIELDS, thiếu/None = NaN); lượt sau chấm lại ngay."""
+        from app.routers.ml import FULL_INPUT_FIELDS
+        raw = np.full(len(FULL_INPUT_FIELDS), np.nan)
+        for f in PROFILE_FIELDS:
+            v = profile.get(f)
+            if v is not None:
+                raw[FULL_INPUT_FIELDS.index(f)] = float(v)
+        with self._lock:
+            self._profiles[patient] = raw
+            self._dirty.add(patient)
+            self._forced.add(patient)
+
+    async def load_profiles(self, changed_only: bool = False) -> int:
+        """Nạp mọi hồ sơ từ Mongo (startup); changed_only: chỉ hồ sơ có updated_at mới hơn lần nạp trước."""
+        from app.models.patient_profile_model import PatientProfile
+        flt = {"updated_at": {"$gt": self._profiles_at}} if changed_only and self._profiles_at else {}
+        self._profiles_mono = time.monotonic()
+        n = 0
+        async for d in PatientProfile.get_motor_collection().find(flt, {"_id": 0, "revision_id": 0}):
+            at = d.get("updated_at")
+            if at is not None and (self._profiles_at is None or at > self._profiles_at):
+                self._profiles_at = at
+            self.set_profile(d["patient"], d)
+            n += 1
+        return n
+
+    def latest(self, patient: str) -> Optional[dict]:
+        return self._last.get(patient)
+
+    # ---- vòng chấm điểm ----
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if time.monotonic() - self._profiles_mono >= PROFILE_REFRESH_S:
+                    await self.load_profiles(changed_only=True)
+                await self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[WARN] risk re-scoring failed: {e}")
+            await asyncio.sleep(self.interval_s)
+
+    def _select(self, patients: Set[str], forced: Set[str], now: float):
+        """-> (bệnh nhân cần chấm + huyết áp mượt, bệnh nhân hoãn sang lượt sau)."""
+        rows, later = [], []
+        for p in patients:
+            base = self._profiles.get(p)
+            if base is None:
+                self.no_profile += 1
+                continue
+            bp = self.rolling.means(p, self.window, BP_FIELDS)
+            if bp is None or all(x is None for x in bp):
+                continue
+            last = self._last.get(p)
+            if p not in forced and last is not None and last["model_version"] == self._version:
+                prev = (last["sbp"], last["dbp"])
+                changed = any((a is None) != (b is None) or (a is not None and abs(a - b) >= self.bp_threshold)
+                              for a, b in zip(bp, prev))
+                if not changed:
+                    self.skipped_small += 1
+                    continue
+                if now - self._last_mono[p] < self.min_interval_s:
+                    later.append(p)
+                    continue
+            rows.append((p, base, bp))
+        return rows, later
+
+    async def run_once(self) -> int:
+        """1 lượt: chấm các bệnh nhân bẩn đủ điều kiện; trả về số bệnh nhân đã chấm."""
+        from app.routers import ml
+        b = ml.registry.current
+        if b is None:           # model chưa sẵn sàng: giữ nguyên tập bẩn
+            return 0
+        t0 = time.perf_counter()
+        with self._lock:
+            patients, forced = self._dirty, self._forced
+            self._dirty, self._forced = set(), set()
+            if b.version != self._version:     # đổi model → chấm lại tất cả
+                self._version = b.version
+                patients = patients | set(self._profiles)
+                forced = forced | patients
+        now = time.monotonic()
+        rows, later = self._select(patients, forced, now)
+        # bệnh nhân bị hoãn được đưa lại vào tập bẩn mỗi lượt tới khi chấm / bỏ qua → chỉ đếm lần đầu
+        held = set(later)
+        self.deferred += len(held - self._held)
+        self._held = held
+        if later:
+            with self._lock:
+                self._dirty.update(later)
+        ap = (ml.FULL_INPUT_FIELDS.index("ap_hi"), ml.FULL_INPUT_FIELDS.index("ap_lo"))
+        ts = datetime.now(timezone.utc).isoformat()
+        for i in range(0, len(rows), self.max_batch):
+            chunk = rows[i:i + self.max_batch]
+            raw = np.stack([base for _, base, _ in chunk])
+            raw[:, ap] = np.array([[np.nan if x is None else x for x in bp] for _, _, bp in chunk], dtype=float)
+            X = ml.build_feature_matrix(raw)
+            labels, p1 = await asyncio.to_thread(ml._score_matrix, X, b)
+            for (p, _, bp), label, prob in zip(chunk, labels, p1):
+                out = {"type": "risk", "patient": p, "prob": round(float(prob), 4), "label": int(label),
+                       "sbp": None if bp[0] is None else round(bp[0], 1),
+                       "dbp": None if bp[1] is None else round(bp[1], 1),
+                       "window": self.window, "model_version": b.version, "ts": ts}
+                self._last[p] = out
+                self._last_mono[p] = now
+                self.hub.publish(risk_topic(p), out)
+        self.runs += 1
+        self.scored += len(rows)
+        self.last_batch = len(rows)
+        self.last_run_s = time.perf_counter() - t0
+        self.last_error = None
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "profiles": len(self._profiles), "pending": len(self._dirty), "scored_patients": len(self._last),
+            "window": self.window, "bp_threshold": self.bp_threshold, "min_interval_s": self.min_interval_s,
+            "runs": self.runs, "scored": self.scored, "skipped_small": self.skipped_small,
+            "deferred": self.deferred, "no_profile": self.no_profile, "last_batch": self.last_batch,
+            "last_run_s": self.last_run_s, "last_error": self.last_error, "model_version": self._version,
+        }
@@ -1,5 +1,6 @@
 from app.models.user_model import User
-from app.core.security import hash_password, verify_password, create_access_token
+from app.core.auth import invalidate_user
+from app.core.security import hash_password_async, verify_password_async, create_access_token
 from app.schemas.auth_schema import RegisterRequest, LoginRequest, TokenResponse
 from fastapi import HTTPException, status
 
@@ -10,7 +11,7 @@ class UserService:
         if existing:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Email already registered")
 
-        user = User(email=data.email, hashed_password=hash_password(data.password))
+        user = User(email=data.email, hashed_password=await hash_password_async(data.password))
         await user.insert()
 
         token = create_access_token({"sub": str(user.id), "email": user.email})
@@ -19,8 +20,15 @@ class UserService:
     @staticmethod
     async def login(data: LoginRequest) -> TokenResponse:
         user = await User.find_one(User.email == data.email)
-        if not user or not verify_password(data.password, user.hashed_password):
+        if not user:
             raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        ok, new_hash = await verify_password_async(data.password, user.hashed_password)
+        if not ok:
+            raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        if new_hash is not None:
+            # BCRYPT_ROUNDS đã đổi: lưu hash theo cost mới
+            await user.set({User.hashed_password: new_hash})
+            invalidate_user(user.id)
 
         token = create_access_token({"sub": str(user.id), "email": user.email})
         return TokenResponse(access_token=token)
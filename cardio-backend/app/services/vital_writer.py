@@ -0,0 +1,181 @@
+# app/services/vital_writer.py
+# Ghi vitals vào Mongo theo lô: thread MQTT (paho) / handler đẩy VitalIn đã validate vào hàng đợi
+# có giới hạn (an toàn đa luồng), 1 task trên event loop gom và flush bằng insert_many khi đủ
+# batch_size dòng hoặc sau flush_interval kể từ lần flush trước.
+import asyncio, threading, time
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.core.metrics import Histogram, LATENCY_MS_BUCKETS
+from app.schemas.vital_schema import VitalIn
+
+DUPLICATE_KEY = 11000
+
+
+class VitalWriter:
+    def __init__(self, *, batch_size: int = 500, flush_interval_ms: float = 200.0,
+                 max_queue: int = 20_000, max_retries: int = 3, retry_backoff_ms: float = 100.0,
+                 collection: Optional[Callable] = None):
+        """
+        max_queue: số vital tối đa đang chờ ghi; đầy → submit trả False (đếm vào dropped_full).
+        collection: hàm trả về motor collection (mặc định collection của Vital, lấy lúc flush).
+        """
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_backoff = max(0.0, float(retry_backoff_ms)) / 1000.0
+        self._collection = collection
+        self._buf: Deque[VitalIn] = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # bộ đếm (đọc qua stats())
+        self.enqueued = 0
+        self.dropped_full = 0        # hàng đợi đầy (backpressure)
+        self.dropped_not_running = 0 # writer chưa start / đã stop
+        self.written = 0
+        self.failed = 0              # bỏ hẳn sau khi hết lượt retry hoặc lỗi không retry được
+        self.retries = 0
+        self.batches = 0
+        self.flush_ms = Histogram("vitals_flush_ms", LATENCY_MS_BUCKETS, "thời gian 1 lần insert_many")
+        self.batch_rows = Histogram("vitals_batch_rows", (1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+                                    "số vital mỗi lần insert_many")
+
+    # ---- vòng đời (gọi trên event loop) ----
+    def start(self):
+        """Gắn writer vào event loop đang chạy (startup)."""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        """Shutdown: ngừng nhận, flush nốt những gì còn trong hàng đợi."""
+        self._stopping = True
+        if self._task is None:
+            return
+        self._wake.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    # ---- ghi (gọi từ bất kỳ thread nào) ----
+    def submit(self, v: VitalIn) -> bool:
+        """Xếp 1 vital vào hàng đợi. False nếu bị bỏ (đầy / writer không chạy) — caller không bị chặn."""
+        loop = self._loop
+        if loop is None or not self.running:
+            self.dropped_not_running += 1
+            return False
+        with self._lock:
+            if len(self._buf) >= self.max_queue:
+                self.dropped_full += 1
+                return False
+            self._buf.append(v)
+            self.enqueued += 1
+            wake = len(self._buf) == self.batch_size
+        if wake:
+            # đủ 1 lô: đánh thức writer sớm (không chờ hết flush_interval)
+            try:
+                loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:   # loop đã đóng
+                pass
+        return True
+
+    def _take(self) -> List[VitalIn]:
+        with self._lock:
+            n = min(len(self._buf), self.batch_size)
+            return [self._buf.popleft() for _ in range(n)]
+
+    async def _run(self):
+        while True:
+            if len(self._buf) < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+            batch = self._take()
+            if batch:
+                await self._flush(batch)
+            elif self._stopping:
+                return
+
+    async def _flush(self, batch: List[VitalIn]):
+        """Ghi 1 lô; mọi lỗi đều được đếm (written / failed) ở đây — không để lọt ra làm chết task _run."""
+        self.batch_rows.observe(len(batch))
+        self.batches += 1
+        try:
+            # _id gán sẵn 1 lần: lượt retry gửi lại đúng các _id đó → document đã ghi ở lượt trước
+            # (vd. AutoReconnect giữa chừng) báo duplicate key thay vì bị ghi trùng
+            docs = [dict(v.model_dump(), _id=ObjectId()) for v in batch]
+            coll = self._collection() if self._collection is not None else _vital_collection()
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"[WARN] vitals batch of {len(batch)} dropped: {e!r}")
+            return
+        for attempt in range(self.max_retries + 1):
+            t0 = time.perf_counter()
+            try:
+                # ordered=False: 1 document lỗi không chặn phần còn lại của lô
+                await coll.insert_many(docs, ordered=False)
+                self.written += len(docs)
+                break
+            except BulkWriteError as e:
+                # lỗi theo từng document — retry không giúp được; duplicate key ở lượt retry = đã ghi ở lượt trước
+                ok = int(e.details.get("nInserted", 0))
+                if attempt:
+                    ok += sum(1 for err in e.details.get("writeErrors", ()) if err.get("code") == DUPLICATE_KEY)
+                self.written += ok
+                self.failed += len(docs) - ok
+                break
+            except PyMongoError as e:
+                if attempt >= self.max_retries:
+                    self.failed += len(docs)
+                    print(f"[WARN] vitals insert_many failed after {attempt + 1} attempts: {e}")
+                    break
+                self.retries += 1
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+            except Exception as e:
+                # ngoài driver (vd. bson InvalidDocument): retry không giúp được, bỏ lô, writer vẫn chạy
+                self.failed += len(docs)
+                print(f"[WARN] vitals batch of {len(docs)} dropped: {e!r}")
+                break
+            finally:
+                self.flush_ms.observe((time.perf_counter() - t0) * 1000.0)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": len(self._buf),
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000.0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped_full": self.dropped_full,
+            "dropped_not_running": self.dropped_not_running,
+            "failed": self.failed,
+            "retries": self.retries,
+            "batches": self.batches,
+            "flush_ms": self.flush_ms.snapshot(),
+            "batch_rows": self.batch_rows.snapshot(),
+        }
+
+
+def _vital_collection():
+    from app.models.vital_model import Vital
+    return Vital.get_motor_collection()
@@ -0,0 +1,93 @@
+# app/services/vitals_aggregate.py
+# Lịch sử vitals cho biểu đồ: gom theo bucket thời gian NGAY TRONG Mongo ($dateTrunc + $group
+# min/avg/max), trả về dạng cột; tuỳ chọn giảm tiếp về ~N điểm bằng LTTB (Largest-Triangle-Three-
+# Buckets) để kích thước payload theo độ phân giải màn hình thay vì độ dài khoảng thời gian.
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+VITAL_FIELDS = ("hr", "spo2", "sbp", "dbp", "rr")
+MAX_BUCKETS = 20_000
+
+_UNITS = {"s": ("second", 1), "m": ("minute", 60), "h": ("hour", 3600), "d": ("day", 86400)}
+_BUCKET_RE = re.compile(r"^\s*(\d+)\s*([smhd])\s*$")
+
+
+def parse_bucket(spec: str):
+    """"30s" / "1m" / "15m" / "1h" / "1d" -> (unit $dateTrunc, binSize, độ rộng giây). ValueError nếu sai."""
+    m = _BUCKET_RE.match(spec or "")
+    if not m or int(m.group(1)) <= 0:
+        raise ValueError(f"invalid bucket {spec!r} (expected e.g. 30s, 1m, 15m, 1h)")
+    unit, sec = _UNITS[m.group(2)]
+    n = int(m.group(1))
+    return unit, n, n * sec
+
+
+def auto_bucket(start: datetime, end: datetime, points: int) -> str:
+    """Bucket đủ mịn để LTTB còn ~4 ứng viên mỗi điểm đầu ra (tối thiểu 1s)."""
+    span = max(1.0, (end - start).total_seconds())
+    return f"{max(1, int(span // (max(1, points) * 4)))}s"
+
+
+def bucket_pipeline(patient: str, start: datetime, end: datetime, unit: str, bin_size: int,
+                    fields: Sequence[str]) -> List[dict]:
+    group = {"_id": {"$dateTrunc": {"date": "$ts", "unit": unit, "binSize": bin_size}}, "n": {"$sum": 1}}
+    for f in fields:
+        # $min/$avg/$max bỏ qua null/thiếu → bucket không có f cho ra null
+        group[f"{f}_min"] = {"$min": f"${f}"}
+        group[f"{f}_mean"] = {"$avg": f"${f}"}
+        group[f"{f}_max"] = {"$max": f"${f}"}
+        # số mẫu có giá trị (null < số trong thứ tự BSON) — để gộp mean với bucket từ archive
+        group[f"{f}_n"] = {"$sum": {"$cond": [{"$gt": [f"${f}", None]}, 1, 0]}}
+    return [
+        {"$match": {"patient": patient, "ts": {"$gte": start, "$lte": end}}},
+        {"$project": {"_id": 0, "ts": 1, **{f: 1 for f in fields}}},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Chỉ số các điểm giữ lại theo LTTB: giữ điểm đầu/cuối, mỗi bucket ở giữa chọn điểm tạo tam giác
+    lớn nhất với điểm đã chọn trước đó và trung bình bucket kế tiếp. x tăng dần, không NaN.
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        raise ValueError("LTTB needs at least 3 output points")
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)   # n_out - 2 bucket giữa
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def to_columns(rows: List[dict], fields: Sequence[str], points: Optional[int] = None) -> Dict[str, dict]:
+    """
+    Kết quả $group -> {field: {"t": [...], "min": [...], "mean": [...], "max": [...]}} (bỏ bucket rỗng
+    của từng field). points: giảm mỗi field còn tối đa `points` bucket bằng LTTB trên chuỗi mean.
+    """
+    t = np.array([r["_id"].timestamp() for r in rows], dtype=float)
+    out = {}
+    for f in fields:
+        mean = np.array([np.nan if r[f"{f}_mean"] is None else r[f"{f}_mean"] for r in rows], dtype=float)
+        keep = np.flatnonzero(~np.isnan(mean))
+        if points is not None and len(keep) > points:
+            keep = keep[lttb(t[keep], mean[keep], points)]
+        out[f] = {
+            "t": [rows[i]["_id"].isoformat() for i in keep],
+            "min": [rows[i][f"{f}_min"] for i in keep],
+            "mean": [round(float(mean[i]), 2) for i in keep],
+            "max": [rows[i][f"{f}_max"] for i in keep],
+        }
+    return out
@@ -0,0 +1,398 @@
+# app/services/vitals_archive.py
+# Cold storage cho vitals: vitals cũ hơn ARCHIVE_AFTER_DAYS được gom thành 1 VitalChunk / bệnh nhân / ngày
+# dạng cột — ts mã hoá delta (int32 ms), chỉ số sống uint8/uint16 (0 = không có), mode/source mã hoá
+# từ điển, mỗi cột nén zlib. 1 ngày 1 Hz (86 400 document) thành 1 document vài chục KB; đọc 1 tháng
+# là ~30 lần giải nén + NumPy thay vì 2,6 triệu document BSON.
+# Nhiều reading cùng ts đều được giữ (không gộp theo ts); chống trùng khi chạy lại dựa trên _id (xem compact_once).
+import asyncio, time, zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from bson import ObjectId
+
+from app.core.config import settings
+
+FORMAT_VERSION = 1
+# dtype lưu trữ theo miền giá trị của VitalIn (sbp tới 260 nên cần 16 bit)
+COLUMNS = {"hr": np.uint8, "spo2": np.uint8, "sbp": np.uint16, "dbp": np.uint8, "rr": np.uint8}
+CATEGORICAL = ("mode", "source")
+DELETE_BATCH = 10_000
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_DAY_MS = 86_400_000
+# $dateTrunc chia bin tính từ 2000-01-01T00:00Z — bucket tính trên archive phải trùng bin của Mongo
+_BIN_REF_MS = 946_684_800_000
+
+
+def to_ms(dt: datetime) -> int:
+    """datetime (naive = UTC, như pymongo trả về) -> ms epoch, số nguyên chính xác."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    d = dt - _EPOCH
+    return d.days * _DAY_MS + d.seconds * 1000 + d.microseconds // 1000
+
+
+def from_ms(ms: int) -> datetime:
+    """ms epoch -> datetime naive UTC (cùng kiểu với ts đọc từ collection vitals)."""
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(ms))
+
+
+def _le(dtype) -> np.dtype:
+    return np.dtype(dtype).newbyteorder("<")
+
+
+# ---- mã hoá / giải mã ----
+def docs_to_columns(docs: Sequence[dict]) -> Dict[str, np.ndarray]:
+    """Document vitals -> cột (ts_ms int64 + COLUMNS + CATEGORICAL), sắp theo ts (ts trùng giữ đủ)."""
+    n = len(docs)
+    cols = {"ts_ms": np.fromiter((to_ms(d["ts"]) for d in docs), dtype=np.int64, count=n)}
+    for c, dt in COLUMNS.items():
+        arr = np.fromiter((d.get(c) or 0 for d in docs), dtype=np.int64, count=n)
+        if n and (arr.min() < 0 or arr.max() > np.iinfo(dt).max):
+            raise ValueError(f"{c} out of range for {np.dtype(dt).name}")
+        cols[c] = arr.astype(dt)
+    for c in CATEGORICAL:
+        cols[c] = np.array([d.get(c) for d in docs], dtype=object)
+    return _sorted(cols)
+
+
+def _sorted(cols: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Sắp theo ts (ổn định: các reading cùng ts giữ thứ tự đến)."""
+    order = np.argsort(cols["ts_ms"], kind="stable")
+    return {k: v[order] for k, v in cols.items()}
+
+
+def merge_columns(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Gộp 2 tập cột cùng bệnh nhân (chunk cũ + vitals đến muộn); không bỏ dòng nào, ts trùng: `a` trước."""
+    return _sorted({k: np.concatenate([a[k], b[k]]) for k in a})
+
+
+def encode_ids(ids: Sequence[ObjectId]) -> bytes:
+    """_id các document gốc vừa gộp vào chunk -> zlib(12 byte / id)."""
+    return zlib.compress(b"".join(i.binary for i in ids))
+
+
+def decode_ids(raw: Optional[bytes]) -> List[ObjectId]:
+    if not raw:
+        return []
+    buf = zlib.decompress(raw)
+    return [ObjectId(buf[i:i + 12]) for i in range(0, len(buf), 12)]
+
+
+def encode_chunk(patient: str, day: datetime, cols: Dict[str, np.ndarray]) -> dict:
+    """Cột đã sắp (docs_to_columns) -> document VitalChunk."""
+    ts = cols["ts_ms"]
+    delta = np.diff(ts)
+    if len(delta) and delta.max() > np.iinfo(np.int32).max:
+        raise ValueError("ts gap too large for int32 delta")
+    codes, dicts = {}, {}
+    for c in CATEGORICAL:
+        table: Dict[Optional[str], int] = {}
+        idx = [table.setdefault(v, len(table)) for v in cols[c]]
+        if len(table) > 256:
+            raise ValueError(f"too many distinct {c} values in one chunk")
+        dicts[c] = list(table)
+        codes[c] = zlib.compress(np.asarray(idx, dtype=np.uint8).tobytes())
+    return {
+        "patient": patient, "day": day, "start_ts": from_ms(ts[0]), "end_ts": from_ms(ts[-1]),
+        "n": int(len(ts)), "v": FORMAT_VERSION, "t0_ms": int(ts[0]),
+        "ts_delta": zlib.compress(delta.astype(_le(np.int32)).tobytes()),
+        "cols": {c: zlib.compress(cols[c].astype(_le(dt)).tobytes()) for c, dt in COLUMNS.items()},
+        "dicts": dicts, "codes": codes,
+    }
+
+
+def decode_chunk(doc: dict, fields: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """Document VitalChunk -> cột; fields: chỉ giải nén những cột cần (ts_ms luôn có)."""
+    if doc.get("v", 1) != FORMAT_VERSION:
+        raise ValueError(f"unsupported chunk format {doc.get('v')!r}")
+    n = int(doc["n"])
+    ts = np.empty(n, dtype=np.int64)
+    ts[0] = doc["t0_ms"]
+    ts[1:] = doc["t0_ms"] + np.cumsum(np.frombuffer(zlib.decompress(doc["ts_delta"]), dtype=_le(np.int32)),
+                                      dtype=np.int64)
+    cols = {"ts_ms": ts}
+    for c in (fields if fields is not None else list(COLUMNS) + list(CATEGORICAL)):
+        if c in COLUMNS:
+            cols[c] = np.frombuffer(zlib.decompress(doc["cols"][c]), dtype=_le(COLUMNS[c]))
+        elif c in CATEGORICAL:
+            table = np.array(doc["dicts"][c], dtype=object)
+            cols[c] = table[np.frombuffer(zlib.decompress(doc["codes"][c]), dtype=np.uint8)]
+    return cols
+
+
+def same_ts_rank(ts: np.ndarray) -> np.ndarray:
+    """ts đã sắp -> thứ tự k của mỗi dòng trong nhóm cùng ts (0, 1, ...)."""
+    return np.arange(len(ts)) - np.searchsorted(ts, ts, side="left")
+
+
+def parse_row_id(row_id: str) -> Optional[Tuple[int, int]]:
+    """id dòng archive ("<patient>@<ts_ms>[.<k>]") -> (ts_ms, k); None nếu không phải id archive."""
+    head, sep, tail = row_id.rpartition("@")
+    if not sep:
+        return None
+    ts_ms, _, k = tail.partition(".")
+    try:
+        return int(ts_ms), int(k or 0)
+    except ValueError:
+        return None
+
+
+def columns_to_rows(cols: Dict[str, np.ndarray], idx: np.ndarray, patient: str,
+                    fields: Sequence[str]) -> List[dict]:
+    """
+    Các dòng `idx` -> dict giống document /iot/history. id ổn định: "<patient>@<ts_ms>", reading thứ k (k ≥ 1)
+    cùng ts: "<patient>@<ts_ms>.<k>".
+    """
+    ts_all = cols["ts_ms"]
+    rank = same_ts_rank(ts_all)
+    out = []
+    for i in idx:
+        ts_ms, k = int(ts_all[i]), int(rank[i])
+        row = {"ts": from_ms(ts_ms)}
+        for f in fields:
+            if f == "patient":
+                row[f] = patient
+            elif f in COLUMNS:
+                v = int(cols[f][i])
+                row[f] = v if v else None
+            elif f in CATEGORICAL:
+                row[f] = cols[f][i]
+        row["id"] = f"{patient}@{ts_ms}.{k}" if k else f"{patient}@{ts_ms}"
+        out.append(row)
+    return out
+
+
+# ---- đọc ----
+def _bounds_ms(ts_cond: dict):
+    """Điều kiện ts kiểu Mongo ($gte/$gt/$lte/$lt) -> [lo, hi] ms (ts lưu ở độ chính xác ms)."""
+    lo, hi = -(1 << 62), 1 << 62
+    if "$gte" in ts_cond: lo = max(lo, to_ms(ts_cond["$gte"]))
+    if "$gt" in ts_cond:  lo = max(lo, to_ms(ts_cond["$gt"]) + 1)
+    if "$lte" in ts_cond: hi = min(hi, to_ms(ts_cond["$lte"]))
+    if "$lt" in ts_cond:  hi = min(hi, to_ms(ts_cond["$lt"]) - 1)
+    return lo, hi
+
+
+def _chunk_filter(patient: str, lo: int, hi: int) -> dict:
+    flt = {"patient": patient}
+    if lo > -(1 << 62): flt["end_ts"] = {"$gte": from_ms(lo)}
+    if hi < (1 << 62):  flt["start_ts"] = {"$lte": from_ms(hi)}
+    return flt
+
+
+def _chunks():
+    from app.models.vital_chunk_model import VitalChunk
+    return VitalChunk.get_motor_collection()
+
+
+async def history_rows(patient: str, ts_cond: dict, direction: int, limit: int,
+                       fields: Sequence[str], edge: Optional[Tuple[int, int]] = None) -> List[dict]:
+    """
+    Tối đa `limit` dòng đã lưu trữ thoả ts_cond, theo thứ tự (ts, k) `direction` (-1: mới nhất trước).
+    edge = (ts_ms, k) của dòng archive làm con trỏ: ở đúng ts đó chỉ giữ dòng đứng sau nó theo `direction`.
+    Duyệt chunk theo ngày và dừng ngay khi đủ → chỉ giải nén vài chunk cho 1 trang.
+    """
+    lo, hi = _bounds_ms(ts_cond)
+    if lo > hi:
+        return []
+    out: List[dict] = []
+    cursor = _chunks().find(_chunk_filter(patient, lo, hi)).sort("day", direction)
+    async for doc in cursor:
+        cols = decode_chunk(doc, fields)
+        ts = cols["ts_ms"]
+        m = (ts >= lo) & (ts <= hi)
+        if edge is not None:
+            rank = same_ts_rank(ts)
+            m &= (ts != edge[0]) | ((rank < edge[1]) if direction < 0 else (rank > edge[1]))
+        idx = np.flatnonzero(m)
+        if direction < 0:
+            idx = idx[::-1]
+        out += columns_to_rows(cols, idx[: limit - len(out)], patient, fields)
+        if len(out) >= limit:
+            break
+    return out
+
+
+async def scan(patient: str, start: datetime, end: datetime, fields: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Mọi dòng đã lưu trữ trong [start, end] dạng cột, ts tăng dần."""
+    lo, hi = to_ms(start), to_ms(end)
+    parts = []
+    async for doc in _chunks().find(_chunk_filter(patient, lo, hi)).sort("day", 1):
+        cols = decode_chunk(doc, fields)
+        m = (cols["ts_ms"] >= lo) & (cols["ts_ms"] <= hi)
+        parts.append({k: v[m] for k, v in cols.items()})
+    if not parts:
+        return {"ts_ms": np.empty(0, dtype=np.int64), **{f: np.empty(0, dtype=COLUMNS[f]) for f in fields}}
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def bucket_stats(cols: Dict[str, np.ndarray], width_s: int, fields: Sequence[str]) -> List[dict]:
+    """
+    Cùng kết quả với $group của vitals_aggregate.bucket_pipeline (kèm <f>_n) nhưng tính trên cột
+    NumPy của archive — bin căn theo mốc của $dateTrunc để gộp được với kết quả Mongo.
+    """
+    ts = cols["ts_ms"]
+    if not len(ts):
+        return []
+    width = int(width_s) * 1000
+    bins = _BIN_REF_MS + ((ts - _BIN_REF_MS) // width) * width
+    keys, inv = np.unique(bins, return_inverse=True)
+    rows = [{"_id": from_ms(k), "n": int(c)} for k, c in zip(keys, np.bincount(inv))]
+    for f in fields:
+        v = cols[f].astype(float)
+        valid = v > 0
+        cnt = np.bincount(inv, weights=valid, minlength=len(keys))
+        tot = np.bincount(inv, weights=np.where(valid, v, 0.0), minlength=len(keys))
+        mn = np.full(len(keys), np.inf); np.minimum.at(mn, inv[valid], v[valid])
+        mx = np.full(len(keys), -np.inf); np.maximum.at(mx, inv[valid], v[valid])
+        for i, r in enumerate(rows):
+            has = cnt[i] > 0
+            r[f"{f}_n"] = int(cnt[i])
+            r[f"{f}_min"] = int(mn[i]) if has else None
+            r[f"{f}_mean"] = float(tot[i] / cnt[i]) if has else None
+            r[f"{f}_max"] = int(mx[i]) if has else None
+    return rows
+
+
+def merge_bucket_rows(a: List[dict], b: List[dict], fields: Sequence[str]) -> List[dict]:
+    """Gộp 2 kết quả bucket (Mongo + archive) theo _id; mean gộp theo số mẫu của từng field."""
+    by_id = {r["_id"]: dict(r) for r in a}
+    for r in b:
+        cur = by_id.get(r["_id"])
+        if cur is None:
+            by_id[r["_id"]] = dict(r)
+            continue
+        cur["n"] += r["n"]
+        for f in fields:
+            n1, n2 = cur.get(f"{f}_n", 0), r.get(f"{f}_n", 0)
+            if not n2:
+                continue
+            if not n1:
+                for k in ("n", "min", "mean", "max"):
+                    cur[f"{f}_{k}"] = r[f"{f}_{k}"]
+                continue
+            cur[f"{f}_min"] = min(cur[f"{f}_min"], r[f"{f}_min"])
+            cur[f"{f}_max"] = max(cur[f"{f}_max"], r[f"{f}_max"])
+            cur[f"{f}_mean"] = (cur[f"{f}_mean"] * n1 + r[f"{f}_mean"] * n2) / (n1 + n2)
+            cur[f"{f}_n"] = n1 + n2
+    return [by_id[k] for k in sorted(by_id)]
+
+
+# ---- compaction nền ----
+class ArchiveJob:
+    # nhiều worker uvicorn: chỉ worker giữ claim_archive() (services/iot_mqtt.py) gọi start()
+    def __init__(self, *, after_days: float = 7, interval_s: float = 3600, max_days_per_run: int = 50):
+        self.after_days = float(after_days)
+        self.interval_s = max(1.0, float(interval_s))
+        self.max_days_per_run = max(1, int(max_days_per_run))
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.chunks_written = 0
+        self.docs_archived = 0
+        self.days_skipped = 0
+        self.last_run_s: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compact_once()
+            except Exception as e:   # Mongo tạm lỗi: ghi lại, thử lại ở lượt sau
+                self.last_error = str(e)
+                print(f"[WARN] vitals archive run failed: {e}")
+            await asyncio.sleep(self.interval_s)
+
+    async def compact_once(self, now: Optional[datetime] = None) -> dict:
+        """
+        Gom (bệnh nhân, ngày) có vitals cũ hơn ngưỡng thành chunk. Thứ tự: ghi chunk (gộp với chunk sẵn có
+        nếu có vitals đến muộn) kèm `pending` = _id các document vừa gộp, xoá đúng các _id đó, rồi bỏ `pending`
+        → vitals ghi xen giữa không bị mất. Lỗi giữa các bước: lần chạy sau thấy `pending`, không gộp lại
+        các _id này (chỉ xoá nốt) → không nhân đôi reading.
+        """
+        from app.models.vital_model import Vital
+
+        t0 = time.perf_counter()
+        now = now or datetime.now(timezone.utc)
+        cutoff_ms = (to_ms(now - timedelta(days=self.after_days)) // _DAY_MS) * _DAY_MS   # chỉ ngày trọn vẹn
+        cutoff = from_ms(cutoff_ms)
+        vitals, chunks = Vital.get_motor_collection(), _chunks()
+        groups = await vitals.aggregate([
+            {"$match": {"ts": {"$lt": cutoff}}},
+            {"$group": {"_id": {"patient": "$patient", "day": {"$dateTrunc": {"date": "$ts", "unit": "day"}}}}},
+            {"$sort": {"_id.day": 1}},
+            {"$limit": self.max_days_per_run},
+        ]).to_list(None)
+        written = archived = 0
+        for g in groups:
+            patient, day = g["_id"]["patient"], g["_id"]["day"]
+            docs = await vitals.find({"patient": patient, "ts": {"$gte": day, "$lt": day + timedelta(days=1)}},
+                                     {"revision_id": 0}).to_list(None)
+            if not docs:
+                continue
+            key = {"patient": patient, "day": day}
+            existing = await chunks.find_one(key)
+            # lần chạy trước đã ghi chunk nhưng chưa xoá xong document gốc: các _id đó đã nằm trong chunk
+            merged = set(decode_ids(existing.get("pending"))) if existing else set()
+            fresh = [d for d in docs if d["_id"] not in merged]
+            # chỉ xoá document gốc có _id đã nằm trong chunk đã ghi
+            ids = [d["_id"] for d in docs if d["_id"] in merged] + [d["_id"] for d in fresh]
+            if fresh:
+                try:
+                    doc = await asyncio.to_thread(self._build_chunk, patient, day, fresh, existing)
+                except ValueError as e:
+                    self.days_skipped += 1
+                    print(f"[WARN] vitals archive: keep {patient} {day:%Y-%m-%d} raw ({e})")
+                    continue
+                doc["pending"] = encode_ids(ids)
+                await chunks.replace_one(key, doc, upsert=True)
+                written += 1
+                archived += len(fresh)
+            for i in range(0, len(ids), DELETE_BATCH):
+                await vitals.delete_many({"_id": {"$in": ids[i:i + DELETE_BATCH]}})
+            await chunks.update_one(key, {"$unset": {"pending": ""}})
+        self.runs += 1
+        self.chunks_written += written
+        self.docs_archived += archived
+        self.last_run_s = time.perf_counter() - t0
+        self.last_error = None
+        return {"chunks": written, "docs": archived, "cutoff": cutoff}
+
+    @staticmethod
+    def _build_chunk(patient: str, day: datetime, docs: List[dict], existing: Optional[dict]) -> dict:
+        cols = docs_to_columns(docs)
+        n = len(docs)
+        if existing is not None:
+            cols = merge_columns(decode_chunk(existing), cols)
+            n += int(existing["n"])
+        if len(cols["ts_ms"]) != n:      # mọi reading phải vào chunk trước khi document gốc bị xoá
+            raise ValueError(f"chunk has {len(cols['ts_ms'])} rows, expected {n}")
+        return encode_chunk(patient, day, cols)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "after_days": self.after_days, "interval_s": self.interval_s,
+            "runs": self.runs, "chunks_written": self.chunks_written, "docs_archived": self.docs_archived,
+            "days_skipped": self.days_skipped, "last_run_s": self.last_run_s, "last_error": self.last_error,
+        }
+
+
+archive_job = ArchiveJob(
+    after_days=settings.ARCHIVE_AFTER_DAYS,
+    interval_s=settings.ARCHIVE_INTERVAL_S,
+    max_days_per_run=settings.ARCHIVE_MAX_DAYS_PER_RUN,
+)
@@ -0,0 +1,138 @@
+# app/services/vitals_hub.py
+# Pub/sub realtime cho WebSocket vitals: mỗi vital mới được serialize 1 lần rồi đẩy vào hàng đợi
+# của mọi subscriber đang theo dõi bệnh nhân đó. Hàng đợi mỗi kết nối có giới hạn, đầy thì bỏ
+# message cũ nhất (client chậm chỉ mất mẫu cũ, không làm chậm ingestion hay client khác).
+import asyncio, json
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional, Set
+
+# topic phụ của 1 bệnh nhân ("stats:<p>", "risk:<p>") — không tính thêm vào giới hạn bệnh nhân / socket
+DERIVED_PREFIXES = ("stats:", "risk:")
+
+
+def topic_patient(topic: str) -> str:
+    """Topic -> bệnh nhân mà nó thuộc về."""
+    for prefix in DERIVED_PREFIXES:
+        if topic.startswith(prefix):
+            return topic[len(prefix):]
+    return topic
+
+
+class Subscription:
+    """1 kết nối WebSocket: tập bệnh nhân đang theo dõi + hàng đợi text đã serialize."""
+
+    def __init__(self, hub: "VitalsHub", max_queue: int):
+        self.hub = hub
+        self.patients: Set[str] = set()
+        self.max_queue = max(1, int(max_queue))
+        self._queue: Deque[str] = deque()
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, text: str):
+        if len(self._queue) >= self.max_queue:
+            self._queue.popleft()
+            self.dropped += 1
+            self.hub.dropped += 1
+        self._queue.append(text)
+        self._ready.set()
+
+    async def get(self) -> str:
+        while not self._queue:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue.popleft()
+
+    def subscribe(self, patients: Iterable[str]):
+        self.hub._add(self, patients)
+
+    def unsubscribe(self, patients: Iterable[str]):
+        self.hub._remove(self, patients)
+
+    def close(self):
+        self.hub._remove(self, list(self.patients))
+
+
+class VitalsHub:
+    def __init__(self, max_queue: int = 64, max_patients_per_socket: int = 256):
+        self.max_queue = max_queue
+        self.max_patients_per_socket = max_patients_per_socket
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    # ---- subscriber (trên event loop) ----
+    def connect(self, patients: Iterable[str] = ()) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        sub = Subscription(self, self.max_queue)
+        sub.subscribe(patients)     # ValueError (quá giới hạn): chưa đăng ký gì, chưa tính kết nối
+        self.connections += 1
+        return sub
+
+    def disconnect(self, sub: Subscription):
+        sub.close()
+        self.connections -= 1
+
+    def _add(self, sub: Subscription, patients: Iterable[str]):
+        """Tất cả hoặc không: kiểm tra giới hạn (số bệnh nhân thật, không tính topic stats/risk) trước khi thêm."""
+        new = [p for p in dict.fromkeys(patients) if p not in sub.patients]
+        owners = {topic_patient(t) for t in sub.patients} | {topic_patient(p) for p in new}
+        if len(owners) > self.max_patients_per_socket:
+            raise ValueError(f"too many patients on one socket (max {self.max_patients_per_socket})")
+        for p in new:
+            sub.patients.add(p)
+            self._subs.setdefault(p, set()).add(sub)
+
+    def _remove(self, sub: Subscription, patients: Iterable[str]):
+        for p in patients:
+            sub.patients.discard(p)
+            subs = self._subs.get(p)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[p]
+
+    def topics(self) -> list:
+        """Các topic (bệnh nhân / stats / risk) đang có ít nhất 1 subscriber trên worker này."""
+        return list(self._subs)
+
+    def has_subscribers(self, patient: str) -> bool:
+        # đọc dict từ thread khác là an toàn (GIL); dùng để bỏ qua serialize khi không ai xem
+        return patient in self._subs
+
+    # ---- publisher ----
+    def publish(self, patient: str, payload: Any):
+        """Gọi trên event loop. payload: dict (serialize tại đây) hoặc text JSON đã serialize sẵn."""
+        subs = self._subs.get(patient)
+        if not subs:
+            return
+        text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+        self.published += 1
+        for sub in subs:
+            sub.put(text)
+        self.delivered += len(subs)
+
+    def publish_threadsafe(self, patient: str, payload: Any):
+        """Gọi từ thread khác (MQTT): serialize ngay trên thread gọi, chuyển sang loop để phân phối."""
+        loop = self._loop
+        if loop is None or not self.has_subscribers(patient):
+            return
+        text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+        try:
+            loop.call_soon_threadsafe(self.publish, patient, text)
+        except RuntimeError:   # loop đã đóng
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "patients": len(self._subs),
+            "subscriptions": sum(len(s) for s in self._subs.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "max_queue": self.max_queue,
+        }
@@ -0,0 +1,496 @@
+# app/services/vitals_latest.py
+# Bảng "vital mới nhất" dùng chung giữa các worker uvicorn: 1 block POSIX shared memory gồm
+# - rows: 1 dòng cố định mỗi bệnh nhân (ts µs, hr/spo2/sbp/dbp/rr int16, mode/source 16 byte) = 50 byte,
+# - seq: bộ đếm seqlock mỗi slot (lẻ = đang ghi) → đọc không khoá, không copy qua IPC,
+# - index: bảng băm địa chỉ mở patient → slot (crc32, dò tuyến tính); slot không bao giờ bị thu hồi,
+# - log: vòng LOG_ROWS lượt ghi gần nhất (slot, pid worker ghi, dòng) — kể cả mẫu đến trễ không đè latest.
+# Tên block gắn với 1 lần chạy (open_latest: IOT_LATEST_SHM_NAME + "_" + instance, mặc định pid master uvicorn);
+# header giữ pid các worker đang attach: block không còn ai sống (master cũ chết bất thường) được reset, không dùng
+# lại, worker cuối cùng close() thì unlink block cùng các file khoá.
+# Ghi tuần tự: threading.Lock giữa các thread trong process (thread MQTT + event loop), rồi flock trên 1 file
+# khoá giữa các worker (flock gắn với open file description nên không chặn thread cùng fd); đọc không khoá.
+# LatestWatcher (mỗi worker) đọc log: mọi mẫu do worker KHÁC ghi được đưa vào thống kê trượt / rủi ro (ingest)
+# và hub cục bộ của worker này, như thể worker tự nhận qua MQTT / /iot/push.
+import asyncio, glob, os, tempfile, threading, zlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:       # Windows: không có flock → chỉ dùng được bảng cục bộ
+    fcntl = None
+
+MAGIC = 0x43564C33        # "CVL3": đổi khi đổi layout
+KEY_BYTES = 256           # ≥ UTF-8 của VitalIn.patient (64 ký tự) → key chính là id; id dài hơn được băm
+LOG_ROWS = 16384          # log vòng: watcher trễ hơn chừng này lượt ghi thì mất mẫu (đếm ở `lost`)
+MAX_ATTACH = 256          # số process attach cùng lúc tối đa (pid ghi trong header)
+VALUE_FIELDS = ("hr", "spo2", "sbp", "dbp", "rr")
+MISSING = -1              # giá trị int16 cho field None
+HEADER = np.dtype([("magic", "<u4"), ("capacity", "<u4"), ("used", "<u4"), ("full", "<u4"), ("writes", "<u8"),
+                   ("logged", "<u8"), ("generation", "<u4"), ("pids", "<u4", (MAX_ATTACH,))])
+ROW = np.dtype([("ts", "<i8")] + [(f, "<i2") for f in VALUE_FIELDS] + [("mode", "S16"), ("source", "S16")])
+LOG = np.dtype([("slot", "<i4"), ("origin", "<u4"), ("row", ROW)])
+
+
+def _layout(capacity: int):
+    """(tên, dtype, shape, offset) của từng mảng trong block, và tổng số byte."""
+    buckets = 1 << max(1, (2 * capacity - 1).bit_length())     # lũy thừa 2 ≥ 2 × capacity
+    parts, off = [], 0
+    for name, dtype, shape in (("header", HEADER, (1,)), ("seq", np.dtype("<u4"), (capacity,)),
+                               ("rows", ROW, (capacity,)), ("keys", np.dtype("u1"), (capacity, KEY_BYTES)),
+                               ("klen", np.dtype("<u2"), (capacity,)), ("index", np.dtype("<i4"), (buckets,)),
+                               ("log", LOG, (LOG_ROWS,))):
+        off = (off + 7) & ~7
+        parts.append((name, dtype, shape, off))
+        off += dtype.itemsize * int(np.prod(shape))
+    return parts, off
+
+
+def _key(patient: str) -> bytes:
+    k = patient.encode("utf-8")
+    return k if len(k) <= KEY_BYTES else zlib.crc32(k).to_bytes(4, "little") + k[-(KEY_BYTES - 4):]
+
+
+def _to_us(ts: datetime) -> int:
+    if ts.tzinfo is None:            # naive = UTC (như khi lưu Mongo)
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1_000_000)
+
+
+class LatestVitals:
+    def __init__(self, capacity: int = 8192, name: Optional[str] = None):
+        """
+        name: tên block shared memory (mọi worker cùng tên dùng chung 1 bảng; block đã có thì attach).
+        name=None: bảng cục bộ trong process (bytearray), cùng API.
+        """
+        self.capacity = int(capacity)
+        self.name = name
+        self._shm = None
+        self._lock_fd = None
+        self._thread_lock = threading.Lock()
+        self.pid = os.getpid()
+        self._slot: Dict[str, int] = {}          # cache cục bộ patient → slot (slot không đổi khi đã cấp)
+        size = _layout(self.capacity)[1]
+        if name is None:
+            self._map(bytearray(size))
+            self._init_header()
+            return
+        if fcntl is None:
+            raise RuntimeError("shared latest table needs fcntl.flock (POSIX)")
+        for _ in range(3):
+            self._shm = self._open(name, size)
+            self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._map(self._shm.buf)
+            if self._init_header():
+                return
+            # worker cuối của lượt chạy trước vừa unlink block + file khoá trong lúc ta chờ khoá → mở lại
+            os.close(self._lock_fd)
+        raise RuntimeError(f"shared memory {name!r} keeps being removed while attaching")
+
+    def _map(self, buf):
+        arrays = {n: np.ndarray(shape, dtype=dt, buffer=buf, offset=off) for n, dt, shape, off in _layout(self.capacity)[0]}
+        self._buf = np.ndarray(len(buf), dtype=np.uint8, buffer=buf)
+        self._header = arrays["header"]
+        self._writes = self._header["writes"]     # view (1,): gán phần tử nhanh hơn nhiều so với += trên field
+        self._logged = self._header["logged"]
+        self._pids = self._header["pids"][0]
+        self._seq, self._rows, self._keys, self._klen, self._index, self._log = (
+            arrays["seq"], arrays["rows"], arrays["keys"], arrays["klen"], arrays["index"], arrays["log"])
+        self._mask = len(self._index) - 1
+
+    @property
+    def shared(self) -> bool:
+        return self._shm is not None
+
+    @property
+    def nbytes(self) -> int:
+        return _layout(self.capacity)[1]
+
+    @property
+    def _lock_path(self) -> str:
+        return os.path.join(tempfile.gettempdir(), f"{self.name}.lock")
+
+    @staticmethod
+    def _open(name: str, size: int):
+        from multiprocessing import resource_tracker
+        from multiprocessing.shared_memory import SharedMemory
+        try:
+            shm = SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            shm = SharedMemory(name=name)
+            if shm.size != size:
+                # block của lượt chạy trước với layout / capacity khác (instance cố định qua IOT_LATEST_INSTANCE)
+                shm.unlink()
+                shm.close()
+                shm = SharedMemory(name=name, create=True, size=size)
+        # block sống lâu hơn từng worker: không để resource_tracker unlink khi process tạo ra nó thoát
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    def _init_header(self) -> bool:
+        """Attach (bảng cục bộ: khởi tạo); False nếu block vừa bị worker cuối lượt trước unlink."""
+        with self._write_lock():
+            if self._lock_fd is not None and not _same_file(self._lock_fd, self._lock_path):
+                return False
+            h = self._header[0]
+            live = self._live_pids()
+            if h["magic"] == MAGIC and live:
+                if h["capacity"] != self.capacity:
+                    raise RuntimeError(f"latest table {self.name!r} has capacity {int(h['capacity'])}, "
+                                       f"configured {self.capacity}")
+            else:
+                # block mới, layout cũ, hoặc không còn process nào của lượt chạy trước: xoá sạch, tăng generation
+                generation = int(h["generation"]) + 1 if h["magic"] == MAGIC else 1
+                self._buf[:] = 0
+                self._index[:] = -1
+                self._header["magic"], self._header["capacity"] = MAGIC, self.capacity
+                self._header["generation"] = generation
+            if self.shared:
+                free = np.flatnonzero(self._pids == 0)
+                if not len(free):
+                    raise RuntimeError(f"latest table {self.name!r}: more than {MAX_ATTACH} attached processes")
+                self._pids[free[0]] = self.pid
+            return True
+
+    def _live_pids(self) -> list:
+        """pid đang attach còn sống (gọi khi giữ khoá ghi); pid đã chết (worker bị kill) được xoá khỏi header."""
+        live = []
+        for i in np.flatnonzero(self._pids):
+            pid = int(self._pids[i])
+            if pid != self.pid and _alive(pid):
+                live.append(pid)
+            else:
+                self._pids[i] = 0
+        return live
+
+    def close(self):
+        """Detach; process cuối cùng còn attach thì unlink block và xoá các file khoá ({name}.lock, {name}.<vai trò>.lock)."""
+        if not self.shared or self._lock_fd is None:
+            return
+        from multiprocessing import resource_tracker
+        with self._write_lock():
+            last = not self._live_pids()
+            if last:
+                resource_tracker.register(self._shm._name, "shared_memory")   # _open đã unregister
+                try:
+                    self._shm.unlink()
+                except FileNotFoundError:     # đã bị dọn (sweep_stale / block được tạo lại)
+                    resource_tracker.unregister(self._shm._name, "shared_memory")
+                for path in glob.glob(os.path.join(tempfile.gettempdir(), glob.escape(self.name) + ".*lock")):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        os.close(self._lock_fd)
+        self._lock_fd = None
+        # không shm.close(): các view numpy vẫn trỏ vào buffer; mapping được giải phóng khi process thoát
+
+    # ---- khoá ghi (giữa các thread, rồi giữa các process) ----
+    def _write_lock(self):
+        return _WriteLock(self._thread_lock, self._lock_fd)
+
+    # ---- index ----
+    def slot_of(self, patient: str) -> Optional[int]:
+        """patient → slot, không khoá: index chỉ được publish sau khi key của slot đã ghi xong."""
+        s = self._slot.get(patient)
+        if s is not None:
+            return s
+        key = _key(patient)
+        b = zlib.crc32(key) & self._mask
+        while True:
+            s = int(self._index[b])
+            if s < 0:
+                return None
+            if self._klen[s] == len(key) and self._keys[s, :len(key)].tobytes() == key:
+                self._slot[patient] = s
+                return s
+            b = (b + 1) & self._mask
+
+    def _alloc(self, patient: str) -> Optional[int]:
+        """Cấp slot mới (gọi khi đang giữ khoá ghi); bảng đầy → None."""
+        key = _key(patient)
+        b = zlib.crc32(key) & self._mask
+        while True:
+            s = int(self._index[b])
+            if s < 0:
+                break
+            if self._klen[s] == len(key) and self._keys[s, :len(key)].tobytes() == key:
+                return s              # worker khác vừa cấp
+            b = (b + 1) & self._mask
+        h = self._header[0]
+        if h["used"] >= self.capacity:
+            self._header["full"] += 1
+            return None
+        s = int(h["used"])
+        self._keys[s, :len(key)] = np.frombuffer(key, dtype=np.uint8)
+        self._klen[s] = len(key)
+        self._rows["ts"][s] = -1
+        self._header["used"] += 1
+        self._index[b] = s            # publish cuối cùng
+        return s
+
+    # ---- ghi / đọc ----
+    def put(self, v) -> Optional[Tuple[int, int]]:
+        """Ghi vital (VitalIn) làm giá trị mới nhất → (slot, seq sau khi ghi); bảng đầy → None."""
+        row = (_to_us(v.ts), *(MISSING if getattr(v, f) is None else getattr(v, f) for f in VALUE_FIELDS),
+               (v.mode or "").encode("utf-8")[:16], (v.source or "").encode("utf-8")[:16])
+        with self._write_lock():
+            s = self.slot_of(v.patient)
+            if s is None:
+                s = self._alloc(v.patient)
+                if s is None:
+                    return None
+                self._slot[v.patient] = s
+            # log nhận mọi mẫu (worker khác cần cả mẫu trễ cho thống kê trượt); ghi entry rồi mới tăng logged
+            i = int(self._logged[0])
+            self._log[i % LOG_ROWS] = (s, self.pid, row)
+            self._logged[0] = i + 1
+            # mẫu đến trễ (ts cũ hơn) không đè giá trị mới hơn
+            if self._rows["ts"][s] > row[0]:
+                return s, int(self._seq[s])
+            q = int(self._seq[s]) + 1
+            self._seq[s] = q           # lẻ: reader thấy đang ghi
+            self._rows[s] = row
+            self._seq[s] = q + 1
+            self._writes[0] = int(self._writes[0]) + 1
+            return s, q + 1
+
+    def seq(self, slot: int) -> int:
+        return int(self._seq[slot])
+
+    def read_slot(self, slot: int, patient: str) -> Optional[dict]:
+        """Seqlock: đọc seq chẵn → copy dòng → seq không đổi thì dòng nhất quán, ngược lại thử lại."""
+        for _ in range(1000):
+            s1 = int(self._seq[slot])
+            if s1 & 1:
+                continue
+            row = self._rows[slot].item()
+            if int(self._seq[slot]) == s1:
+                break
+        else:
+            return None
+        if row[0] < 0:
+            return None
+        return _row_dict(patient, row)
+
+    @property
+    def logged(self) -> int:
+        return int(self._logged[0])
+
+    def read_log(self, start: int) -> Tuple[np.ndarray, int, int]:
+        """
+        Các entry log từ vị trí `start` → (entries, vị trí kế tiếp, số entry đã bị ghi đè trước khi kịp đọc).
+        Không khoá: entry chỉ được tính sau khi logged tăng; entry có thể bị ghi đè trong lúc copy thì bỏ.
+        """
+        end = self.logged
+        first = max(start, end - LOG_ROWS)
+        entries = self._log[np.arange(first, end) % LOG_ROWS]      # fancy index → bản copy
+        # writer có thể đang ghi entry thứ `logged` (đè vị trí logged - LOG_ROWS)
+        drop = min(len(entries), max(0, self.logged + 1 - LOG_ROWS - first))
+        return entries[drop:], end, (first - start) + drop
+
+    def patient_of(self, slot: int) -> str:
+        """slot → id bệnh nhân (key lưu nguyên UTF-8 nếu ≤ KEY_BYTES)."""
+        return self._keys[slot, :int(self._klen[slot])].tobytes().decode("utf-8", "replace")
+
+    def get(self, patient: str) -> Optional[dict]:
+        s = self.slot_of(patient)
+        return None if s is None else self.read_slot(s, patient)
+
+    @property
+    def writes(self) -> int:
+        return int(self._writes[0])
+
+    def stats(self) -> dict:
+        h = self._header[0]
+        return {"shared": self.shared, "name": self.name, "capacity": self.capacity, "patients": int(h["used"]),
+                "writes": int(h["writes"]), "rejected_full": int(h["full"]), "row_bytes": ROW.itemsize,
+                "memory_kb": round(self.nbytes / 1024, 1)}
+
+
+def _row_dict(patient: str, row: tuple) -> dict:
+    """Dòng ROW (tuple) → dict giống payload vital (ts ISO 8601 UTC)."""
+    out = {"patient": patient, "ts": datetime.fromtimestamp(row[0] / 1_000_000, timezone.utc).isoformat()}
+    for f, x in zip(VALUE_FIELDS, row[1:6]):
+        out[f] = None if x == MISSING else int(x)
+    out["mode"] = row[6].decode("utf-8", "replace") or None
+    out["source"] = row[7].decode("utf-8", "replace") or None
+    return out
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:      # process của user khác vẫn là process sống
+        return True
+    return True
+
+
+def _same_file(fd: int, path: str) -> bool:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    own = os.fstat(fd)
+    return (own.st_dev, own.st_ino) == (st.st_dev, st.st_ino)
+
+
+class _WriteLock:
+    """
+    threading.Lock của bảng, rồi flock độc quyền trên fd (None = bảng cục bộ: chỉ cần khoá giữa thread).
+    flock không loại trừ 2 thread dùng chung 1 fd nên khoá thread luôn phải lấy trước.
+    """
+
+    def __init__(self, lock: threading.Lock, fd: Optional[int]):
+        self.lock = lock
+        self.fd = fd
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.fd is not None:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            except BaseException:
+                self.lock.release()
+                raise
+
+    def __exit__(self, *exc):
+        try:
+            if self.fd is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.lock.release()
+
+
+class LatestWatcher:
+    """
+    Mỗi interval_ms: đọc các entry log mới; entry do worker KHÁC ghi → ingest(patient, ts, data) (thống kê trượt,
+    rủi ro, WebSocket — xem iot_mqtt.ingest_remote) hoặc, khi không có ingest, chỉ publish lên hub.
+    Log bị ghi đè trước khi kịp đọc (worker quá tải): đếm `lost`, rồi bù vital mới nhất cho bệnh nhân đang có
+    WebSocket theo seq của slot (lượt ghi cục bộ được đánh dấu qua mark_local).
+    """
+
+    def __init__(self, table: LatestVitals, hub, interval_ms: float = 50.0,
+                 ingest: Optional[Callable[[str, datetime, dict], None]] = None):
+        self.table = table
+        self.hub = hub
+        self.ingest = ingest
+        self.interval_s = max(0.005, interval_ms / 1000.0)
+        self._seen: Dict[int, int] = {}
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.ingested = 0
+        self.lost = 0
+        self.polls = 0
+
+    def mark_local(self, slot: int, seq: int):
+        """Lượt ghi của chính worker này (đã publish trực tiếp) — watcher không gửi lại."""
+        self._seen[slot] = seq
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._cursor = self.table.logged
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[WARN] latest watcher: {e}")
+
+    def poll(self) -> int:
+        """→ số mẫu của worker khác đã xử lý ở lượt này."""
+        if self.table.logged == self._cursor:
+            return 0
+        entries, self._cursor, lost = self.table.read_log(self._cursor)
+        self.polls += 1
+        n = 0
+        for e in entries[entries["origin"] != self.table.pid]:
+            patient = self.table.patient_of(int(e["slot"]))
+            row = e["row"].item()
+            data = _row_dict(patient, row)
+            if self.ingest is not None:
+                self.ingest(patient, datetime.fromtimestamp(row[0] / 1_000_000, timezone.utc), data)
+            else:
+                self.hub.publish(patient, data)
+            n += 1
+        self.ingested += n
+        if lost:
+            self.lost += lost
+            self._catch_up()
+        return n
+
+    def _catch_up(self) -> int:
+        """Sau khi mất entry log: gửi vital mới nhất (nếu seq đã đổi) cho mọi bệnh nhân đang có người xem."""
+        n = 0
+        for patient in self.hub.topics():
+            slot = self.table.slot_of(patient)
+            if slot is None:
+                continue
+            seq = self.table.seq(slot)
+            if seq & 1 or self._seen.get(slot) == seq:
+                continue
+            data = self.table.read_slot(slot, patient)
+            if data is None:
+                continue
+            self._seen[slot] = seq
+            self.hub.publish(patient, data)
+            n += 1
+        self.published += n
+        return n
+
+    def stats(self) -> dict:
+        return {"running": self._task is not None and not self._task.done(), "polls": self.polls,
+                "ingested": self.ingested, "lost": self.lost, "published": self.published,
+                "interval_ms": self.interval_s * 1000.0}
+
+
+def instance_name(base: str, instance: str = "") -> str:
+    """Tên block cho 1 lượt chạy: base_<instance>; instance rỗng = pid master (cha chung của các worker uvicorn)."""
+    return f"{base}_{instance or os.getppid()}"
+
+
+def sweep_stale(base: str) -> int:
+    """Xoá block base_<pid> (và file khoá) của master đã chết mà không kịp dọn (kill -9, OOM). Chỉ Linux (/dev/shm)."""
+    n = 0
+    for path in glob.glob(os.path.join("/dev/shm", glob.escape(base) + "_*")):
+        name = os.path.basename(path)
+        suffix = name[len(base) + 1:]
+        if not suffix.isdigit() or _alive(int(suffix)):
+            continue
+        for stale in [path] + glob.glob(os.path.join(tempfile.gettempdir(), glob.escape(name) + ".*lock")):
+            try:
+                os.remove(stale)
+                n += stale == path
+            except OSError:
+                pass
+    return n
+
+
+def open_latest(capacity: int, base: Optional[str], instance: str = "") -> LatestVitals:
+    """
+    Bảng shared memory của lượt chạy này (instance_name); không mở được (Windows, không có /dev/shm) → bảng cục bộ
+    + cảnh báo. base rỗng/None → bảng cục bộ.
+    """
+    if base:
+        try:
+            sweep_stale(base)
+            return LatestVitals(capacity, instance_name(base, instance))
+        except (RuntimeError, OSError, ValueError) as e:
+            print(f"[WARN] shared latest-vitals table unavailable ({e}), using per-process table")
+    return LatestVitals(capacity)
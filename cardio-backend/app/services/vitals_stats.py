@@ -0,0 +1,210 @@
+# app/services/vitals_stats.py
+# Thống kê trượt theo từng bệnh nhân, cập nhật O(1) mỗi mẫu, bộ nhớ cố định:
+# thời gian chia thành block block_s giây; mỗi bệnh nhân có 1 vòng (ring) n_blocks block trong các mảng
+# NumPy cấp phát sẵn (max_patients, n_blocks, n_fields), mỗi block giữ tổng đủ để gộp lại
+# (n, Σv, Σv², Σt, Σt², Σtv, min, max). Cửa sổ 1/5/15 phút = gộp vài block cuối → mean, var, min/max,
+# slope (hồi quy tuyến tính). Từ đó tính điểm cảnh báo sớm kiểu NEWS2 trên hr/spo2/sbp/rr.
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Sequence
+import numpy as np
+
+FIELDS = ("hr", "spo2", "sbp", "dbp", "rr")
+WINDOWS = {"1m": 60, "5m": 300, "15m": 900}
+
+
+class RollingVitals:
+    def __init__(self, max_patients: int = 2048, block_s: int = 15, windows: Dict[str, int] = WINDOWS):
+        """
+        Cửa sổ w giây = block hiện tại (đang đầy dần) + các block trước đó, tổng cộng w / block_s block
+        → độ phân giải thời gian của cửa sổ là block_s. Hết chỗ → bỏ bệnh nhân lâu nhất không có mẫu.
+        """
+        self.block_s = int(block_s)
+        self.windows = {k: max(1, int(w) // self.block_s) for k, w in windows.items()}
+        self.n_blocks = max(self.windows.values())
+        self.max_patients = int(max_patients)
+        shape = (self.max_patients, self.n_blocks, len(FIELDS))
+        self._n = np.zeros(shape, dtype=np.float32)
+        self._s = np.zeros(shape)
+        self._ss = np.zeros(shape)
+        self._st = np.zeros(shape)        # t tính từ đầu block (0..block_s) → các tổng nhỏ, không mất chính xác
+        self._stt = np.zeros(shape)
+        self._stv = np.zeros(shape)
+        self._min = np.full(shape, np.inf, dtype=np.float32)
+        self._max = np.full(shape, -np.inf, dtype=np.float32)
+        self._block = np.full(shape[:2], -1, dtype=np.int64)   # số block tuyệt đối đang nằm ở slot ring
+        self._last_t = np.full(self.max_patients, -np.inf)      # ts mẫu mới nhất (giây epoch)
+        self._samples = np.zeros(self.max_patients, dtype=np.int64)
+        self._slot: Dict[str, int] = {}
+        self._names: list = [None] * self.max_patients
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.too_old = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self._n, self._s, self._ss, self._st, self._stt, self._stv,
+                                      self._min, self._max, self._block, self._last_t, self._samples))
+
+    def _slot_for(self, patient: str) -> int:
+        p = self._slot.get(patient)
+        if p is not None:
+            return p
+        if len(self._slot) < self.max_patients:
+            p = len(self._slot)
+        else:
+            p = int(np.argmin(self._last_t))   # O(max_patients), chỉ khi phải đuổi
+            del self._slot[self._names[p]]
+            self.evicted += 1
+        self._slot[patient] = p
+        self._names[p] = patient
+        self._block[p] = -1
+        self._last_t[p] = -np.inf
+        self._samples[p] = 0
+        return p
+
+    def add(self, patient: str, ts: datetime, values: Sequence[Optional[float]]) -> bool:
+        """1 mẫu (giá trị theo FIELDS, None = thiếu). False nếu mẫu cũ hơn cửa sổ dài nhất."""
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        t = ts.timestamp()
+        B = int(t // self.block_s)
+        tb = t - B * self.block_s
+        v = np.array([np.nan if x is None else x for x in values], dtype=float)
+        w = ~np.isnan(v)
+        v0 = np.where(w, v, 0.0)
+        with self._lock:
+            p = self._slot_for(patient)
+            j = B % self.n_blocks
+            cur = self._block[p, j]
+            if cur != B:
+                if cur > B:
+                    self.too_old += 1
+                    return False
+                # slot chứa block cũ đã trôi khỏi mọi cửa sổ → dùng lại
+                self._block[p, j] = B
+                for a in (self._n, self._s, self._ss, self._st, self._stt, self._stv):
+                    a[p, j] = 0.0
+                self._min[p, j] = np.inf
+                self._max[p, j] = -np.inf
+            self._n[p, j] += w
+            self._s[p, j] += v0
+            self._ss[p, j] += v0 * v0
+            self._st[p, j] += w * tb
+            self._stt[p, j] += w * (tb * tb)
+            self._stv[p, j] += v0 * tb
+            np.fmin(self._min[p, j], v, out=self._min[p, j])   # fmin/fmax bỏ qua NaN
+            np.fmax(self._max[p, j], v, out=self._max[p, j])
+            self._samples[p] += 1
+            if t > self._last_t[p]:
+                self._last_t[p] = t
+        return True
+
+    def _window(self, p: int, k: int, Bc: int) -> Dict[str, dict]:
+        blocks = np.arange(Bc - k + 1, Bc + 1)
+        j = blocks % self.n_blocks
+        valid = self._block[p, j] == blocks
+        j = j[valid]
+        off = ((blocks[valid] - blocks[0]) * self.block_s).astype(float)[:, None]   # đầu block so với đầu cửa sổ
+        n = self._n[p, j].astype(float)
+        S, st = self._s[p, j], self._st[p, j]
+        N = n.sum(0)
+        Sv = S.sum(0)
+        SS = self._ss[p, j].sum(0)
+        ST = (off * n + st).sum(0)
+        STT = (off * off * n + 2 * off * st + self._stt[p, j]).sum(0)
+        STV = (off * S + self._stv[p, j]).sum(0)
+        mn = self._min[p, j].min(0) if len(j) else np.full(len(FIELDS), np.inf)
+        mx = self._max[p, j].max(0) if len(j) else np.full(len(FIELDS), -np.inf)
+        out = {}
+        for i, f in enumerate(FIELDS):
+            c = N[i]
+            if c == 0:
+                out[f] = {"n": 0, "mean": None, "var": None, "min": None, "max": None, "slope_per_min": None}
+                continue
+            mean = Sv[i] / c
+            var = max(0.0, (SS[i] - Sv[i] * mean) / (c - 1)) if c > 1 else 0.0
+            den = c * STT[i] - ST[i] ** 2
+            slope = (c * STV[i] - ST[i] * Sv[i]) / den * 60.0 if c > 1 and den > 1e-9 else None
+            out[f] = {"n": int(c), "mean": round(float(mean), 2), "var": round(float(var), 3),
+                      "min": float(mn[i]), "max": float(mx[i]),
+                      "slope_per_min": None if slope is None else round(float(slope), 3)}
+        return out
+
+    def means(self, patient: str, window: str, fields: Sequence[str]) -> Optional[list]:
+        """Chỉ mean của vài field trong 1 cửa sổ (rẻ hơn summary); None nếu chưa có mẫu, từng field None nếu thiếu."""
+        idx = [FIELDS.index(f) for f in fields]
+        k = self.windows[window]
+        with self._lock:
+            p = self._slot.get(patient)
+            if p is None or not np.isfinite(self._last_t[p]):
+                return None
+            Bc = int(self._last_t[p] // self.block_s)
+            blocks = np.arange(Bc - k + 1, Bc + 1)
+            j = blocks % self.n_blocks
+            j = j[self._block[p, j] == blocks]
+            n = self._n[p, j][:, idx].sum(0)
+            s = self._s[p, j][:, idx].sum(0)
+        return [float(s[i] / n[i]) if n[i] else None for i in range(len(idx))]
+
+    def summary(self, patient: str) -> Optional[dict]:
+        """Thống kê các cửa sổ (tính tới block của mẫu mới nhất) + điểm cảnh báo sớm; None nếu chưa có mẫu."""
+        with self._lock:
+            p = self._slot.get(patient)
+            if p is None or not np.isfinite(self._last_t[p]):
+                return None
+            last_t = float(self._last_t[p])
+            Bc = int(last_t // self.block_s)
+            windows = {name: self._window(p, k, Bc) for name, k in self.windows.items()}
+            samples = int(self._samples[p])
+        basis = min(self.windows, key=self.windows.get)
+        return {
+            "patient": patient,
+            "last_ts": datetime.fromtimestamp(last_t, timezone.utc).isoformat(),
+            "samples": samples,
+            "block_s": self.block_s,
+            "windows": windows,
+            "ews": early_warning_score({f: windows[basis][f]["mean"] for f in FIELDS}, basis=basis),
+        }
+
+    def stats(self) -> dict:
+        return {"patients": len(self._slot), "max_patients": self.max_patients, "block_s": self.block_s,
+                "windows": {k: k_ * self.block_s for k, k_ in self.windows.items()},
+                "memory_mb": round(self.nbytes / 2**20, 1), "evicted": self.evicted, "too_old": self.too_old}
+
+
+# ---- điểm cảnh báo sớm (theo các ngưỡng NEWS2, thang SpO2 1) ----
+# (cận trên của khoảng, điểm) theo thứ tự tăng dần; giá trị > mọi cận dùng điểm cuối
+_BANDS = {
+    "rr":   [(8, 3), (11, 1), (20, 0), (24, 2), (float("inf"), 3)],
+    "spo2": [(91, 3), (93, 2), (95, 1), (float("inf"), 0)],
+    "sbp":  [(90, 3), (100, 2), (110, 1), (219, 0), (float("inf"), 3)],
+    "hr":   [(40, 3), (50, 1), (90, 0), (110, 1), (130, 2), (float("inf"), 3)],
+}
+
+
+def _band(field: str, value: float) -> int:
+    v = round(value)
+    for upper, pts in _BANDS[field]:
+        if v <= upper:
+            return pts
+    return _BANDS[field][-1][1]
+
+
+def early_warning_score(values: Dict[str, Optional[float]], basis: str = "1m") -> dict:
+    """
+    Điểm NEWS2 rút gọn trên hr/spo2/sbp/rr (không có nhiệt độ, ý thức, thở oxy).
+    risk: high (>= 7), medium (5-6), low-medium (1 chỉ số = 3 điểm), low. Thiếu chỉ số → không tính điểm phần đó.
+    """
+    parts = {f: _band(f, values[f]) for f in _BANDS if values.get(f) is not None}
+    score = sum(parts.values())
+    if score >= 7:
+        risk = "high"
+    elif score >= 5:
+        risk = "medium"
+    elif any(p == 3 for p in parts.values()):
+        risk = "low-medium"
+    else:
+        risk = "low"
+    return {"score": score, "risk": risk, "parts": parts,
+            "missing": [f for f in _BANDS if f not in parts], "basis": f"{basis} mean"}
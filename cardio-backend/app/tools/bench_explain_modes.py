@@ -0,0 +1,66 @@
+# tools/bench_explain_modes.py
+# Engine giải thích của /ml/explain_*: shap.TreeExplainer vs contribution gốc của booster xgboost
+# (pred_contribs exact / approx). 2 phần:
+# 1) kiểm tra nhất quán: exact khớp shap (dung sai --atol), mọi mode thoả tính cộng
+#    (base_value + tổng đóng góp = margin của model); sai → exit code 1
+# 2) throughput (dòng/s) theo kích thước batch
+# Chạy từ thư mục cardio-backend:  python -m app.tools.bench_explain_modes --sizes 1,64,1000,10000
+import argparse, time
+import numpy as np
+
+from app.routers import ml
+from app.services import ml_native
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--sizes", default="1,64,1000,10000", help="kích thước batch, cách nhau bởi dấu phẩy")
+ap.add_argument("--min-seconds", type=float, default=1.0, help="thời gian đo tối thiểu mỗi ô")
+ap.add_argument("--atol", type=float, default=1e-4)
+args = ap.parse_args()
+ml.settings.ML_SIMPLE_GRID = False
+
+try:
+    ml.load_model(engine_name="sklearn", model_format="pickle")
+except Exception as e:
+    raise SystemExit(f"Model not loaded (chạy từ thư mục cardio-backend): {e}")
+b = ml.current_bundle()
+
+def _transformed(n: int) -> np.ndarray:
+    X = ml_native.verification_sample(n)
+    return ml._infer(X, b)[2]
+
+# ---- 1) nhất quán ----
+X_trans = _transformed(2000)
+_, p1, _ = ml._infer(ml_native.verification_sample(2000), b)
+margin = np.log(p1 / (1.0 - p1))
+S_ref, base_ref = ml._explain_matrix(X_trans, b, "shap")
+ok = True
+print(f"{'mode':<8}{'max|Δ| vs shap':>16}{'mean|Δ|':>10}{'additivity':>12}{'top1 agree':>12}")
+for mode in ml.EXPLAIN_MODES:
+    S, base = ml._explain_matrix(X_trans, b, mode)
+    d = np.abs(S - S_ref)
+    add = float(np.max(np.abs(base + S.sum(1) - margin)))
+    top1 = float(np.mean(np.argmax(np.abs(S), 1) == np.argmax(np.abs(S_ref), 1)))
+    print(f"{mode:<8}{d.max():>16.2e}{d.mean():>10.2e}{add:>12.2e}{top1:>12.1%}")
+    if add > args.atol or (mode == "exact" and (d.max() > args.atol or abs(base - base_ref) > args.atol)):
+        ok = False
+
+# ---- 2) throughput ----
+sizes = [int(s) for s in args.sizes.split(",") if s]
+print(f"\n{'rows':>6}" + "".join(f"{m + ' rows/s':>16}" for m in ml.EXPLAIN_MODES))
+for n in sizes:
+    Xn = _transformed(n)
+    line = f"{n:>6}"
+    for mode in ml.EXPLAIN_MODES:
+        ml._explain_matrix(Xn, b, mode)   # warm-up
+        reps, t0 = 0, time.perf_counter()
+        while True:
+            ml._explain_matrix(Xn, b, mode)
+            reps += 1
+            dt = time.perf_counter() - t0
+            if dt >= args.min_seconds:
+                break
+        line += f"{reps * n / dt:>16,.0f}"
+    print(line)
+
+if not ok:
+    raise SystemExit("explain modes inconsistent with shap (see table above)")
@@ -0,0 +1,55 @@
+# tools/bench_imports.py
+# Đo thời gian import (cold, mỗi module 1 process mới) + RSS sau import cho từng module của app
+# và các thư viện nặng. Chạy từ thư mục cardio-backend:  python -m app.tools.bench_imports --repeat 3
+import argparse, json, os, subprocess, sys
+
+DEFAULT_MODULES = [
+    "app.main",
+    "app.routers.ml",
+    "app.routers.iot_router",
+    "app.api.auth",
+    "app.api.users",
+    "app.api.chatbot_router",
+    "app.core.database",
+    # thư viện nặng (để so sánh: app.main không được kéo theo những module này)
+    "numpy", "pandas", "sklearn", "xgboost", "shap", "google.generativeai",
+]
+HEAVY = ("pandas", "sklearn", "xgboost", "shap", "google.generativeai")
+
+# chạy trong process con: import module, in thời gian + RSS + các thư viện nặng đã bị kéo theo
+PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+import importlib; importlib.import_module(sys.argv[1])
+dt = time.perf_counter() - t0
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({"seconds": dt, "rss_mb": rss_kb / 1024.0, "heavy_loaded": heavy}))
+""" % (HEAVY,)
+
+ap = argparse.ArgumentParser()
+ap.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+ap.add_argument("--repeat", type=int, default=3, help="số lần đo mỗi module (lấy min)")
+args = ap.parse_args()
+
+env = dict(os.environ)
+# Settings bắt buộc có 2 biến này; giá trị giả là đủ vì import không kết nối DB
+env.setdefault("MONGO_URI", "mongodb://localhost:27017/bench")
+env.setdefault("JWT_SECRET", "bench")
+env.setdefault("PYTHONPATH", os.getcwd())
+
+print(f"{'module':<28} {'import (min)':>12} {'RSS':>9}  heavy deps pulled in")
+for mod in args.modules:
+    runs = []
+    for _ in range(max(1, args.repeat)):
+        r = subprocess.run([sys.executable, "-c", PROBE, mod], env=env, capture_output=True, text=True)
+        if r.returncode != 0:
+            runs = None
+            err = (r.stderr.strip().splitlines() or ["?"])[-1]
+            break
+        runs.append(json.loads(r.stdout.strip().splitlines()[-1]))
+    if not runs:
+        print(f"{mod:<28} {'FAILED':>12}            {err}")
+        continue
+    best = min(runs, key=lambda x: x["seconds"])
+    print(f"{mod:<28} {best['seconds'] * 1000:>10.0f}ms {best['rss_mb']:>7.0f}MB  {', '.join(best['heavy_loaded']) or '-'}")
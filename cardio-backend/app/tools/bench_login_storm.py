@@ -0,0 +1,63 @@
+# tools/bench_login_storm.py
+# Độ trễ event loop khi có "bão login": 1 task đo tick mỗi --tick-ms (trễ = thời gian thực - dự kiến)
+# trong lúc --n lần verify bcrypt chạy đồng thời. So sánh verify ngay trong coroutine (đường cũ)
+# với verify_password_async (pool bcrypt riêng + giới hạn đồng thời).
+# Chạy từ thư mục cardio-backend:  python -m app.tools.bench_login_storm --n 40 --rounds 10
+import argparse, asyncio, time
+import numpy as np
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--n", type=int, default=40, help="số login đồng thời")
+ap.add_argument("--rounds", type=int, default=None, help="bcrypt cost (mặc định BCRYPT_ROUNDS)")
+ap.add_argument("--tick-ms", type=float, default=5.0)
+args = ap.parse_args()
+
+from app.core import security
+from app.core.config import settings
+if args.rounds is not None:
+    security.pwd_context.update(bcrypt__default_rounds=args.rounds, bcrypt__min_rounds=args.rounds,
+                                bcrypt__max_rounds=args.rounds)
+settings.BCRYPT_MAX_PENDING = max(settings.BCRYPT_MAX_PENDING, args.n)
+HASHED = security.hash_password("correct horse")
+
+async def _lag_sampler(stop: asyncio.Event, out: list):
+    tick = args.tick_ms / 1000.0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(tick)
+        out.append((time.perf_counter() - t0 - tick) * 1000.0)
+
+async def _inline_login():
+    await asyncio.sleep(0)
+    return security.verify_password("correct horse", HASHED)
+
+async def _offload_login():
+    ok, _ = await security.verify_password_async("correct horse", HASHED)
+    return ok
+
+async def _storm(login) -> dict:
+    lags, stop = [], asyncio.Event()
+    sampler = asyncio.create_task(_lag_sampler(stop, lags))
+    await asyncio.sleep(0.2)                     # mốc lag khi rảnh
+    idle = len(lags)
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(args.n)))
+    wall = time.perf_counter() - t0
+    stop.set()
+    await sampler
+    busy = np.array(lags[idle:] or [0.0])
+    assert all(results)
+    return {"wall_s": wall, "logins_per_s": args.n / wall, "lag_p50_ms": float(np.percentile(busy, 50)),
+            "lag_p99_ms": float(np.percentile(busy, 99)), "lag_max_ms": float(busy.max()),
+            "idle_lag_p99_ms": float(np.percentile(lags[:idle] or [0.0], 99))}
+
+async def main():
+    rounds = security.pwd_context.handler("bcrypt").default_rounds
+    print(f"bcrypt cost={rounds}  threads={settings.BCRYPT_MAX_THREADS}  logins={args.n}  tick={args.tick_ms}ms")
+    print(f"{'mode':<10}{'wall s':>8}{'login/s':>9}{'lag p50':>9}{'lag p99':>9}{'lag max':>9}{'idle p99':>10}")
+    for name, fn in (("inline", _inline_login), ("offload", _offload_login)):
+        r = await _storm(fn)
+        print(f"{name:<10}{r['wall_s']:>8.2f}{r['logins_per_s']:>9.1f}{r['lag_p50_ms']:>9.1f}"
+              f"{r['lag_p99_ms']:>9.1f}{r['lag_max_ms']:>9.1f}{r['idle_lag_p99_ms']:>10.1f}")
+
+asyncio.run(main())
@@ -0,0 +1,81 @@
+# tools/bench_ml_latency.py
+# So sánh latency p50/p99 từng endpoint /ml: đường cũ (predict + predict_proba [+ pre.transform])
+# với inference core dùng chung (_infer: 1 lần preprocess + 1 lần predict_proba).
+# Chạy từ thư mục cardio-backend:  python -m app.tools.bench_ml_latency --n 300
+import argparse, asyncio, time
+import numpy as np
+
+from app.routers import ml
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--n", type=int, default=300, help="số request mỗi endpoint")
+ap.add_argument("--warmup", type=int, default=20)
+ap.add_argument("--batching", action="store_true", help="bật micro-batcher (mặc định tắt: đo riêng inference core)")
+ap.add_argument("--cache", action="store_true", help="bật cache kết quả (mặc định tắt: mọi request đều chấm thật)")
+args = ap.parse_args()
+ml.settings.ML_BATCH_ENABLED = args.batching
+if not args.cache:
+    ml._pred_cache.ttl = 0.0   # entry hết hạn ngay khi ghi
+_run = asyncio.new_event_loop().run_until_complete
+
+try:
+    ml._load_active_model()
+except Exception as e:
+    raise SystemExit(f"Model not loaded (chạy từ thư mục cardio-backend): {e}")
+
+FULL = ml.CardioFullInput(age=18393, height=168, weight=62, ap_hi=110, ap_lo=80,
+                          cholesterol=1, gluc=1, smoke=0, alco=0, active=1, gender=2)
+BASIC = ml.CardioInput(age=18393, height=168, weight=62, ap_hi=110, ap_lo=80,
+                       cholesterol=1, gluc=1, smoke=0, alco=0, active=1, gender=2)
+SIMPLE = ml.SimpleInput(age=50, gender="male", cholesterol=2, bp=140)
+
+def _full_df():
+    return ml.build_feature_df(
+        age_days=FULL.age, height=FULL.height, weight=FULL.weight,
+        ap_hi=FULL.ap_hi, ap_lo=FULL.ap_lo, cholesterol=FULL.cholesterol,
+        gluc=FULL.gluc, smoke=FULL.smoke, alco=FULL.alco, active=FULL.active,
+        gender=FULL.gender,
+    )
+
+def _simple_df():
+    return ml.build_feature_df(
+        age_days=SIMPLE.age * 365.0, height=None, weight=None, ap_hi=float(SIMPLE.bp), ap_lo=None,
+        cholesterol=float(SIMPLE.cholesterol), gluc=None, smoke=None, alco=None, active=None,
+        gender=2.0,
+    )
+
+# --- đường cũ: tái hiện đúng các lời gọi trước khi có _infer ---
+def legacy_predict(X_df):
+    m = ml.current_bundle().model
+    y = m.predict(X_df)
+    p = m.predict_proba(X_df)
+    return int(y[0]), float(p[0, 1])
+
+def legacy_explain(X_df):
+    b = ml.current_bundle()
+    X_trans = b.model.named_steps["pre"].transform(X_df)
+    legacy_predict(X_df)
+    return b.explainer.shap_values(X_trans)
+
+CASES = [
+    ("/predict",       lambda: legacy_predict(_full_df()),   lambda: _run(ml.predict(BASIC))),
+    ("/predict_full",  lambda: legacy_predict(_full_df()),   lambda: _run(ml.predict_full(FULL))),
+    ("/predict_simple",lambda: legacy_predict(_simple_df()), lambda: _run(ml.predict_simple(SIMPLE))),
+    ("/explain_full",  lambda: legacy_explain(_full_df()),   lambda: ml.explain_full(FULL)),
+]
+
+def measure(fn, n, warmup):
+    for _ in range(warmup):
+        fn()
+    out = np.empty(n)
+    for i in range(n):
+        t0 = time.perf_counter()
+        fn()
+        out[i] = (time.perf_counter() - t0) * 1000.0
+    return np.percentile(out, 50), np.percentile(out, 99)
+
+print(f"{'endpoint':<16} {'legacy p50':>11} {'legacy p99':>11} {'core p50':>9} {'core p99':>9} {'p50 drop':>9}")
+for name, legacy, core in CASES:
+    l50, l99 = measure(legacy, args.n, args.warmup)
+    c50, c99 = measure(core, args.n, args.warmup)
+    print(f"{name:<16} {l50:>9.2f}ms {l99:>9.2f}ms {c50:>7.2f}ms {c99:>7.2f}ms {100*(1-c50/l50):>8.1f}%")
@@ -0,0 +1,105 @@
+# tools/bench_ml_pool.py
+# Latency của route không phải ML (1 handler sync nhẹ, chạy cùng threadpool như /iot, /auth) trong lúc
+# --jobs client gọi /ml/explain_batch (--rows dòng) liên tục: explain trong threadpool (đường cũ, giữ GIL)
+# vs trong process pool ML_POOL_WORKERS process (services/ml_pool.py).
+# Chạy từ thư mục cardio-backend:  python -m app.tools.bench_ml_pool --workers 2 --jobs 4 --rows 200
+# (worker "spawn" import lại module __main__ → mọi thứ nằm trong main())
+import argparse, asyncio, time
+import numpy as np
+
+
+def _parse():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=2, help="số process của pool")
+    ap.add_argument("--jobs", type=int, default=4, help="số client explain đồng thời")
+    ap.add_argument("--rows", type=int, default=200, help="số dòng mỗi request explain_batch")
+    ap.add_argument("--seconds", type=float, default=10.0, help="thời gian đo mỗi chế độ")
+    ap.add_argument("--tick-ms", type=float, default=10.0, help="chu kỳ gọi route nhẹ")
+    return ap.parse_args()
+
+
+async def _measure(client, args, rows) -> dict:
+    stop = asyncio.Event()
+    done = [0]
+
+    async def _explain():
+        while not stop.is_set():
+            r = await client.post("/ml/explain_batch", json={"rows": rows})
+            assert r.status_code == 200, r.text
+            done[0] += 1
+
+    async def _ping(out: list, until: float):
+        while time.perf_counter() < until:
+            t0 = time.perf_counter()
+            r = await client.get("/ping")
+            assert r.status_code == 200
+            out.append((time.perf_counter() - t0) * 1000.0)
+            await asyncio.sleep(args.tick_ms / 1000.0)
+
+    idle: list = []
+    await _ping(idle, time.perf_counter() + 1.0)
+    busy: list = []
+    jobs = [asyncio.create_task(_explain()) for _ in range(args.jobs)]
+    t0 = time.perf_counter()
+    await _ping(busy, t0 + args.seconds)
+    stop.set()
+    await asyncio.gather(*jobs)
+    wall = time.perf_counter() - t0
+    busy_a = np.array(busy)
+    return {"explain_rps": done[0] / wall, "rows_per_s": done[0] * args.rows / wall,
+            "idle_p50": float(np.percentile(idle, 50)), "p50": float(np.percentile(busy_a, 50)),
+            "p99": float(np.percentile(busy_a, 99)), "max": float(busy_a.max())}
+
+
+async def _run(args):
+    import httpx
+    from fastapi import FastAPI
+    from app.routers import ml
+
+    ml.settings.ML_SIMPLE_GRID = False
+    ml._pred_cache.ttl = 0.0
+    try:
+        ml._load_active_model()
+    except Exception as e:
+        raise SystemExit(f"Model not loaded (chạy từ thư mục cardio-backend): {e}")
+    b = ml.current_bundle()
+
+    app = FastAPI()
+    app.include_router(ml.router)
+
+    @app.get("/ping")
+    def ping():
+        return {"ok": True, "t": time.time()}
+
+    rng = np.random.default_rng(0)
+    rows = [{"age": int(rng.integers(30, 65)) * 365, "height": float(rng.normal(168, 8)),
+             "weight": float(rng.normal(74, 12)), "ap_hi": float(rng.integers(100, 180)),
+             "ap_lo": float(rng.integers(60, 110)), "cholesterol": int(rng.integers(1, 4)),
+             "gluc": int(rng.integers(1, 4)), "smoke": int(rng.integers(0, 2)), "alco": int(rng.integers(0, 2)),
+             "active": int(rng.integers(0, 2)), "gender": int(rng.integers(1, 3))} for _ in range(args.rows)]
+
+    print(f"workers={args.workers}  explain jobs={args.jobs}  rows/request={args.rows}  {args.seconds:g}s/mode")
+    print(f"{'mode':<12}{'explain/s':>10}{'rows/s':>9}{'idle p50':>10}{'ping p50':>10}{'ping p99':>10}{'ping max':>10}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        for mode in ("threadpool", "process"):
+            if mode == "process":
+                ml.pool.workers = args.workers
+                ml.pool.start(b)
+                while ml.pool.ready < args.workers:
+                    if ml.pool.error:
+                        raise SystemExit(ml.pool.error)
+                    await asyncio.sleep(0.1)
+            r = await _measure(client, args, rows)
+            print(f"{mode:<12}{r['explain_rps']:>10.1f}{r['rows_per_s']:>9.0f}{r['idle_p50']:>10.2f}"
+                  f"{r['p50']:>10.2f}{r['p99']:>10.2f}{r['max']:>10.1f}")
+    print("pool:", ml.pool.stats())
+    ml.pool.stop()
+
+
+def main():
+    asyncio.run(_run(_parse()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# tools/bench_vitals_archive.py
+# So sánh lưu trữ + quét 1 tháng vitals 1 Hz của 1 bệnh nhân: document BSON thô (như collection vitals)
+# với VitalChunk dạng cột (services/vitals_archive.py). Không cần mongod: đo kích thước BSON đã encode
+# và thời gian decode (phần việc của driver) + tính min/mean/max theo giờ.
+# Chạy từ thư mục cardio-backend:  python -m app.tools.bench_vitals_archive --days 30
+import argparse, time
+from datetime import datetime, timedelta
+import bson
+import numpy as np
+from bson import ObjectId
+
+from app.services import vitals_archive as va
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--days", type=int, default=30)
+ap.add_argument("--hz", type=float, default=1.0)
+args = ap.parse_args()
+
+rng = np.random.default_rng(0)
+T0 = datetime(2024, 1, 1)
+FIELDS = list(va.COLUMNS)
+
+def day_docs(d: int):
+    n = int(86400 * args.hz)
+    step = 1000.0 / args.hz
+    hr = rng.integers(60, 110, n); spo2 = rng.integers(93, 100, n); sbp = rng.integers(105, 150, n)
+    dbp = rng.integers(65, 95, n); rr = rng.integers(12, 22, n)
+    base = T0 + timedelta(days=d)
+    return [{"_id": ObjectId(), "patient": "P001", "ts": base + timedelta(milliseconds=i * step),
+             "hr": int(hr[i]), "spo2": int(spo2[i]), "sbp": int(sbp[i]), "dbp": int(dbp[i]), "rr": int(rr[i]),
+             "mode": "normal", "source": "sim", "revision_id": None} for i in range(n)]
+
+raw_bytes, chunk_bytes, raw_blobs, chunk_blobs, n_docs = 0, 0, [], [], 0
+for d in range(args.days):
+    docs = day_docs(d)
+    n_docs += len(docs)
+    blob = b"".join(bson.encode(x) for x in docs)
+    raw_bytes += len(blob); raw_blobs.append(blob)
+    chunk = va.encode_chunk("P001", T0 + timedelta(days=d), va.docs_to_columns(docs))
+    cb = bson.encode(chunk)
+    chunk_bytes += len(cb); chunk_blobs.append(cb)
+
+# quét raw: decode BSON (driver) -> cột -> bucket 1 giờ
+t = time.perf_counter()
+cols_raw = va.docs_to_columns([x for b in raw_blobs for x in bson.decode_all(b)])
+rows_raw = va.bucket_stats(cols_raw, 3600, FIELDS)
+t_raw = time.perf_counter() - t
+# quét archive: decode chunk -> giải nén cột -> bucket 1 giờ
+t = time.perf_counter()
+parts = [va.decode_chunk(bson.decode(b), FIELDS) for b in chunk_blobs]
+cols_arc = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+rows_arc = va.bucket_stats(cols_arc, 3600, FIELDS)
+t_arc = time.perf_counter() - t
+assert rows_raw == rows_arc, "archive scan differs from raw scan"
+
+print(f"{n_docs:,} vitals over {args.days} days ({len(rows_arc)} hourly buckets, results identical)")
+print(f"{'':<10} {'storage':>12} {'scan':>10}")
+print(f"{'raw BSON':<10} {raw_bytes / 2**20:>10.1f}MB {t_raw:>9.2f}s")
+print(f"{'chunks':<10} {chunk_bytes / 2**20:>10.2f}MB {t_arc:>9.2f}s")
+print(f"{'ratio':<10} {raw_bytes / chunk_bytes:>11.0f}x {t_raw / t_arc:>9.0f}x")
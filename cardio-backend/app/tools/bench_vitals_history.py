@@ -0,0 +1,80 @@
+# tools/bench_vitals_history.py
+# Seed vitals 1 Hz cho 1 bệnh nhân với lịch sử tăng dần (+ bệnh nhân "nhiễu") vào mongod local,
+# đo p50/p99 của các truy vấn /iot/history (trang đầu, trang keyset sâu, khoảng ts) ở từng kích thước,
+# so index ghép (patient, ts) với 2 index đơn patient / ts kiểu cũ.
+# Chạy từ thư mục cardio-backend:  python -m app.tools.bench_vitals_history --uri mongodb://localhost:27017/bench
+import argparse, random, time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from pymongo import ASCENDING, MongoClient
+
+from app.models.vital_model import Vital
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--uri", default="mongodb://localhost:27017/cardio_bench")
+ap.add_argument("--sizes", default="10000,100000,1000000", help="số vital của bệnh nhân đo, tăng dần")
+ap.add_argument("--noise", type=int, default=5, help="số bệnh nhân khác có cùng lượng lịch sử")
+ap.add_argument("--n", type=int, default=200, help="số truy vấn mỗi loại")
+ap.add_argument("--limit", type=int, default=500)
+args = ap.parse_args()
+
+client = MongoClient(args.uri)
+coll = client.get_default_database()["vitals_bench"]
+PROJ = {"patient": 1, "ts": 1, "hr": 1, "spo2": 1, "sbp": 1, "dbp": 1, "rr": 1, "mode": 1, "source": 1}
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def seed(patient: str, start: int, stop: int):
+    rnd = random.Random(patient)
+    batch = []
+    for i in range(start, stop):
+        batch.append({"patient": patient, "ts": T0 + timedelta(seconds=i), "hr": rnd.randint(60, 100),
+                      "spo2": rnd.randint(94, 99), "sbp": rnd.randint(110, 140), "dbp": rnd.randint(70, 90),
+                      "rr": rnd.randint(12, 20), "mode": "normal", "source": "bench"})
+        if len(batch) == 10_000:
+            coll.insert_many(batch, ordered=False); batch = []
+    if batch:
+        coll.insert_many(batch, ordered=False)
+
+def use_indexes(kind: str):
+    coll.drop_indexes()
+    if kind == "compound":
+        for idx in Vital.Settings.indexes:
+            coll.create_indexes([idx])
+    else:
+        coll.create_index([("patient", ASCENDING)])
+        coll.create_index([("ts", ASCENDING)])
+
+def measure(fn):
+    out = np.empty(args.n)
+    for i in range(args.n):
+        t = time.perf_counter(); fn(); out[i] = (time.perf_counter() - t) * 1000.0
+    return np.percentile(out, 50), np.percentile(out, 99)
+
+def queries(size: int):
+    mid = T0 + timedelta(seconds=size // 2)
+    first = lambda: list(coll.find({"patient": "P"}, PROJ).sort("ts", -1).limit(args.limit))
+    deep = lambda: list(coll.find({"patient": "P", "ts": {"$lt": mid}}, PROJ).sort("ts", -1).limit(args.limit))
+    rng = lambda: list(coll.find({"patient": "P", "ts": {"$gte": mid, "$lte": mid + timedelta(hours=1)}},
+                                 PROJ).sort("ts", -1).limit(args.limit))
+    return {"first page": first, "keyset page @50%": deep, "1h range": rng}
+
+def docs_examined(size: int) -> int:
+    mid = T0 + timedelta(seconds=size // 2)
+    plan = coll.find({"patient": "P", "ts": {"$lt": mid}}, PROJ).sort("ts", -1).limit(args.limit).explain()
+    return plan["executionStats"]["totalDocsExamined"]
+
+coll.drop()
+sizes = sorted(int(s) for s in args.sizes.split(","))
+print(f"{'size':>9} {'index':<9} {'query':<18} {'p50':>8} {'p99':>8} {'docs examined (keyset)':>24}")
+done = 0
+for size in sizes:
+    for p in ["P"] + [f"N{k}" for k in range(args.noise)]:
+        seed(p, done, size)
+    done = size
+    for kind in ("single", "compound"):
+        use_indexes(kind)
+        examined = docs_examined(size)
+        for name, fn in queries(size).items():
+            p50, p99 = measure(fn)
+            print(f"{size:>9} {kind:<9} {name:<18} {p50:>6.2f}ms {p99:>6.2f}ms {examined:>24}")
+coll.drop()
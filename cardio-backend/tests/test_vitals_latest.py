@@ -0,0 +1,100 @@
+# tests/test_vitals_latest.py
+# put() đồng thời từ nhiều thread (thread MQTT + event loop trong 1 worker): mỗi bệnh nhân đúng 1 slot,
+# mỗi slot đúng 1 bệnh nhân — cả bảng cục bộ lẫn bảng shared memory; watcher nhận đủ mẫu của worker khác.
+# Chạy từ thư mục cardio-backend:  python -m pytest -q tests/test_vitals_latest.py
+import os, tempfile, threading, uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from app.schemas.vital_schema import VitalIn
+from app.services.vitals_latest import LatestVitals, LatestWatcher, fcntl
+
+THREADS = 4
+PER_THREAD = 2000
+
+
+@pytest.fixture(params=["local", "shm"])
+def table(request):
+    if request.param == "local":
+        yield LatestVitals(THREADS * PER_THREAD)
+        return
+    if fcntl is None:
+        pytest.skip("shared table needs fcntl")
+    t = LatestVitals(THREADS * PER_THREAD, f"cardio_latest_test_{uuid.uuid4().hex[:8]}")
+    yield t
+    t.close()
+    assert not os.path.exists(os.path.join(tempfile.gettempdir(), f"{t.name}.lock"))
+
+
+def test_concurrent_put_keeps_slots_one_to_one(table):
+    ts = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    start = threading.Barrier(THREADS)
+    slots = {}
+
+    def worker(k):
+        start.wait()
+        for i in range(PER_THREAD):
+            patient = f"t{k}-p{i}"
+            out = table.put(VitalIn(patient=patient, ts=ts, hr=40 + (i % 150)))
+            assert out is not None
+            slots[patient] = out[0]
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(THREADS)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    assert len(slots) == THREADS * PER_THREAD
+    assert len(set(slots.values())) == len(slots)                  # không 2 bệnh nhân chung 1 slot
+    assert table.stats()["patients"] == len(slots)
+    fresh = LatestVitals.__new__(LatestVitals)                      # tra index từ đầu, không qua cache _slot
+    fresh.__dict__.update(table.__dict__, _slot={})
+    for patient, slot in slots.items():
+        assert fresh.slot_of(patient) == slot
+        i = int(patient.rsplit("p", 1)[1])
+        assert table.get(patient)["hr"] == 40 + (i % 150)
+
+
+def test_watcher_ingests_every_sample_written_by_other_worker(table):
+    # worker khác = bản attach thứ 2 của cùng block (bảng cục bộ: cùng buffer) với pid khác
+    other = LatestVitals.__new__(LatestVitals)
+    other.__dict__.update(table.__dict__, _slot={}, pid=table.pid + 1)
+    seen = []
+
+    class Hub:
+        def topics(self):
+            return []
+
+        def publish(self, patient, data):
+            raise AssertionError("ingest set: watcher must not publish directly")
+
+    watcher = LatestWatcher(table, Hub(), ingest=lambda p, ts, data: seen.append((p, ts, data["hr"])))
+    watcher._cursor = table.logged
+    t0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    table.put(VitalIn(patient="local", ts=t0, hr=50))                      # của chính worker này: bỏ qua
+    for i in range(5):                                                      # 5 mẫu giữa 2 lượt quét
+        other.put(VitalIn(patient="remote", ts=t0 + timedelta(seconds=i), hr=60 + i))
+    other.put(VitalIn(patient="remote", ts=t0, hr=99))                      # mẫu trễ: không đè latest
+    assert watcher.poll() == 6
+    assert [hr for _, _, hr in seen] == [60, 61, 62, 63, 64, 99]
+    assert {p for p, _, _ in seen} == {"remote"} and seen[0][1] == t0
+    assert table.get("remote")["hr"] == 64
+    assert watcher.poll() == 0
+
+
+def test_block_of_dead_run_is_reset_not_reused():
+    if fcntl is None:
+        pytest.skip("shared table needs fcntl")
+    import subprocess, sys
+    name = f"cardio_latest_test_{uuid.uuid4().hex[:8]}"
+    old = LatestVitals(16, name)
+    old.put(VitalIn(patient="p1", ts=datetime(2026, 1, 1, tzinfo=timezone.utc), hr=70))
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    old._pids[old._pids == old.pid] = dead.pid            # lượt chạy trước: mọi process đã chết, không close()
+    new = LatestVitals(16, name)
+    assert new.get("p1") is None
+    assert int(new._header["generation"][0]) == 2
+    new.close()
+    assert not os.path.exists(os.path.join(tempfile.gettempdir(), f"{name}.lock"))